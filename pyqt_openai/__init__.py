@@ -129,7 +129,7 @@ REPORT_ERROR_URL = (
 
 AWESOME_CHATGPT_PROMPTS_URL = "https://huggingface.co/datasets/fka/awesome-chatgpt-prompts/tree/main"
 
-COLUMN_TO_EXCLUDE_FROM_SHOW_HIDE_CHAT = ["id"]
+COLUMN_TO_EXCLUDE_FROM_SHOW_HIDE_CHAT = ["id", "is_archived"]
 COLUMN_TO_EXCLUDE_FROM_SHOW_HIDE_IMAGE = ["id", "data"]
 DEFAULT_LANGUAGE = "en_US"
 LANGUAGE_DICT = {
@@ -153,6 +153,14 @@ LANGUAGE_DICT = {
 MESSAGE_PADDING = 16
 MESSAGE_MAXIMUM_HEIGHT = 800
 MESSAGE_MAXIMUM_HEIGHT_RANGE = 300, 1000
+# Number of messages loaded at once when the thread is opened or scrolled up to the top
+MESSAGE_PAGE_SIZE = 50
+# The chunks of the streamed response are joined and shown at most once per this many ms (a frame at 60 Hz)
+# or as soon as this many characters are waiting
+STREAM_FLUSH_INTERVAL = 16
+STREAM_FLUSH_SIZE = 2048
+# Most models which the same prompt can be sent to at once to compare their responses (the fan-out mode)
+FAN_OUT_MAX_TARGETS = 6
 
 CONTEXT_DELIMITER = "\n" * 2
 PROMPT_IMAGE_SCALE = 200, 200
@@ -318,11 +326,89 @@ NOTIFIER_MAX_CHAR = 100
 # DB
 DB_NAME_REGEX = "[a-zA-Z0-9]{1,20}"
 
+## CONNECTION
+# Milliseconds to wait for a lock held by another connection before raising "database is locked"
+DB_BUSY_TIMEOUT = 5000
+# Bytes of the database file to memory-map (0 disables memory-mapped I/O)
+DB_MMAP_SIZE = 256 * 1024 * 1024
+# Page cache size per connection, negative value means KiB instead of pages (SQLite convention)
+DB_CACHE_SIZE = -64000
+# Messages are written by a background thread, committed together every interval (milliseconds)
+# or as soon as this many messages are waiting
+DB_WRITE_BEHIND_INTERVAL = 200
+DB_WRITE_BEHIND_BATCH_SIZE = 32
+# While another connection holds the write lock past the busy timeout, the writer retries after this delay
+# (milliseconds), doubled after each try up to the maximum, the messages are never dropped for it
+DB_WRITE_RETRY_DELAY = 100
+DB_WRITE_RETRY_MAX_DELAY = 5000
+
+## MAINTENANCE
+# The maintenance (incremental vacuum, ANALYZE) is due this long after startup and then every interval (milliseconds),
+# it runs once the app goes to the background
+DB_MAINTENANCE_DELAY = 2 * 60 * 1000
+DB_MAINTENANCE_INTERVAL = 60 * 60 * 1000
+# Free pages given back to the file system per step of the incremental vacuum,
+# the write lock is released between the steps
+DB_INCREMENTAL_VACUUM_PAGES = 1000
+
+## ARCHIVE
+# Threads which haven't been updated for this many days are moved into the archive database
+# by the maintenance (0 disables it), opening an archived thread moves it back
+DB_ARCHIVE_AFTER_DAYS = 0
+# Threads moved per transaction, the write lock is released between the batches
+DB_ARCHIVE_BATCH_SIZE = 20
+# The archive database is next to the main one, "<db><suffix>.db", attached to every connection under the schema name
+ARCHIVE_DB_SUFFIX = "_archive"
+ARCHIVE_SCHEMA_NAME = "archive"
+
+## SOFT DELETE
+# With "soft_delete" the deleted threads and images are only marked (deleted_dt) and can be restored,
+# the maintenance removes them for good once they have been deleted for this many minutes
+DB_PURGE_DELETED_AFTER_MINUTES = 10
+
+## BACKUP
+# Snapshots of the database are written by the SQLite backup API into "<db><suffix>" next to the db file,
+# this many pages are copied per step with a pause (milliseconds) in between, so the app keeps writing meanwhile
+DB_BACKUP_DIR_SUFFIX = "_backups"
+DB_BACKUP_PAGES_PER_STEP = 1024
+DB_BACKUP_STEP_SLEEP = 10
+# A backup is made when the newest one is older than this many hours (0 disables the scheduled backups),
+# only this many backups are kept
+DB_BACKUP_INTERVAL_HOURS = 0
+DB_BACKUP_KEEP = 5
+# How often (milliseconds) the scheduler checks whether a backup is due
+DB_BACKUP_CHECK_INTERVAL = 10 * 60 * 1000
+
+## RESPONSE CACHE
+# With "response_cache" the responses of the deterministic requests (temperature 0) are kept in the database,
+# for this many hours after they are received, the least recently used ones are evicted beyond the size (bytes)
+RESPONSE_CACHE_TTL_HOURS = 24 * 7
+RESPONSE_CACHE_MAX_SIZE = 64 * 1024 * 1024
+
+## HTTP
+# Pool of the shared HTTP clients (see util/http_client.py), the idle connections are kept open for the expiry (seconds)
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_KEEPALIVE_EXPIRY = 120
+# Seconds, the read timeout is long because the models can take a while before the first token
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 600
+
 THREAD_TABLE_NAME_OLD = "conv_tb"
 THREAD_TRIGGER_NAME_OLD = "conv_tr"
 MESSAGE_TABLE_NAME_OLD = "conv_unit_tb"
 
+# Files attached to the chat messages are stored once per content hash (SHA-256) in chat_file_tb,
+# message_file_tb links them to the messages
 CHAT_FILE_TABLE_NAME = "chat_file_tb"
+MESSAGE_FILE_TABLE_NAME = "message_file_tb"
+# The files are read and written with incremental BLOB I/O in chunks of this many bytes
+CHAT_FILE_CHUNK_SIZE = 64 * 1024
+# Files which no message refers to are removed by the maintenance once they haven't been used for this many days,
+# not right away, since the message of a new file may still be queued
+CHAT_FILE_GRACE_DAYS = 1
+# Data URLs of the attached images kept in memory, to send the history again without reading the files
+CHAT_FILE_URL_CACHE_SIZE = 16
 
 THREAD_TABLE_NAME = "thread_tb"
 THREAD_TRIGGER_NAME = "thread_tr"
@@ -330,6 +416,20 @@ MESSAGE_TABLE_NAME = "message_tb"
 
 IMAGE_TABLE_NAME = "image_tb"
 
+# Image payloads are kept in a content-addressed store (<db name>_blobs next to the db file),
+# blob_tb counts the references of image_tb to each payload
+BLOB_TABLE_NAME = "blob_tb"
+BLOB_DIR_SUFFIX = "_blobs"
+IMAGE_BLOB_INSERTED_TR_NAME = "image_blob_inserted_tr"
+IMAGE_BLOB_UPDATED_TR_NAME = "image_blob_updated_tr"
+IMAGE_BLOB_DELETED_TR_NAME = "image_blob_deleted_tr"
+
+# Downscaled copies of the images shown in the history, the full image is decoded only to zoom, copy or save
+IMAGE_THUMBNAIL_TABLE_NAME = "image_thumbnail_tb"
+IMAGE_THUMBNAIL_SIZE = 512
+IMAGE_THUMBNAIL_FORMAT = "JPG"
+IMAGE_THUMBNAIL_QUALITY = 85
+
 THREAD_MESSAGE_INSERTED_TR_NAME_OLD = "conv_tb_updated_by_unit_inserted_tr"
 THREAD_MESSAGE_UPDATED_TR_NAME_OLD = "conv_tb_updated_by_unit_updated_tr"
 THREAD_MESSAGE_DELETED_TR_NAME_OLD = "conv_tb_updated_by_unit_deleted_tr"
@@ -340,6 +440,52 @@ THREAD_MESSAGE_DELETED_TR_NAME = "thread_message_deleted_tr"
 
 THREAD_ORDERBY = "update_dt"
 
+# Aggregates of the messages of each thread (count, tokens, last message), kept up to date by the triggers on message_tb
+THREAD_STATS_TABLE_NAME = "thread_stats_tb"
+THREAD_STATS_INSERTED_TR_NAME = "thread_stats_inserted_tr"
+THREAD_STATS_UPDATED_TR_NAME = "thread_stats_updated_tr"
+THREAD_STATS_DELETED_TR_NAME = "thread_stats_deleted_tr"
+THREAD_STATS_PREVIEW_LENGTH = 100
+# Threads with their aggregates, shown in the chat list (the name is editable through the trigger)
+THREAD_LIST_VIEW_NAME = "thread_list_v"
+THREAD_LIST_UPDATED_TR_NAME = "thread_list_updated_tr"
+# Tables of the archive database, named apart from the main ones so the names resolve without the schema in triggers
+THREAD_ARCHIVE_TABLE_NAME = "thread_archive_tb"
+MESSAGE_ARCHIVE_TABLE_NAME = "message_archive_tb"
+THREAD_STATS_ARCHIVE_TABLE_NAME = "thread_stats_archive_tb"
+MESSAGE_FILE_ARCHIVE_TABLE_NAME = "message_file_archive_tb"
+# Threads of both databases with is_archived (temporary view, created on every connection)
+THREAD_ALL_VIEW_NAME = "thread_all_v"
+THREAD_ALL_UPDATED_TR_NAME = "thread_all_updated_tr"
+
+# Responses by the hash of the arguments of the request (see util/response_cache.py)
+RESPONSE_CACHE_TABLE_NAME = "response_cache_tb"
+
+# Number of tokens of each message per tokenizer, so the history is never tokenized twice
+MESSAGE_TOKEN_TABLE_NAME = "message_token_tb"
+MESSAGE_TOKEN_UPDATED_TR_NAME = "message_token_updated_tr"
+
+# Token usage per day (local time), model and provider of the messages which reported it,
+# updated along with the insert of the message (restoring an archived thread doesn't count it again)
+USAGE_DAILY_TABLE_NAME = "usage_daily_tb"
+
+# Temporary table (per connection) which holds ids for set-based statements
+TEMP_ID_TABLE_NAME = "temp_id_tb"
+
+# Full-text index over message content (FTS5, external content table of message_tb)
+MESSAGE_FTS_TABLE_NAME = "message_fts"
+MESSAGE_FTS_INSERTED_TR_NAME = "message_fts_inserted_tr"
+MESSAGE_FTS_UPDATED_TR_NAME = "message_fts_updated_tr"
+MESSAGE_FTS_DELETED_TR_NAME = "message_fts_deleted_tr"
+# The trigram tokenizer can't match anything shorter than this, LIKE is used instead
+MESSAGE_FTS_MIN_QUERY_LENGTH = 3
+MESSAGE_FTS_SNIPPET_TOKENS = 32
+
+# Message content of this many bytes or more is compressed if "db_compression" is enabled,
+# the view shows it decompressed (the FTS5 index reads the content through it)
+MESSAGE_COMPRESSION_THRESHOLD = 1024
+MESSAGE_CONTENT_VIEW_NAME = "message_content_v"
+
 PROPERTY_PROMPT_GROUP_TABLE_NAME_OLD = "prop_prompt_grp_tb"
 PROPERTY_PROMPT_UNIT_TABLE_NAME_OLD = "prop_prompt_unit_tb"
 TEMPLATE_PROMPT_GROUP_TABLE_NAME_OLD = "template_prompt_grp_tb"
@@ -895,6 +1041,9 @@ DEFAULT_API_CONFIGS = [
 DEFAULT_LLM = "gpt-4o"
 
 G4F_PROVIDER_DEFAULT = "Auto"
+# With the "Auto" provider, the request is sent to this many providers of the model at once
+# and the first one which answers is used (1 leaves the choice to g4f, one provider after another)
+G4F_RACE_PROVIDER_COUNT = 3
 
 G4F_USE_CHAT_HISTORY = True
 
@@ -904,6 +1053,21 @@ G4F_DEFAULT_IMAGE_MODEL = "flux"
 MAXIMUM_MESSAGES_IN_PARAMETER = 40
 MAXIMUM_MESSAGES_IN_PARAMETER_RANGE = 2, 1000
 
+# The history sent with the request is packed into the context window of the model (newest message first)
+# Used when the context window of the model is unknown
+HISTORY_DEFAULT_CONTEXT_WINDOW = 8192
+# Room left for the response when max_tokens is not used
+HISTORY_RESPONSE_RESERVE_TOKENS = 1024
+# Tokens of the role and the separators of each message in the chat format
+HISTORY_MESSAGE_OVERHEAD_TOKENS = 4
+# Estimate of an image (1024x1024 in high detail), the images are not tokenized
+HISTORY_IMAGE_TOKENS = 765
+# The last messages of this many recently used threads are kept in memory for the history
+HISTORY_CACHE_MAX_THREADS = 8
+# Tokenizer of the models which tiktoken doesn't know
+TOKEN_DEFAULT_ENCODING = "cl100k_base"
+TOKEN_ENCODING_CACHE_SIZE = 16
+
 # llamaIndex
 LLAMA_INDEX_DEFAULT_SUPPORTED_FORMATS_LIST = [".txt"]
 LLAMA_INDEX_DEFAULT_ALL_SUPPORTED_FORMATS_LIST = [".txt", ".docx", ".hwp", ".ipynb", ".csv", ".jpeg", ".jpg", ".mbox", ".md", ".mp3", ".mp4", ".pdf", ".png", ".ppt", ".pptx", ".pptm"]
@@ -1101,6 +1265,27 @@ CONFIG_DATA = {
         "lang": "English",
         # DB
         "db": "conv",
+        "db_busy_timeout": DB_BUSY_TIMEOUT,
+        "db_mmap_size": DB_MMAP_SIZE,
+        "db_cache_size": DB_CACHE_SIZE,
+        "db_compression": False,
+        "archive_after_days": DB_ARCHIVE_AFTER_DAYS,
+        "soft_delete": True,
+        "backup_interval_hours": DB_BACKUP_INTERVAL_HOURS,
+        "backup_keep": DB_BACKUP_KEEP,
+        "backup_compression": False,
+        "response_cache": False,
+        "response_cache_ttl_hours": RESPONSE_CACHE_TTL_HOURS,
+        "http2": True,
+        "http_prewarm": True,
+        "http_max_connections": HTTP_MAX_CONNECTIONS,
+        "http_max_keepalive_connections": HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        "http_keepalive_expiry": HTTP_KEEPALIVE_EXPIRY,
+        "http_connect_timeout": HTTP_CONNECT_TIMEOUT,
+        "http_read_timeout": HTTP_READ_TIMEOUT,
+        # Send each prompt to all of the targets ({"is_g4f", "model", "provider"}) at once
+        "fan_out": False,
+        "fan_out_targets": [],
         # GUI & Application settings
         "TAB_IDX": 0,
         "show_chat_list": True,
@@ -1115,7 +1300,7 @@ CONFIG_DATA = {
         "run_at_startup": True,
         "manual_update": True,
         # Columns
-        "chat_column_to_show": ["id", "name", "insert_dt", "update_dt"],
+        "chat_column_to_show": ["id", "name", "insert_dt", "update_dt", "message_count"],
         "image_column_to_show": [
             "id",
             "model",
@@ -1159,6 +1344,7 @@ CONFIG_DATA = {
         "g4f_model": DEFAULT_LLM,
         "provider": G4F_PROVIDER_DEFAULT,
         "g4f_use_chat_history": G4F_USE_CHAT_HISTORY,
+        "g4f_race_provider_count": G4F_RACE_PROVIDER_COUNT,
         # STT and TTS settings
         "voice_provider": TTS_DEFAULT_PROVIDER,
         "voice": TTS_DEFAULT_VOICE,
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from qtpy.QtGui import QPalette
+from qtpy.QtGui import QPalette, QTextCursor
 from qtpy.QtWidgets import QMessageBox
 
 from pyqt_openai import (
@@ -70,6 +70,8 @@ class AIChatUnit(ChatUnit):
         else:
             self.__favoriteBtn.setStyleAndIcon(ICON_FAVORITE_NO)
         if insert_f and self.__result_info:
+            # The id is set after the message is written by the background writer
+            DB.flushMessages()
             current_date = DB.updateMessage(self.__result_info.id, favorite)
             self.__result_info.favorite = favorite
             self.__result_info.favorite_set_date = current_date
@@ -150,5 +152,8 @@ class AIChatUnit(ChatUnit):
         self._lbl.adjustBrowserHeight()
 
     def addText(self, text: str):
-        self._lbl.setText(self._lbl.toPlainText() + text)
+        # Append at the end of the document instead of setting the whole text again
+        cursor = QTextCursor(self._lbl.document())
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.insertText(text)
         self._lbl.adjustBrowserHeight()
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import re
 
-from qtpy.QtCore import Qt, Signal
+from qtpy.QtCore import QCoreApplication, QEvent, Qt, Signal
 from qtpy.QtGui import QColor, QTextCharFormat, QTextCursor
 from qtpy.QtWidgets import QLabel, QScrollArea, QVBoxLayout, QWidget
 
@@ -10,12 +10,15 @@ from pyqt_openai import (
     DEFAULT_FOUND_TEXT_BG_COLOR,
     DEFAULT_FOUND_TEXT_COLOR,
     MAXIMUM_MESSAGES_IN_PARAMETER,
+    MESSAGE_PAGE_SIZE,
 )
 from pyqt_openai.chat_widget.center.aiChatUnit import AIChatUnit
+from pyqt_openai.chat_widget.center.fanOutUnit import FanOutUnit
 from pyqt_openai.chat_widget.center.userChatUnit import UserChatUnit
 from pyqt_openai.globals import DB
 from pyqt_openai.models import ChatMessageContainer
-from pyqt_openai.util.common import is_valid_regex
+from pyqt_openai.util.common import get_message_files_content, is_valid_regex
+from pyqt_openai.util.token_counter import count_message_tokens, count_tokens, get_encoding_name
 
 
 class ChatBrowser(QScrollArea):
@@ -31,6 +34,10 @@ class ChatBrowser(QScrollArea):
         self.__cur_id = 0
         self.__user_image = ""
         self.__ai_image = ""
+        # Id of the oldest message shown, older ones are loaded when scrolled up to the top (None if there is no more)
+        self.__oldest_id = None
+        # Distance between the scroll position and the bottom to keep while older messages are inserted above
+        self.__distance_from_bottom = None
 
     def __initUi(self):
         lay = QVBoxLayout()
@@ -44,11 +51,15 @@ class ChatBrowser(QScrollArea):
         self.setWidget(self.__chatWidget)
         self.setWidgetResizable(True)
 
-    def showLabel(self, text, stream_f, arg: ChatMessageContainer):
+        self.verticalScrollBar().valueChanged.connect(self.__scrolled)
+        self.verticalScrollBar().rangeChanged.connect(self.__rangeChanged)
+
+    def showLabel(self, text, stream_f, arg: ChatMessageContainer, files=None):
         arg.thread_id = arg.thread_id if arg.thread_id else self.__cur_id
         unit = self.__setLabel(text, stream_f, arg.role)
         if not stream_f:
-            arg.id = DB.insertMessage(arg)
+            # Written in the background with its files, arg.id is set once it is done
+            DB.insertMessageLater(arg, files)
             self.__setResponseInfo(unit, arg)
 
     def getLayout(self):
@@ -71,10 +82,35 @@ class ChatBrowser(QScrollArea):
     def streamFinished(self, arg: ChatMessageContainer):
         unit = self.__getLastUnit()
         arg.content = self.getLastResponse()
-        arg.id = DB.insertMessage(arg)
+        DB.insertMessageLater(arg)
         self.__setResponseInfo(unit, arg)
 
-    def __setLabel(self, text, stream_f, role):
+    def showFanOut(self, targets: list[dict]) -> FanOutUnit:
+        """Add the columns of the responses of the targets which the last prompt is sent to at once."""
+        unit = FanOutUnit(targets, self.__ai_image)
+        self.getLayout().addWidget(unit)
+        return unit
+
+    def showFanOutLabel(self, unit: FanOutUnit, i, text, stream_f, arg: ChatMessageContainer):
+        """Show the response (or the chunk of it) of the i-th target, each one is stored as a message of its own."""
+        if stream_f:
+            unit.addText(i, text)
+            return
+        arg.thread_id = arg.thread_id if arg.thread_id else self.__cur_id
+        DB.insertMessageLater(arg)
+        unit.setResponse(i, arg)
+        if arg.finish_reason != "stop":
+            unit.clearStats(i)
+
+    def fanOutStreamFinished(self, unit: FanOutUnit, i, arg: ChatMessageContainer):
+        arg.thread_id = arg.thread_id if arg.thread_id else self.__cur_id
+        arg.content = unit.getText(i)
+        DB.insertMessageLater(arg)
+        unit.setResponse(i, arg)
+        if arg.finish_reason != "stop":
+            unit.clearStats(i)
+
+    def __setLabel(self, text, stream_f, role, index=-1):
         chatUnit = QLabel()
         if role == "user":
             chatUnit = UserChatUnit()
@@ -94,9 +130,41 @@ class ChatBrowser(QScrollArea):
                     return None
             chatUnit.setText(text)
 
-        self.getLayout().addWidget(chatUnit)
+        self.getLayout().insertWidget(index, chatUnit)
         return chatUnit
 
+    def __scrolled(self, value):
+        if value == self.verticalScrollBar().minimum() and self.__oldest_id is not None:
+            self.__loadOlderMessages()
+
+    def __rangeChanged(self, minimum, maximum):
+        if self.__distance_from_bottom is not None:
+            self.verticalScrollBar().setValue(maximum - self.__distance_from_bottom)
+            self.__distance_from_bottom = None
+
+    def __loadOlderMessages(self, keep_position=True):
+        args = DB.selectThreadMessagesBefore(self.__cur_id, self.__oldest_id, MESSAGE_PAGE_SIZE)
+        self.__oldest_id = args[0].id if len(args) == MESSAGE_PAGE_SIZE else None
+        if not args:
+            return
+        if keep_position:
+            # Keep the messages which were shown in place, instead of jumping to the inserted ones
+            bar = self.verticalScrollBar()
+            self.__distance_from_bottom = bar.maximum() - bar.value()
+        for i, arg in enumerate(args):
+            unit = self.__setLabel(arg.content, False, arg.role, index=i)
+            self.__setResponseInfo(unit, arg)
+
+    def loadAllOlderMessages(self):
+        """Load every page of the thread which is not shown yet, for the find to search the whole thread.
+        The layout is updated right away, so the positions of the labels are right to scroll to.
+        """
+        if self.__oldest_id is None:
+            return
+        while self.__oldest_id is not None:
+            self.__loadOlderMessages(keep_position=False)
+        QCoreApplication.sendPostedEvents(None, QEvent.Type.LayoutRequest)
+
     def event(self, event):
         if event.type() == 43:
             self.verticalScrollBar().setSliderPosition(
@@ -104,14 +172,64 @@ class ChatBrowser(QScrollArea):
             )
         return super().event(event)
 
-    def getMessages(self, limit=MAXIMUM_MESSAGES_IN_PARAMETER):
-        messages = DB.selectCertainThreadMessages(self.__cur_id)
+    def getMessages(self, limit=MAXIMUM_MESSAGES_IN_PARAMETER, with_files=False):
+        return self.getHistory(limit, with_files)[0]
+
+    def getHistory(self, limit=MAXIMUM_MESSAGES_IN_PARAMETER, with_files=False, model=None):
+        """Get the messages to send as the history and the number of tokens of each of them
+        counted with the tokenizer of the model (None if the model is not given).
+        The messages come from the history cache of the thread, which also keeps their files and token counts,
+        so the DB is only read for what is not known yet.
+        """
+        # Only the last "limit" messages of the thread
+        records = DB.selectThreadHistory(self.__cur_id, limit)
+        # The images attached to the messages are sent again from chat_file_tb
+        if with_files:
+            self.__loadHistoryFiles(records)
         all_text_lst = [
-            {"role": message.role, "content": message.content} for message in messages
+            {
+                "role": record.role,
+                "content": get_message_files_content(record.content, record.files)
+                if with_files and record.files
+                else record.content,
+            }
+            for record in records
+        ]
+        if model is None:
+            return all_text_lst, None
+
+        self.__countHistoryTokens(records, model)
+        encoding = get_encoding_name(model)
+        token_counts = [
+            count_message_tokens(obj, record.token_counts[encoding]) for record, obj in zip(records, all_text_lst)
         ]
-        all_text_lst = all_text_lst[-limit:]
 
-        return all_text_lst
+        return all_text_lst, token_counts
+
+    def __loadHistoryFiles(self, records):
+        records = [record for record in records if record.files is None]
+        if not records:
+            return
+        if any(record.id is None for record in records):
+            # Wait for the messages which are being written, for their ids
+            DB.flushMessages()
+        files = DB.selectMessageFiles([record.id for record in records if record.id is not None])
+        for record in records:
+            record.files = files.get(record.id, [])
+
+    def __countHistoryTokens(self, records, model):
+        """Count the tokens of the records which are not counted with the tokenizer of the model yet.
+        The stored counts are read with the history (see ``SqliteDatabase.selectThreadHistory``), the new ones are
+        kept in the records and stored by the background writer, so the messages aren't tokenized again after
+        the app restarts and sending never waits for the DB.
+        """
+        encoding = get_encoding_name(model)
+        records = [record for record in records if encoding not in record.token_counts]
+        if not records:
+            return
+        for record in records:
+            record.token_counts[encoding] = count_tokens(record.content, model)
+        DB.insertMessageTokenCountsLater(encoding, records)
 
     def getLastResponse(self):
         lay = self.getLayout()
@@ -131,10 +249,13 @@ class ChatBrowser(QScrollArea):
                 item = lay.itemAt(i)
                 if item and item.widget():
                     item.widget().deleteLater()
+        self.__oldest_id = None
         self.onReplacedCurrentPage.emit(0)
 
     def setCurId(self, id):
         self.__cur_id = id
+        # Keep the maintenance from archiving the thread while it is shown
+        DB.setOpenThread(id or None)
 
     def getCurId(self):
         return self.__cur_id
@@ -272,8 +393,10 @@ class ChatBrowser(QScrollArea):
 
         return selections
 
-    def replaceThread(self, args: list[ChatMessageContainer], id):
-        """For showing messages from the thread."""
+    def replaceThread(self, args: list[ChatMessageContainer], id, has_older=False):
+        """For showing messages from the thread.
+        If args is only the last page of the thread, set has_older to load the rest when scrolled up to the top.
+        """
         self.clear()
         self.setCurId(id)
         self.onReplacedCurrentPage.emit(1)
@@ -282,6 +405,7 @@ class ChatBrowser(QScrollArea):
             # stream is False no matter what
             unit = self.__setLabel(arg.content, False, arg.role)
             self.__setResponseInfo(unit, arg)
+        self.__oldest_id = args[0].id if has_older and args else None
 
     def replaceThreadForFavorite(self, args: list[ChatMessageContainer]):
         """For showing favorite messages."""
@@ -302,5 +426,7 @@ class ChatBrowser(QScrollArea):
     def setAIImage(self, img):
         self.__ai_image = img
         lbls = self.__getEveryAILabels()
+        for fanOutUnit in self.__getLabelsByType(FanOutUnit):
+            lbls.extend(fanOutUnit.getUnits())
         for lbl in lbls:
             lbl.setIcon(img)
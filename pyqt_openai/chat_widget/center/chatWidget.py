@@ -3,6 +3,8 @@ from __future__ import annotations
 import json
 import sys
 
+from functools import partial
+
 from qtpy.QtCore import Signal
 from qtpy.QtWidgets import (
     QHBoxLayout,
@@ -13,22 +15,27 @@ from qtpy.QtWidgets import (
     QWidget,
 )
 
+from pyqt_openai import MESSAGE_PAGE_SIZE
 from pyqt_openai.chat_widget.center.chatBrowser import ChatBrowser
 from pyqt_openai.chat_widget.center.chatHome import ChatHome
+from pyqt_openai.chat_widget.center.fanOutUnit import FanOutUnit
 from pyqt_openai.chat_widget.center.menuWidget import MenuWidget
 from pyqt_openai.chat_widget.center.prompt import Prompt
 from pyqt_openai.chat_widget.llamaIndexThread import LlamaIndexThread
 from pyqt_openai.config_loader import CONFIG_MANAGER
-from pyqt_openai.globals import DB, LLAMAINDEX_WRAPPER
+from pyqt_openai.globals import DB, LLAMAINDEX_WRAPPER, NETWORK_ENGINE
 from pyqt_openai.lang.translations import LangClass
 from pyqt_openai.models import ChatMessageContainer
-from pyqt_openai.util.common import ChatThread, get_argument
+from pyqt_openai.util.common import ChatTask, get_argument
+from pyqt_openai.util.http_client import prewarm_connection
 from pyqt_openai.widgets.notifier import NotifierWidget
 
 
 class ChatWidget(QWidget):
     addThread = Signal()
     onMenuCloseClicked = Signal()
+    # Emitted from the writer thread of the DB, queued to the GUI thread
+    messageWriteFailed = Signal(str)
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -39,6 +46,9 @@ class ChatWidget(QWidget):
         self.__cur_id = 0
         self.__notify_finish = CONFIG_MANAGER.get_general_property("notify_finish")
         self.__is_g4f = False
+        # Requests of the last prompt, more than one in the fan-out mode
+        self.__tasks = []
+        self.__running_task_count = 0
 
     def __initUi(self):
         # Main widget
@@ -69,6 +79,7 @@ class ChatWidget(QWidget):
         self.__prompt = Prompt(self)
         self.__prompt.onRecording.connect(self.__toggleWidgetWhileRecording)
         self.__prompt.onStoppedClicked.connect(self.__stopResponse)
+        self.__prompt.onTypingStarted.connect(self.__prewarmConnection)
         self.__mainPrompt = self.__prompt.getMainPromptInput()
 
         lay = QHBoxLayout()
@@ -94,6 +105,9 @@ class ChatWidget(QWidget):
 
         self.__mainPrompt.returnPressed.connect(self.__chat)
 
+        self.messageWriteFailed.connect(self.__showMessageWriteError)
+        DB.addMessageWriteErrorListener(lambda arg, e: self.messageWriteFailed.emit(str(e)))
+
     def showTitle(self, title):
         self.__menuWidget.setTitle(title)
 
@@ -166,9 +180,6 @@ class ChatWidget(QWidget):
             maximum_messages_in_parameter = CONFIG_MANAGER.get_general_property(
                 "maximum_messages_in_parameter",
             )
-            messages = self.__browser.getMessages(maximum_messages_in_parameter)
-            if self.__is_g4f and not g4f_use_chat_history:
-                messages = []
 
             cur_text = self.__prompt.getContent()
 
@@ -216,24 +227,43 @@ class ChatWidget(QWidget):
                     )
                     return
 
-            param = get_argument(
-                model,
-                system,
-                messages,
-                cur_text,
-                temperature,
-                top_p,
-                frequency_penalty,
-                presence_penalty,
-                stream,
-                use_max_tokens,
-                max_tokens,
-                images,
-                is_llama_available,
-                is_json_response_available,
-                json_content,
-                self.__is_g4f,
-            )
+            def get_param(model, is_g4f):
+                # G4F gets the images of the current message only (separately from the messages)
+                # The history of the API is packed into the context window of the model with the token counts
+                messages, token_counts = self.__browser.getHistory(
+                    maximum_messages_in_parameter,
+                    with_files=not is_g4f,
+                    model=None if is_g4f else model,
+                )
+                if is_g4f and not g4f_use_chat_history:
+                    messages = []
+
+                return get_argument(
+                    model,
+                    system,
+                    messages,
+                    cur_text,
+                    temperature,
+                    top_p,
+                    frequency_penalty,
+                    presence_penalty,
+                    stream,
+                    use_max_tokens,
+                    max_tokens,
+                    images,
+                    is_llama_available,
+                    is_json_response_available,
+                    json_content,
+                    is_g4f,
+                    history_token_counts=token_counts,
+                )
+
+            # In the fan-out mode the prompt goes to every target at once instead of the selected model
+            fan_out_targets = []
+            if CONFIG_MANAGER.get_general_property("fan_out") and not is_llama_available:
+                fan_out_targets = CONFIG_MANAGER.get_general_property("fan_out_targets") or []
+            fan_out_params = [get_param(target["model"], target["is_g4f"]) for target in fan_out_targets]
+            param = fan_out_params[0] if fan_out_params else get_param(model, self.__is_g4f)
 
             # If there is no current conversation selected on the list to the left, make a new one.
             if self.__mainWidget.currentIndex() == 0:
@@ -245,9 +275,6 @@ class ChatWidget(QWidget):
                 "content": cur_text,
                 "model_name": param["model"],
                 "finish_reason": "",
-                "prompt_tokens": "",
-                "completion_tokens": "",
-                "total_tokens": "",
                 "is_json_response_available": is_json_response_available,
             }
 
@@ -260,24 +287,32 @@ class ChatWidget(QWidget):
             # Create a container for the user's input and output from the chatbot
             container = ChatMessageContainer(**container_param)
 
+            # The images are stored once per content and attached to the message by the writer thread of the DB,
+            # the next requests send them again as part of the history
             query_text = self.__prompt.getContent()
-            self.__browser.showLabel(query_text, False, container)
+            self.__browser.showLabel(query_text, False, container, images)
 
             # Run a different thread based on whether the llama-index is enabled or not.
-            if is_llama_available:
-                self.__t = LlamaIndexThread(
-                    param, container, LLAMAINDEX_WRAPPER, query_text,
-                )
+            if fan_out_targets:
+                self.__startFanOut(fan_out_targets, fan_out_params, container)
             else:
-                self.__t = ChatThread(
-                    param, info=container, is_g4f=self.__is_g4f, provider=provider,
-                )
+                if is_llama_available:
+                    t = LlamaIndexThread(
+                        param, container, LLAMAINDEX_WRAPPER, query_text,
+                    )
+                else:
+                    t = ChatTask(
+                        param, info=container, is_g4f=self.__is_g4f, provider=provider,
+                    )
+                self.__tasks = [t]
+                self.__running_task_count = 1
 
-            self.__t.started.connect(self.__beforeGenerated)
-            self.__t.replyGenerated.connect(self.__browser.showLabel)
-            self.__t.streamFinished.connect(self.__browser.streamFinished)
-            self.__t.start()
-            self.__t.finished.connect(self.__afterGenerated)
+                t.started.connect(self.__beforeGenerated)
+                t.replyGenerated.connect(self.__browser.showLabel)
+                t.streamFinished.connect(self.__browser.streamFinished)
+                # Connected before it starts, the request can finish before the next line
+                t.finished.connect(self.__taskFinished)
+                t.start()
 
             # Remove image files widget from the window
             self.__prompt.resetUploadImageFileWidget()
@@ -298,8 +333,48 @@ class ChatWidget(QWidget):
             """,
             )
 
+    def __showMessageWriteError(self, error):
+        # TODO LANGUAGE
+        QMessageBox.critical(
+            self,
+            LangClass.TRANSLATIONS["Error"],
+            f"The message (or its images) couldn't be saved to the database, "
+            f"it will be missing when the thread is opened again.\n\n{error}",
+        )
+
+    def __prewarmConnection(self):
+        # The connection to the provider is opened while the prompt is written, the request reuses it
+        if not self.__is_g4f and CONFIG_MANAGER.get_general_property("http_prewarm"):
+            NETWORK_ENGINE.submit(prewarm_connection(CONFIG_MANAGER.get_general_property("model")))
+
+    def __startFanOut(self, targets, params, container: ChatMessageContainer):
+        """Send the prompt to every target at once, the response of each one streams into a column of its own.
+        The requests run concurrently on the network engine, so it takes about as long as the slowest one.
+        """
+        unit: FanOutUnit = self.__browser.showFanOut(targets)
+        self.__tasks = []
+        self.__running_task_count = len(targets)
+        self.__beforeGenerated()
+        for i, (target, param) in enumerate(zip(targets, params)):
+            info = ChatMessageContainer(**{**dict(container.get_items(excludes=["id"])), "model": param["model"]})
+            t = ChatTask(param, info=info, is_g4f=target["is_g4f"], provider=target["provider"])
+            t.replyGenerated.connect(partial(self.__browser.showFanOutLabel, unit, i))
+            t.streamFinished.connect(partial(self.__browser.fanOutStreamFinished, unit, i))
+            t.statsGenerated.connect(partial(unit.setStats, i))
+            t.finished.connect(partial(unit.finish, i))
+            t.finished.connect(self.__taskFinished)
+            self.__tasks.append(t)
+        for t in self.__tasks:
+            t.start()
+
+    def __taskFinished(self):
+        self.__running_task_count -= 1
+        if self.__running_task_count == 0:
+            self.__afterGenerated()
+
     def __stopResponse(self):
-        self.__t.stop()
+        for t in self.__tasks:
+            t.stop()
 
     def __toggleWidgetWhileRecording(self, f):
         self.__mainPrompt.setExecuteEnabled(not f)
@@ -341,7 +416,11 @@ class ChatWidget(QWidget):
 
     def showMessages(self, cur_id):
         self.__browser.resetChatWidget(cur_id)
-        self.__browser.replaceThread(DB.selectCertainThreadMessages(cur_id), cur_id)
+        # Show the last page only, the older messages are loaded when scrolled up
+        messages = DB.selectLastThreadMessages(cur_id, MESSAGE_PAGE_SIZE)
+        self.__browser.replaceThread(messages, cur_id, has_older=len(messages) == MESSAGE_PAGE_SIZE)
+        # Read the history once now, the messages which are sent later are added to it
+        DB.selectThreadHistory(cur_id, CONFIG_MANAGER.get_general_property("maximum_messages_in_parameter"))
         self.__mainPrompt.setFocus()
         # Reset menu widget
         self.__menuWidget.getFindTextWidget().clearFormatting()
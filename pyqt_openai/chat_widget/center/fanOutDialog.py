@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+from qtpy.QtCore import Qt
+from qtpy.QtWidgets import (
+    QAbstractItemView,
+    QCheckBox,
+    QComboBox,
+    QDialog,
+    QHBoxLayout,
+    QHeaderView,
+    QPushButton,
+    QTableWidget,
+    QVBoxLayout,
+    QWidget,
+)
+
+from pyqt_openai import FAN_OUT_MAX_TARGETS, G4F_PROVIDER_DEFAULT
+from pyqt_openai.config_loader import CONFIG_MANAGER
+from pyqt_openai.lang.translations import LangClass
+from pyqt_openai.util.common import (
+    getSeparator,
+    get_chat_model,
+    get_g4f_models,
+    get_g4f_models_by_provider,
+    get_g4f_providers,
+)
+
+API_TYPE = "API"
+G4F_TYPE = "G4F"
+
+
+class FanOutDialog(QDialog):
+    """Select the models (of the API and G4F) which each prompt is sent to at once, to compare their responses."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.__initVal()
+        self.__initUi()
+
+    def __initVal(self):
+        self.__fan_out = bool(CONFIG_MANAGER.get_general_property("fan_out"))
+        self.__targets = CONFIG_MANAGER.get_general_property("fan_out_targets") or []
+
+    def __initUi(self):
+        # TODO LANGUAGE
+        self.setWindowTitle("Compare Models")
+        self.setWindowFlags(Qt.WindowType.Window | Qt.WindowType.WindowCloseButtonHint)
+
+        self.__fanOutChkBox = QCheckBox("Send each prompt to all of these models at once")
+        self.__fanOutChkBox.setChecked(self.__fan_out)
+
+        self.__tableWidget = QTableWidget()
+        self.__tableWidget.setColumnCount(3)
+        self.__tableWidget.setHorizontalHeaderLabels(["Type", LangClass.TRANSLATIONS["Model"], "Provider"])
+        self.__tableWidget.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.__tableWidget.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.__tableWidget.verticalHeader().setVisible(False)
+        for target in self.__targets:
+            self.__addRow(target)
+
+        self.__addBtn = QPushButton(LangClass.TRANSLATIONS["Add"])
+        self.__addBtn.clicked.connect(lambda: self.__addRow())
+        delBtn = QPushButton(LangClass.TRANSLATIONS["Delete"])
+        delBtn.clicked.connect(self.__deleteRow)
+        self.__refreshAddBtn()
+
+        lay = QHBoxLayout()
+        lay.addWidget(self.__addBtn)
+        lay.addWidget(delBtn)
+        lay.setAlignment(Qt.AlignmentFlag.AlignLeft)
+        lay.setContentsMargins(0, 0, 0, 0)
+
+        btnWidget = QWidget()
+        btnWidget.setLayout(lay)
+
+        okBtn = QPushButton(LangClass.TRANSLATIONS["OK"])
+        okBtn.clicked.connect(self.__accept)
+
+        cancelBtn = QPushButton(LangClass.TRANSLATIONS["Cancel"])
+        cancelBtn.clicked.connect(self.close)
+
+        lay = QHBoxLayout()
+        lay.addWidget(okBtn)
+        lay.addWidget(cancelBtn)
+        lay.setAlignment(Qt.AlignmentFlag.AlignRight)
+        lay.setContentsMargins(0, 0, 0, 0)
+
+        okCancelWidget = QWidget()
+        okCancelWidget.setLayout(lay)
+
+        lay = QVBoxLayout()
+        lay.addWidget(self.__fanOutChkBox)
+        lay.addWidget(self.__tableWidget)
+        lay.addWidget(btnWidget)
+        lay.addWidget(getSeparator("horizontal"))
+        lay.addWidget(okCancelWidget)
+
+        self.setLayout(lay)
+        self.resize(600, 300)
+
+    def __addRow(self, target=None):
+        target = target or {
+            "is_g4f": False,
+            "model": CONFIG_MANAGER.get_general_property("model"),
+            "provider": G4F_PROVIDER_DEFAULT,
+        }
+        row = self.__tableWidget.rowCount()
+        self.__tableWidget.insertRow(row)
+
+        typeCmbBox = QComboBox()
+        typeCmbBox.addItems([API_TYPE, G4F_TYPE])
+
+        modelCmbBox = QComboBox()
+        # The API takes the models of every provider of litellm, e.g. "groq/llama3-8b-8192"
+        modelCmbBox.setEditable(True)
+
+        providerCmbBox = QComboBox()
+        providerCmbBox.addItems(get_g4f_providers(including_auto=True))
+
+        self.__tableWidget.setCellWidget(row, 0, typeCmbBox)
+        self.__tableWidget.setCellWidget(row, 1, modelCmbBox)
+        self.__tableWidget.setCellWidget(row, 2, providerCmbBox)
+
+        typeCmbBox.setCurrentText(G4F_TYPE if target["is_g4f"] else API_TYPE)
+        providerCmbBox.setCurrentText(target["provider"])
+        self.__refreshModels(typeCmbBox, modelCmbBox, providerCmbBox)
+        modelCmbBox.setCurrentText(target["model"])
+
+        typeCmbBox.currentTextChanged.connect(
+            lambda _: self.__refreshModels(typeCmbBox, modelCmbBox, providerCmbBox),
+        )
+        providerCmbBox.currentTextChanged.connect(
+            lambda _: self.__refreshModels(typeCmbBox, modelCmbBox, providerCmbBox),
+        )
+        self.__refreshAddBtn()
+
+    def __refreshModels(self, typeCmbBox, modelCmbBox, providerCmbBox):
+        is_g4f = typeCmbBox.currentText() == G4F_TYPE
+        provider = providerCmbBox.currentText()
+        model = modelCmbBox.currentText()
+        providerCmbBox.setEnabled(is_g4f)
+        modelCmbBox.clear()
+        if not is_g4f:
+            modelCmbBox.addItems(get_chat_model())
+        elif provider == G4F_PROVIDER_DEFAULT:
+            modelCmbBox.addItems(get_g4f_models())
+        else:
+            modelCmbBox.addItems(get_g4f_models_by_provider(provider))
+        modelCmbBox.setCurrentText(model)
+
+    def __deleteRow(self):
+        rows = sorted({index.row() for index in self.__tableWidget.selectedIndexes()}, reverse=True)
+        for row in rows:
+            self.__tableWidget.removeRow(row)
+        self.__refreshAddBtn()
+
+    def __refreshAddBtn(self):
+        self.__addBtn.setEnabled(self.__tableWidget.rowCount() < FAN_OUT_MAX_TARGETS)
+
+    def getTargets(self) -> list[dict]:
+        targets = []
+        for row in range(self.__tableWidget.rowCount()):
+            model = self.__tableWidget.cellWidget(row, 1).currentText().strip()
+            if not model:
+                continue
+            is_g4f = self.__tableWidget.cellWidget(row, 0).currentText() == G4F_TYPE
+            targets.append(
+                {
+                    "is_g4f": is_g4f,
+                    "model": model,
+                    "provider": self.__tableWidget.cellWidget(row, 2).currentText()
+                    if is_g4f
+                    else "",
+                },
+            )
+        return targets
+
+    def __accept(self):
+        CONFIG_MANAGER.set_general_property("fan_out", self.__fanOutChkBox.isChecked())
+        CONFIG_MANAGER.set_general_property("fan_out_targets", self.getTargets())
+        self.accept()
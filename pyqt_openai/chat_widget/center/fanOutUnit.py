@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from qtpy.QtCore import Qt
+from qtpy.QtGui import QFont
+from qtpy.QtWidgets import QHBoxLayout, QLabel, QVBoxLayout, QWidget
+
+from pyqt_openai import SMALL_LABEL_PARAM
+from pyqt_openai.chat_widget.center.aiChatUnit import AIChatUnit
+from pyqt_openai.models import ChatMessageContainer
+
+# TODO LANGUAGE
+WAITING_TEXT = "Waiting for the first token..."
+
+
+class FanOutUnit(QWidget):
+    """Responses of the models which the same prompt was sent to, side by side in a column each.
+    Every column shows the time to the first token and the tokens per second of its response.
+    """
+
+    def __init__(self, targets: list[dict], ai_image="", parent=None):
+        super().__init__(parent)
+        self.__initUi(targets, ai_image)
+
+    def __initUi(self, targets, ai_image):
+        self.__units: list[AIChatUnit] = []
+        self.__statsLbls: list[QLabel] = []
+
+        lay = QHBoxLayout()
+        lay.setContentsMargins(0, 0, 0, 0)
+        lay.setSpacing(1)
+        for target in targets:
+            titleLbl = QLabel(
+                f'{target["model"]} ({target["provider"]})' if target["is_g4f"] else target["model"],
+            )
+            titleLbl.setWordWrap(True)
+
+            statsLbl = QLabel(WAITING_TEXT)
+            statsLbl.setFont(QFont(*SMALL_LABEL_PARAM))
+
+            unit = AIChatUnit()
+            unit.setIcon(ai_image)
+            unit.toggleGUI(False)
+
+            columnLay = QVBoxLayout()
+            columnLay.addWidget(titleLbl)
+            columnLay.addWidget(statsLbl)
+            columnLay.addWidget(unit)
+            columnLay.setAlignment(Qt.AlignmentFlag.AlignTop)
+            columnLay.setContentsMargins(2, 2, 2, 2)
+
+            column = QWidget()
+            column.setLayout(columnLay)
+            lay.addWidget(column, 1)
+
+            self.__units.append(unit)
+            self.__statsLbls.append(statsLbl)
+
+        self.setLayout(lay)
+
+    def getUnits(self) -> list[AIChatUnit]:
+        return self.__units
+
+    def addText(self, i, text):
+        self.__units[i].addText(text)
+
+    def setResponse(self, i, arg: ChatMessageContainer):
+        """Show the whole response of the i-th column, the streamed text is replaced with its rendered form."""
+        self.__units[i].afterResponse(arg)
+
+    def getText(self, i):
+        return self.__units[i].getText()
+
+    def setStats(self, i, time_to_first_token, tokens_per_second):
+        self.__statsLbls[i].setText(f"TTFT {time_to_first_token:.2f} s · {tokens_per_second:.1f} tokens/s")
+
+    def clearStats(self, i):
+        """For the responses which failed or were stopped, there is nothing to measure."""
+        self.__statsLbls[i].setText("")
+
+    def finish(self, i):
+        """The request of the i-th column is over, clear the label if it was stopped before the first token."""
+        if self.__statsLbls[i].text() == WAITING_TEXT:
+            self.clearStats(i)
@@ -124,6 +124,8 @@ class FindTextWidget(QWidget):
             self.__showWarning()
             return
 
+        # Only the last page of the thread is shown at first, search the older ones too
+        self.__chatBrowser.loadAllOlderMessages()
         self.__selections = self.__getSelections(text)
         is_exist = self.__isSelectionExist(text)
 
@@ -36,6 +36,7 @@ from pyqt_openai import (
 from pyqt_openai.chat_widget.center.commandSuggestionWidget import (
     CommandSuggestionWidget,
 )
+from pyqt_openai.chat_widget.center.fanOutDialog import FanOutDialog
 from pyqt_openai.chat_widget.center.textEditPromptGroup import TextEditPromptGroup
 from pyqt_openai.chat_widget.center.uploadedImageFileWidget import (
     UploadedImageFileWidget,
@@ -56,6 +57,7 @@ from pyqt_openai.widgets.toolButton import ToolButton
 class Prompt(QWidget):
     onRecording = Signal(bool)
     onStoppedClicked = Signal()
+    onTypingStarted = Signal()
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -98,6 +100,7 @@ class Prompt(QWidget):
 
         self.__textEditGroup = TextEditPromptGroup()
         self.__textEditGroup.textChanged.connect(self.updateHeight)
+        self.__textEditGroup.typingStarted.connect(self.onTypingStarted)
 
         # set command suggestion
         self.__textEditGroup.onUpdateSuggestion.connect(self.__updateSuggestions)
@@ -171,6 +174,10 @@ class Prompt(QWidget):
         readingFilesAction = QAction(LangClass.TRANSLATIONS["Upload Files..."], self)
         readingFilesAction.triggered.connect(self.__readingFiles)
 
+        # TODO LANGUAGE
+        fanOutAction = QAction("Compare Models...", self)
+        fanOutAction.triggered.connect(self.__showFanOutDialog)
+
         self.__writeJSONAction = QAction(LangClass.TRANSLATIONS["Write JSON"], self)
         self.__writeJSONAction.toggled.connect(self.__showJSON)
         self.__writeJSONAction.setCheckable(True)
@@ -182,6 +189,7 @@ class Prompt(QWidget):
         menu.addAction(supportPromptCommandAction)
         menu.addAction(self.__writeJSONAction)
         menu.addAction(readingFilesAction)
+        menu.addAction(fanOutAction)
 
         # Connect the button to the menu
         settingsBtn.setMenu(menu)
@@ -307,6 +315,10 @@ class Prompt(QWidget):
         elif key == "enter":
             self.executeCommand(self.__suggestion_list.currentItem())
 
+    def __showFanOutDialog(self):
+        dialog = FanOutDialog(self)
+        dialog.exec()
+
     def showWidgetInPromptDuringResponse(self, f):
         self.__controlWidgetDuringGeneration.setVisible(f)
 
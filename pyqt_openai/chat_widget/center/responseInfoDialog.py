@@ -27,7 +27,7 @@ class ResponseInfoDialog(QDialog):
 
         lbls = []
         for k, v in self.__result_info.get_items(excludes=["content"]):
-            if k == "favorite":
+            if k in ("favorite", "is_cached"):
                 lbls.append(QLabel(f'{k}: {"Yes" if v else "No"}'))
             else:
                 lbls.append(QLabel(f"{k}: {v}"))
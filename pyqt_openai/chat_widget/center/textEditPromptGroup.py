@@ -22,6 +22,8 @@ from pyqt_openai.widgets.jsonEditor import JSONEditor
 
 class TextEditPromptGroup(QWidget):
     textChanged = Signal()
+    # The main prompt got its first character, e.g. to connect to the provider while the rest is written
+    typingStarted = Signal()
     onUpdateSuggestion = Signal()
     onSendKeySignalToSuggestion = Signal(str)
     onPasteFile = Signal(QByteArray)
@@ -29,8 +31,12 @@ class TextEditPromptGroup(QWidget):
 
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.__initVal()
         self.__initUi()
 
+    def __initVal(self):
+        self.__is_empty = True
+
     def __initUi(self):
         self.__beginningTextEdit = TextEditPrompt()
         self.__beginningTextEdit.setPlaceholderText(LangClass.TRANSLATIONS["Beginning"])
@@ -74,9 +80,17 @@ class TextEditPromptGroup(QWidget):
         self.setVisibleTo(PROMPT_JSON_KEY_NAME, False)
         self.setVisibleTo(PROMPT_END_KEY_NAME, False)
 
+        self.__textEdit.textChanged.connect(self.__mainTextChanged)
+
         self.__textGroup[PROMPT_MAIN_KEY_NAME].installEventFilter(self)
         self.__textGroup[PROMPT_MAIN_KEY_NAME].handleDrop.connect(self.handleDrop)
 
+    def __mainTextChanged(self):
+        is_empty = self.__textEdit.document().isEmpty()
+        if self.__is_empty and not is_empty:
+            self.typingStarted.emit()
+        self.__is_empty = is_empty
+
     def showPromptContent(self, item, grp):
         command_key = item.text()
         command = ""
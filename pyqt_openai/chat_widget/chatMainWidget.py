@@ -4,7 +4,7 @@ import os
 
 from typing import TYPE_CHECKING, Any
 
-from qtpy.QtCore import Qt
+from qtpy.QtCore import Qt, Signal
 from qtpy.QtWidgets import QFileDialog, QHBoxLayout, QMessageBox, QPushButton, QSplitter, QStackedWidget, QVBoxLayout, QWidget
 
 from pyqt_openai import (
@@ -19,7 +19,7 @@ from pyqt_openai import (
     ICON_SIDEBAR,
     JSON_FILE_EXT_LIST_STR,
     QFILEDIALOG_DEFAULT_DIRECTORY,
-    THREAD_TABLE_NAME,
+    THREAD_ALL_VIEW_NAME,
 )
 from pyqt_openai.chat_widget.center.chatWidget import ChatWidget
 from pyqt_openai.chat_widget.center.realtimeApiWidget import RealtimeApiWidget
@@ -29,7 +29,7 @@ from pyqt_openai.chat_widget.right_sidebar.chatRightSideBarWidget import ChatRig
 from pyqt_openai.config_loader import CONFIG_MANAGER
 from pyqt_openai.globals import DB
 from pyqt_openai.lang.translations import LangClass
-from pyqt_openai.models import ChatMessageContainer, ChatThreadContainer
+from pyqt_openai.models import ChatMessageContainer, ChatThreadStatsContainer
 from pyqt_openai.util.common import add_file_to_zip, conv_unit_to_html, getSeparator, get_generic_ext_out_of_qt_ext, message_list_to_txt, open_directory
 from pyqt_openai.widgets.button import Button
 
@@ -40,6 +40,9 @@ if TYPE_CHECKING:
 
 
 class ChatMainWidget(QWidget):
+    # Emitted from the maintenance thread of the DB, queued to the GUI thread
+    threadsArchived = Signal()
+
     def __init__(self, parent: QWidget | None = None):
         super().__init__(parent)
         self.__initVal()
@@ -67,8 +70,8 @@ class ChatMainWidget(QWidget):
 
     def __initUi(self):
         self.__chatNavWidget = ChatNavWidget(
-            ChatThreadContainer.get_keys(),
-            THREAD_TABLE_NAME,
+            ChatThreadStatsContainer.get_keys(),
+            THREAD_ALL_VIEW_NAME,
         )
 
         self.__chatWidget: ChatWidget = ChatWidget()
@@ -159,6 +162,9 @@ class ChatMainWidget(QWidget):
         self.__chatNavWidget.onExport.connect(self.__exportChat)
         self.__chatNavWidget.onFavoriteClicked.connect(self.__showFavorite)
 
+        self.threadsArchived.connect(self.__chatNavWidget.reload)
+        DB.addArchiveListener(lambda ids: self.threadsArchived.emit())
+
         self.__rightSideBar: QSplitter = QSplitter()
         self.__rightSideBar.setOrientation(Qt.Orientation.Vertical)
         self.__rightSideBar.addWidget(self.__chatRightSideBarWidget)
@@ -288,17 +294,8 @@ class ChatMainWidget(QWidget):
 
     def __importChat(self, data: list[dict[str, Any]]):
         try:
-            # Import thread
-            for thread in data:
-                cur_id = DB.insertThread(
-                    thread["name"], thread["insert_dt"], thread["update_dt"],
-                )
-                messages = thread["messages"]
-                # Import message
-                for message in messages:
-                    message["thread_id"] = cur_id
-                    container = ChatMessageContainer(**message)
-                    DB.insertMessage(container, deactivate_trigger=True)
+            # Import threads and their messages in a single transaction
+            DB.importThreads(data)
             self.__chatNavWidget.refreshData()
         except Exception:
             QMessageBox.critical(  # type: ignore[call-arg]
@@ -3,7 +3,7 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 from qtpy.QtCore import QSortFilterProxyModel, Qt, Signal
-from qtpy.QtSql import QSqlQuery, QSqlTableModel
+from qtpy.QtSql import QSqlTableModel
 from qtpy.QtWidgets import (
     QComboBox,
     QDialog,
@@ -130,6 +130,7 @@ class ChatNavWidget(BaseNavWidget):
         lay.addSpacerItem(QSpacerItem(10, 10, QSizePolicy.Policy.MinimumExpanding))
         lay.addWidget(self.__addBtn)
         lay.addWidget(self._delBtn)
+        lay.addWidget(self._undoBtn)
         lay.addWidget(self._clearBtn)
         lay.addWidget(self.__importBtn)
         lay.addWidget(self.__saveBtn)
@@ -231,25 +232,26 @@ class ChatNavWidget(BaseNavWidget):
         # get the source index
         source_idx = self._proxyModel.mapToSource(idx)
         # get the primary key value of the row
-        cur_id = self._model.record(source_idx.row()).value("id")
+        record = self._model.record(source_idx.row())
+        cur_id = record.value("id")
+        # Opening the archived thread moves it back from the archive (with the new id)
+        if record.value("is_archived"):
+            cur_id = DB.restoreThread(cur_id)
+            self._model.select()
         clicked_thread = DB.selectThread(cur_id)
         # get the title
         title = clicked_thread["name"]
 
         self.clicked.emit(cur_id, title)
 
-    def __getSelectedIds(self) -> list[int]:
+    def __getSelectedThreads(self) -> list[tuple[int, bool]]:
+        """(id, is_archived) of the selected threads, the archived threads are numbered apart."""
         selected_idx_s = self._tableView.selectedIndexes()
-        ids = []
+        threads = set()
         for idx in selected_idx_s:
-            ids.append(
-                self._model.data(
-                    self._proxyModel.mapToSource(idx.siblingAtColumn(0)),
-                    role=Qt.ItemDataRole.DisplayRole,
-                ),
-            )
-        ids = list(set(ids))
-        return ids
+            record = self._model.record(self._proxyModel.mapToSource(idx).row())
+            threads.add((record.value("id"), bool(record.value("is_archived"))))
+        return list(threads)
 
     # TODO LANGUAGE
     def _delete(self):
@@ -260,12 +262,20 @@ class ChatNavWidget(BaseNavWidget):
             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
         )
         if reply == QMessageBox.StandardButton.Yes:
-            ids = self.__getSelectedIds()
-            for _id in ids:
-                DB.deleteThread(_id)
+            threads = self.__getSelectedThreads()
+            archived_ids = [_id for _id, is_archived in threads if is_archived]
+            ids = [_id for _id, is_archived in threads if not is_archived]
+            if archived_ids:
+                DB.deleteArchivedThreads(archived_ids)
+            if ids:
+                is_restorable = DB.deleteThreads(ids)
+                self._setDeleted(ids if is_restorable else [])
             self._model.select()
             self.cleared.emit()
 
+    def _restoreDeleted(self, ids: list):
+        DB.restoreDeletedThreads(ids)
+
     def _clear(
         self,
         table_type: str = "chat",
@@ -277,6 +287,10 @@ class ChatNavWidget(BaseNavWidget):
     def __refresh(self):
         self._model.select()
 
+    def reload(self):
+        """Read the threads again (e.g. after the maintenance archived some), keeping the search."""
+        self._search(self._searchBar.getSearchBar().text())
+
     def _search(self, text: str):
         # title
         if self.__searchOptionCmbBox.currentText() == LangClass.TRANSLATIONS["Title"]:
@@ -286,14 +300,10 @@ class ChatNavWidget(BaseNavWidget):
             self.__searchOptionCmbBox.currentText() == LangClass.TRANSLATIONS["Content"]
         ):
             if text:
-                threads = DB.selectAllContentOfThread(content_to_select=text)
-                ids = [_[0] for _ in threads]
-                self._model.setQuery(
-                    QSqlQuery(
-                        f"SELECT {','.join(self._columns)} FROM {self._table_nm} "
-                        f"WHERE id IN ({','.join(map(str, ids))})",
-                    ),
-                )
+                threads = DB.selectThreadsByContent(text)
+                keys = [f"({thread['thread_id']}, {thread['is_archived']})" for thread in threads]
+                condition = f"(id, is_archived) IN (VALUES {','.join(keys)})" if keys else "0"
+                self._model.setQuery(self._getSelectQuery(condition))
             else:
                 self.refreshData()
 
@@ -305,6 +315,9 @@ class ChatNavWidget(BaseNavWidget):
         columns: list[str],
         table_type: str = "chat",
     ):
+        # The archived threads can't be told apart without it (the settings saved before it was added lack it)
+        if "is_archived" not in columns:
+            columns = columns + ["is_archived"]
         super().setColumns(columns, table_type=table_type)
 
     def __onFavoriteClicked(self, f: bool):
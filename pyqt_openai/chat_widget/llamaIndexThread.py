@@ -6,7 +6,7 @@ from qtpy.QtCore import QThread, Signal
 from pyqt_openai.models import ChatMessageContainer
 
 
-# Should combine with ChatThread
+# Should combine with ChatTask
 class LlamaIndexThread(QThread):
     replyGenerated = Signal(str, bool, ChatMessageContainer)
     streamFinished = Signal(ChatMessageContainer)
@@ -1,11 +1,15 @@
 """This is the file that contains the global variables that are used, or possibly used, throughout the application."""
 from __future__ import annotations
 
-from g4f.client import Client
+import litellm
+
+from g4f.client import AsyncClient, Client
 from openai import OpenAI
 
 from pyqt_openai.sqlite import SqliteDatabase
+from pyqt_openai.util.http_client import get_async_http_client, get_http_client
 from pyqt_openai.util.llamaindex import LlamaIndexWrapper
+from pyqt_openai.util.network_engine import NetworkEngine
 from pyqt_openai.util.replicate import ReplicateWrapper
 
 DB = SqliteDatabase()
@@ -13,8 +17,17 @@ DB = SqliteDatabase()
 LLAMAINDEX_WRAPPER = LlamaIndexWrapper()
 
 G4F_CLIENT = Client()
+G4F_ASYNC_CLIENT = AsyncClient()
+
+# Runs the chat requests (see ChatTask)
+NETWORK_ENGINE = NetworkEngine()
+
+# litellm sends the requests of OpenAI and the OpenAI-compatible providers with the shared pooled clients,
+# G4F providers keep their own transport
+litellm.client_session = get_http_client()
+litellm.aclient_session = get_async_http_client()
 
 # For Whisper
-OPENAI_CLIENT = OpenAI(api_key="")
+OPENAI_CLIENT = OpenAI(api_key="", http_client=get_http_client())
 
 REPLICATE_CLIENT = ReplicateWrapper(api_key="")
@@ -21,15 +21,18 @@ if __name__ == "__main__":
 # os.environ['QT_API'] = 'pyqt6'
 
 from qtpy.QtGui import QFont, QIcon, QPixmap
-from qtpy.QtSql import QSqlDatabase
+from qtpy.QtSql import QSqlDatabase, QSqlQuery
 from qtpy.QtWidgets import QApplication, QSplashScreen
 
-from pyqt_openai import DEFAULT_APP_ICON
+from pyqt_openai import DB_BUSY_TIMEOUT, DEFAULT_APP_ICON
 from pyqt_openai.config_loader import CONFIG_MANAGER
+from pyqt_openai.globals import DB, NETWORK_ENGINE
 from pyqt_openai.mainWindow import MainWindow
-from pyqt_openai.sqlite import get_db_filename
+from pyqt_openai.sqlite import get_archive_statements, get_db_filename
 from pyqt_openai.updateSoftwareDialog import update_software
 from pyqt_openai.util.common import handle_exception
+from pyqt_openai.util.db_backup import DBBackupScheduler
+from pyqt_openai.util.db_maintenance import DBMaintenanceScheduler
 
 
 # Application
@@ -37,12 +40,19 @@ class App(QApplication):
     def __init__(self, *args):
         super().__init__(*args)
         self.setQuitOnLastWindowClosed(False)
+        # Write the messages waiting in the background writer before quitting
+        self.aboutToQuit.connect(DB.flushMessages)
+        # Cancel the requests which are still running
+        self.aboutToQuit.connect(NETWORK_ENGINE.stop)
         self.setWindowIcon(QIcon(DEFAULT_APP_ICON))
         self.splash: QSplashScreen = QSplashScreen(QPixmap(DEFAULT_APP_ICON))
         self.splash.show()
 
         self.__initQSqlDb()
         self.__initFont()
+        # Incremental vacuum and ANALYZE while the app is idle
+        self.__dbMaintenanceScheduler = DBMaintenanceScheduler(self)
+        self.__dbBackupScheduler = DBBackupScheduler(self)
 
         self.__showMainWindow()
         self.splash.finish(self.main_window)
@@ -53,7 +63,15 @@ class App(QApplication):
         # Set up the database and table model (you'll need to configure this part based on your database)
         self.__db: QSqlDatabase = QSqlDatabase.addDatabase("QSQLITE")
         self.__db.setDatabaseName(get_db_filename())
+        # The table models read through this connection while SqliteDatabase writes (WAL mode),
+        # wait for the writer's lock instead of failing immediately
+        self.__db.setConnectOptions(
+            f"QSQLITE_BUSY_TIMEOUT={CONFIG_MANAGER.get_general_property('db_busy_timeout') or DB_BUSY_TIMEOUT}",
+        )
         self.__db.open()
+        # The chat list shows the archived threads as well
+        for statement in get_archive_statements(get_db_filename()):
+            QSqlQuery(statement, self.__db)
 
     def __initFont(self):
         font_family: str = CONFIG_MANAGER.get_general_property("font_family") or "Arial"
@@ -60,6 +60,7 @@ from pyqt_openai.customizeDialog import CustomizeDialog
 from pyqt_openai.dalle_widget.dalleMainWidget import DallEMainWidget
 from pyqt_openai.doNotAskAgainDialog import DoNotAskAgainDialog
 from pyqt_openai.g4f_image_widget.g4fImageMainWidget import G4FImageMainWidget
+from pyqt_openai.globals import DB
 from pyqt_openai.lang.translations import LangClass
 from pyqt_openai.models import CustomizeParamsContainer, SettingsParamsContainer
 from pyqt_openai.replicate_widget.replicateMainWidget import ReplicateMainWidget
@@ -528,6 +529,8 @@ class MainWindow(QMainWindow):
         self,
         event: QCloseEvent,
     ):
+        # Write the messages waiting in the background writer, the app may be closed right after this
+        DB.flushMessages()
         f = self.__beforeClose()
         if f:
             event.ignore()
@@ -1,15 +1,22 @@
 """This file is used to store the data classes that are used throughout the application."""
 from __future__ import annotations
 
-from dataclasses import dataclass, field, fields
+import functools
+
+from dataclasses import MISSING, dataclass, field, fields
+from typing import TYPE_CHECKING
 
 from pyqt_openai import (
+    DB_ARCHIVE_AFTER_DAYS,
+    DB_BACKUP_INTERVAL_HOURS,
+    DB_BACKUP_KEEP,
     DB_FILE_NAME,
     DEFAULT_AI_IMAGE_PATH,
     DEFAULT_FONT_FAMILY,
     DEFAULT_FONT_SIZE,
     DEFAULT_USER_IMAGE_PATH,
     MAXIMUM_MESSAGES_IN_PARAMETER,
+    RESPONSE_CACHE_TTL_HOURS,
     TTS_DEFAULT_AUTO_PLAY,
     TTS_DEFAULT_AUTO_STOP_SILENCE_DURATION,
     TTS_DEFAULT_PROVIDER,
@@ -18,55 +25,103 @@ from pyqt_openai import (
 )
 from pyqt_openai.lang.translations import LangClass
 
+if TYPE_CHECKING:
+    import sqlite3
+
+
+@functools.cache
+def _get_field_defaults(cls) -> tuple[tuple[str, object, object], ...]:
+    """(name, default, default_factory) of every field of the class, computed once per class."""
+    return tuple((f.name, f.default, f.default_factory) for f in fields(cls))
+
+
+@functools.cache
+def _get_keys(cls, excludes: tuple[str, ...] = ()) -> tuple[str, ...]:
+    return tuple(name for name, _, _ in _get_field_defaults(cls) if name not in excludes)
+
+
+@functools.cache
+def _get_insert_query(cls, table_name: str, excludes: tuple[str, ...] = ()) -> str:
+    field_names = _get_keys(cls, excludes)
+    columns: str = ", ".join(field_names)
+    placeholders: str = ", ".join(["?" for _ in field_names])
+    return f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
+
+
+@functools.lru_cache(maxsize=64)
+def _get_row_layout(cls, description: tuple) -> tuple[tuple, tuple]:
+    """(name, column index) of the fields selected by the cursor and
+    (name, default, default_factory) of the fields which are not.
+    """
+    columns = {column[0]: i for i, column in enumerate(description)}
+    selected = tuple(
+        (name, columns[name]) for name, _, _ in _get_field_defaults(cls) if name in columns
+    )
+    not_selected = tuple(
+        field_default for field_default in _get_field_defaults(cls) if field_default[0] not in columns
+    )
+    return selected, not_selected
+
+
+def _get_default(default, default_factory):
+    if default_factory is not MISSING:
+        return default_factory()
+    if default is not MISSING:
+        return default
+    return ""
+
 
 @dataclass
 class Container:
+    # Subclasses which are created per DB row use @dataclass(slots=True, init=False),
+    # the empty slots here keep their instances free of __dict__
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         """You don't have to call this if you want to use default class variables."""
-        for k in self.__annotations__:
-            setattr(self, k, kwargs.get(k, getattr(self, k, "")))
-        for key, value in kwargs.items():
-            if key in self.__annotations__:
-                setattr(self, key, value)
+        for name, default, default_factory in _get_field_defaults(type(self)):
+            if name in kwargs:
+                setattr(self, name, kwargs[name])
+            else:
+                setattr(self, name, _get_default(default, default_factory))
+
+    @classmethod
+    def row_factory(cls, cursor: sqlite3.Cursor, row: tuple):
+        """sqlite3 row factory which builds the container straight from the row,
+        e.g. ``cursor.row_factory = ChatMessageContainer.row_factory``.
+        Fields which are not selected get their default values.
+        """
+        selected, not_selected = _get_row_layout(cls, cursor.description)
+        obj = cls.__new__(cls)
+        for name, index in selected:
+            setattr(obj, name, row[index])
+        for name, default, default_factory in not_selected:
+            setattr(obj, name, _get_default(default, default_factory))
+        return obj
 
     @classmethod
     def get_keys(cls, excludes: list | None = None) -> list[str]:
         """Function that returns the keys of the target data type as a list.
         Exclude the keys in the "excludes" list.
         """
-        if excludes is None:
-            excludes = []
-        arr = [field.name for field in fields(cls)]
-        for exclude in excludes:
-            if exclude in arr:
-                arr.remove(exclude)
-        return arr
+        return list(_get_keys(cls, tuple(excludes or ())))
 
     def get_values_for_insert(self, excludes: list | None = None) -> list[str]:
         """Function that returns the values of the target data type as a list."""
-        if excludes is None:
-            excludes = []
-        arr = [getattr(self, key) for key in self.get_keys(excludes)]
-        return arr
+        return [getattr(self, key) for key in _get_keys(type(self), tuple(excludes or ()))]
 
     def get_items(self, excludes: list | None = None) -> list[tuple[str, str]]:
         """Function that returns the items of the target data type as a list."""
-        if excludes is None:
-            excludes = []
-        return {key: getattr(self, key) for key in self.get_keys(excludes)}.items()
+        return {key: getattr(self, key) for key in _get_keys(type(self), tuple(excludes or ()))}.items()
 
-    def create_insert_query(self, table_name: str, excludes: list | None = None) -> str:
-        if excludes is None:
-            excludes = []
+    @classmethod
+    def create_insert_query(cls, table_name: str, excludes: list | None = None) -> str:
         """
         Function to dynamically generate an SQLite insert statement.
         Takes the table name as a parameter.
+        The statement is built once per table name and excludes.
         """
-        field_names: list[str] = self.get_keys(excludes)
-        columns: str = ", ".join(field_names)
-        placeholders: str = ", ".join(["?" for _ in field_names])
-        query: str = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-        return query
+        return _get_insert_query(cls, table_name, tuple(excludes or ()))
 
 
 @dataclass
@@ -78,6 +133,20 @@ class ChatThreadContainer(Container):
 
 
 @dataclass
+class ChatThreadStatsContainer(ChatThreadContainer):
+    """Thread with the aggregates of its messages, a row of the chat list (thread_all_v)."""
+
+    message_count: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    last_role: str = ""
+    last_model: str = ""
+    preview: str = ""
+    is_archived: int = 0
+
+
+@dataclass(slots=True, init=False)
 class ChatMessageContainer(Container):
     id: str = ""
     thread_id: str = ""
@@ -87,20 +156,61 @@ class ChatMessageContainer(Container):
     update_dt: str = ""
     finish_reason: str = ""
     model: str = ""
-    prompt_tokens: str = ""
-    completion_tokens: str = ""
-    total_tokens: str = ""
+    # None if the response didn't report its usage
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+    total_tokens: int | None = None
     favorite: int = 0
     favorite_set_date: str = ""
     is_json_response_available: str = "0"
     is_g4f: int = 0
     provider: str = ""
+    # Whether the response came from the response cache
+    is_cached: int = 0
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
 
+@dataclass(slots=True, init=False)
+class MessageHistoryRecord(Container):
+    """Message of the history which is sent with the request, kept in memory (see ``SqliteDatabase.selectThreadHistory``).
+    id is None until the message is written.
+    """
 
-@dataclass
+    id: int | None = None
+    role: str = ""
+    content: str = ""
+    # Files attached to the message, None if they are not read yet
+    files: list | None = None
+    # Number of tokens of the content per tokenizer
+    token_counts: dict = field(default_factory=dict)
+
+
+@dataclass(slots=True, init=False)
+class UsageContainer(Container):
+    """Token usage of a day, model and provider (a row of usage_daily_tb)."""
+
+    day: str = ""
+    model: str = ""
+    provider: str = ""
+    message_count: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+
+
+@dataclass(slots=True, init=False)
+class ChatFileContainer(Container):
+    """File attached to a message, the data is read separately (see ``SqliteDatabase.readChatFile``)."""
+
+    id: str = ""
+    hash: str = ""
+    name: str = ""
+    mime_type: str = ""
+    size: int = 0
+    update_dt: str = ""
+    insert_dt: str = ""
+
+
+@dataclass(slots=True, init=False)
 class ImagePromptContainer(Container):
     id: str = ""
     model: str = ""
@@ -112,14 +222,14 @@ class ImagePromptContainer(Container):
     n: str = ""
     quality: str = ""
     data: str = ""
+    data_hash: str = ""
+    data_size: str = ""
+    mime_type: str = ""
     style: str = ""
     revised_prompt: str = ""
     update_dt: str = ""
     insert_dt: str = ""
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-
 
 @dataclass
 class SettingsParamsContainer(Container):
@@ -144,6 +254,13 @@ class SettingsParamsContainer(Container):
     auto_play_voice: bool = TTS_DEFAULT_AUTO_PLAY
     auto_stop_silence_duration: int = TTS_DEFAULT_AUTO_STOP_SILENCE_DURATION
 
+    archive_after_days: int = DB_ARCHIVE_AFTER_DAYS
+    backup_interval_hours: int = DB_BACKUP_INTERVAL_HOURS
+    backup_keep: int = DB_BACKUP_KEEP
+    backup_compression: bool = False
+    response_cache: bool = False
+    response_cache_ttl_hours: int = RESPONSE_CACHE_TTL_HOURS
+
 
 @dataclass
 class CustomizeParamsContainer(Container):
@@ -0,0 +1,405 @@
+from __future__ import annotations
+
+import os
+
+from qtpy.QtCore import QThread, Qt
+from qtpy.QtWidgets import (
+    QAbstractItemView,
+    QApplication,
+    QCheckBox,
+    QFormLayout,
+    QGroupBox,
+    QHBoxLayout,
+    QHeaderView,
+    QLabel,
+    QListWidget,
+    QListWidgetItem,
+    QMessageBox,
+    QProgressBar,
+    QPushButton,
+    QSpinBox,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+    QWidget,
+)
+
+from pyqt_openai import DB_ARCHIVE_AFTER_DAYS, DB_BACKUP_INTERVAL_HOURS, DB_BACKUP_KEEP, RESPONSE_CACHE_TTL_HOURS
+from pyqt_openai.config_loader import CONFIG_MANAGER
+from pyqt_openai.globals import DB
+from pyqt_openai.lang.translations import LangClass
+from pyqt_openai.util.common import restart_app, show_message_box_after_change_to_restart
+from pyqt_openai.util.db_backup import (
+    DBBackupThread,
+    get_backup_directory,
+    get_backup_filenames,
+    get_backup_time,
+)
+from pyqt_openai.util.db_maintenance import DBCompactThread, DBTableSizesThread
+
+
+def format_size(size: int) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class DatabaseWidget(QWidget):
+    """Show how much of the database file each table and index takes,
+    and manage the archive, the backups and the response cache of the database.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.__initVal()
+        self.__initUi()
+        self.__refresh()
+        self.__refreshBackups()
+
+    def __initVal(self):
+        self.archive_after_days = CONFIG_MANAGER.get_general_property("archive_after_days") or DB_ARCHIVE_AFTER_DAYS
+        self.backup_interval_hours = (
+            CONFIG_MANAGER.get_general_property("backup_interval_hours") or DB_BACKUP_INTERVAL_HOURS
+        )
+        self.backup_keep = CONFIG_MANAGER.get_general_property("backup_keep") or DB_BACKUP_KEEP
+        self.backup_compression = bool(CONFIG_MANAGER.get_general_property("backup_compression"))
+        self.response_cache = bool(CONFIG_MANAGER.get_general_property("response_cache"))
+        self.response_cache_ttl_hours = (
+            CONFIG_MANAGER.get_general_property("response_cache_ttl_hours") or RESPONSE_CACHE_TTL_HOURS
+        )
+        self.__backupThread: DBBackupThread | None = None
+        self.__compactThread: DBCompactThread | None = None
+        self.__tableSizesThread: DBTableSizesThread | None = None
+
+    def __initUi(self):
+        # TODO LANGUAGE
+        self.__filenameLbl = QLabel()
+        self.__filenameLbl.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        self.__sizeLbl = QLabel()
+        self.__freeSizeLbl = QLabel()
+        self.__walSizeLbl = QLabel()
+        self.__archiveSizeLbl = QLabel()
+        self.__autoVacuumLbl = QLabel()
+
+        self.__compactBtn = QPushButton("Compact now")
+        self.__compactBtn.setToolTip(
+            "Rebuild the file to give all of its free space back. The file is locked until it is done.",
+        )
+        self.__compactBtn.clicked.connect(self.__compact)
+
+        autoVacuumLay = QHBoxLayout()
+        autoVacuumLay.addWidget(self.__autoVacuumLbl)
+        autoVacuumLay.addStretch()
+        autoVacuumLay.addWidget(self.__compactBtn)
+
+        lay = QFormLayout()
+        lay.addRow("File", self.__filenameLbl)
+        lay.addRow("Size", self.__sizeLbl)
+        lay.addRow("Free (reclaimed when idle)", self.__freeSizeLbl)
+        lay.addRow("WAL", self.__walSizeLbl)
+        lay.addRow("Archive", self.__archiveSizeLbl)
+        lay.addRow("Auto vacuum", autoVacuumLay)
+
+        fileGrpBox = QGroupBox("File")
+        fileGrpBox.setLayout(lay)
+
+        self.__archiveAfterDaysSpinBox = QSpinBox()
+        self.__archiveAfterDaysSpinBox.setRange(0, 3650)
+        self.__archiveAfterDaysSpinBox.setSuffix(" days")
+        self.__archiveAfterDaysSpinBox.setSpecialValueText("Never")
+        self.__archiveAfterDaysSpinBox.setValue(int(self.archive_after_days))
+
+        lay = QFormLayout()
+        lay.addRow("Archive the threads not updated for", self.__archiveAfterDaysSpinBox)
+        lay.addRow(QLabel("Archived threads are moved back when they are opened."))
+
+        archiveGrpBox = QGroupBox("Archive")
+        archiveGrpBox.setLayout(lay)
+
+        self.__backupIntervalSpinBox = QSpinBox()
+        self.__backupIntervalSpinBox.setRange(0, 24 * 365)
+        self.__backupIntervalSpinBox.setSuffix(" hours")
+        self.__backupIntervalSpinBox.setSpecialValueText("Never")
+        self.__backupIntervalSpinBox.setValue(int(self.backup_interval_hours))
+
+        self.__backupKeepSpinBox = QSpinBox()
+        self.__backupKeepSpinBox.setRange(1, 100)
+        self.__backupKeepSpinBox.setValue(int(self.backup_keep))
+
+        self.__backupCompressionCheckBox = QCheckBox("Compress the backups (gzip)")
+        self.__backupCompressionCheckBox.setChecked(self.backup_compression)
+
+        backupDirLbl = QLabel(get_backup_directory())
+        backupDirLbl.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+
+        self.__backupListWidget = QListWidget()
+        self.__backupListWidget.currentItemChanged.connect(self.__backupSelectionChanged)
+
+        self.__backupProgressBar = QProgressBar()
+        self.__backupProgressBar.setVisible(False)
+
+        self.__backupBtn = QPushButton("Back up now")
+        self.__backupBtn.clicked.connect(self.__backup)
+        self.__restoreBtn = QPushButton("Restore")
+        self.__restoreBtn.setEnabled(False)
+        self.__restoreBtn.clicked.connect(self.__restore)
+
+        btnLay = QHBoxLayout()
+        btnLay.addWidget(self.__backupProgressBar)
+        btnLay.addStretch()
+        btnLay.addWidget(self.__backupBtn)
+        btnLay.addWidget(self.__restoreBtn)
+
+        lay = QFormLayout()
+        lay.addRow("Back up every", self.__backupIntervalSpinBox)
+        lay.addRow("Backups to keep", self.__backupKeepSpinBox)
+        lay.addRow(self.__backupCompressionCheckBox)
+        lay.addRow("Folder", backupDirLbl)
+        lay.addRow(self.__backupListWidget)
+        lay.addRow(btnLay)
+
+        backupGrpBox = QGroupBox("Backup")
+        backupGrpBox.setLayout(lay)
+
+        self.__responseCacheCheckBox = QCheckBox("Replay the responses of the same requests with temperature 0")
+        self.__responseCacheCheckBox.setChecked(self.response_cache)
+
+        self.__responseCacheTtlSpinBox = QSpinBox()
+        self.__responseCacheTtlSpinBox.setRange(1, 24 * 365)
+        self.__responseCacheTtlSpinBox.setSuffix(" hours")
+        self.__responseCacheTtlSpinBox.setValue(int(self.response_cache_ttl_hours))
+
+        self.__responseCacheLbl = QLabel()
+
+        clearResponseCacheBtn = QPushButton("Clear")
+        clearResponseCacheBtn.clicked.connect(self.__clearResponseCache)
+
+        cacheInfoLay = QHBoxLayout()
+        cacheInfoLay.addWidget(self.__responseCacheLbl)
+        cacheInfoLay.addStretch()
+        cacheInfoLay.addWidget(clearResponseCacheBtn)
+
+        lay = QFormLayout()
+        lay.addRow(self.__responseCacheCheckBox)
+        lay.addRow("Keep the responses for", self.__responseCacheTtlSpinBox)
+        lay.addRow("Cached", cacheInfoLay)
+
+        responseCacheGrpBox = QGroupBox("Response cache")
+        responseCacheGrpBox.setLayout(lay)
+
+        self.__tableWidget = QTableWidget()
+        self.__tableWidget.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.__tableWidget.setColumnCount(3)
+        self.__tableWidget.setHorizontalHeaderLabels(
+            [LangClass.TRANSLATIONS["Name"], "Pages", "Size"],
+        )
+        self.__tableWidget.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.__tableWidget.verticalHeader().setVisible(False)
+
+        self.__estimatedLbl = QLabel(
+            "dbstat is not available in this SQLite build, the sizes of the tables are estimated.",
+        )
+        self.__estimatedLbl.setWordWrap(True)
+        self.__estimatedLbl.setVisible(False)
+
+        self.__tableSizesLbl = QLabel()
+
+        refreshBtn = QPushButton("Refresh")
+        refreshBtn.clicked.connect(self.__refresh)
+
+        tableBtnLay = QHBoxLayout()
+        tableBtnLay.addWidget(self.__tableSizesLbl)
+        tableBtnLay.addStretch()
+        tableBtnLay.addWidget(refreshBtn)
+
+        lay = QVBoxLayout()
+        lay.addWidget(self.__tableWidget)
+        lay.addWidget(self.__estimatedLbl)
+        lay.addLayout(tableBtnLay)
+
+        tableGrpBox = QGroupBox("Tables and Indexes")
+        tableGrpBox.setLayout(lay)
+
+        lay = QVBoxLayout()
+        lay.addWidget(fileGrpBox)
+        lay.addWidget(archiveGrpBox)
+        lay.addWidget(backupGrpBox)
+        lay.addWidget(responseCacheGrpBox)
+        lay.addWidget(tableGrpBox)
+
+        self.setLayout(lay)
+
+    def __refresh(self):
+        info = DB.getFileInfo()
+        self.__filenameLbl.setText(info["filename"])
+        self.__sizeLbl.setText(f'{format_size(info["size"])} ({info["page_count"]} pages)')
+        self.__freeSizeLbl.setText(f'{format_size(info["free_size"])} ({info["freelist_count"]} pages)')
+        self.__walSizeLbl.setText(format_size(info["wal_size"]))
+        self.__archiveSizeLbl.setText(format_size(info["archive_size"]))
+        self.__autoVacuumLbl.setText(
+            {0: "None (switched by compacting)", 1: "Full (switched by compacting)", 2: "Incremental"}.get(
+                info["auto_vacuum"],
+                "",
+            ),
+        )
+        self.__compactBtn.setEnabled(self.__compactThread is None)
+
+        cache_info = DB.getResponseCacheInfo()
+        self.__responseCacheLbl.setText(f'{cache_info["count"]} responses ({format_size(cache_info["size"])})')
+
+        self.__refreshTableSizes()
+
+    def __refreshTableSizes(self):
+        # Reading every page of the file takes a while for a big one, the GUI thread doesn't wait for it
+        if self.__tableSizesThread is not None:
+            return
+        app = QApplication.instance()
+        thread = DBTableSizesThread(parent=app)
+        app.aboutToQuit.connect(thread.stop)
+        thread.sizesReady.connect(self.__showTableSizes)
+        thread.finished.connect(thread.deleteLater)
+        thread.finished.connect(self.__tableSizesThreadFinished)
+        self.__tableSizesThread = thread
+        self.__tableSizesLbl.setText("Calculating...")
+        thread.start(QThread.Priority.LowPriority)
+
+    def __tableSizesThreadFinished(self):
+        self.__tableSizesThread = None
+        self.__tableSizesLbl.setText("")
+
+    def __showTableSizes(self, table_sizes):
+        self.__tableWidget.setRowCount(len(table_sizes))
+        for i, table_size in enumerate(table_sizes):
+            pagesItem = QTableWidgetItem(str(table_size["pages"]))
+            pagesItem.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+            sizeItem = QTableWidgetItem(format_size(table_size["size"]))
+            sizeItem.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+            self.__tableWidget.setItem(i, 0, QTableWidgetItem(table_size["name"]))
+            self.__tableWidget.setItem(i, 1, pagesItem)
+            self.__tableWidget.setItem(i, 2, sizeItem)
+        self.__estimatedLbl.setVisible(any(table_size["is_estimated"] for table_size in table_sizes))
+
+    def __compact(self):
+        reply = QMessageBox.question(
+            self,
+            LangClass.TRANSLATIONS["Confirm"],
+            "Compacting rebuilds the whole file, the messages can't be saved until it is done. Compact now?",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+        )
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        # The thread belongs to the app, the settings dialog can be closed while it is running
+        app = QApplication.instance()
+        thread = DBCompactThread(parent=app)
+        app.aboutToQuit.connect(thread.stop)
+        thread.finished.connect(thread.deleteLater)
+        thread.finished.connect(self.__compactThreadFinished)
+        thread.errorOccurred.connect(self.__showError)
+        self.__compactThread = thread
+        self.__compactBtn.setEnabled(False)
+        self.__compactBtn.setText("Compacting...")
+        thread.start()
+
+    def __compactThreadFinished(self):
+        self.__compactThread = None
+        self.__compactBtn.setText("Compact now")
+        self.__refresh()
+
+    def __clearResponseCache(self):
+        DB.clearResponseCache()
+        self.__refresh()
+
+    def __refreshBackups(self):
+        self.__backupListWidget.clear()
+        for filename in get_backup_filenames():
+            backup_time = get_backup_time(filename)
+            size = os.path.getsize(filename)
+            item = QListWidgetItem(f"{backup_time:%Y-%m-%d %H:%M:%S} ({format_size(size)})")
+            item.setData(Qt.ItemDataRole.UserRole, filename)
+            self.__backupListWidget.addItem(item)
+
+    def __backupSelectionChanged(self, current, previous):
+        self.__restoreBtn.setEnabled(current is not None and self.__backupThread is None)
+
+    def __startBackupThread(self, thread: DBBackupThread):
+        # The thread belongs to the app, the settings dialog can be closed while it is running
+        app = QApplication.instance()
+        app.aboutToQuit.connect(thread.requestInterruption)
+        app.aboutToQuit.connect(thread.wait)
+        thread.finished.connect(thread.deleteLater)
+
+        self.__backupThread = thread
+        thread.progressChanged.connect(self.__backupProgressChanged)
+        thread.finished.connect(self.__backupThreadFinished)
+        thread.errorOccurred.connect(self.__showError)
+        thread.blobsMissing.connect(self.__showBlobsMissing)
+        self.__backupBtn.setEnabled(False)
+        self.__restoreBtn.setEnabled(False)
+        # Busy indicator until the first progress
+        self.__backupProgressBar.setRange(0, 0)
+        self.__backupProgressBar.setVisible(True)
+        thread.start()
+
+    def __backup(self):
+        self.__startBackupThread(
+            DBBackupThread(
+                compress=self.__backupCompressionCheckBox.isChecked(),
+                keep=self.__backupKeepSpinBox.value(),
+                parent=QApplication.instance(),
+            ),
+        )
+
+    def __restore(self):
+        item = self.__backupListWidget.currentItem()
+        if item is None:
+            return
+        reply = QMessageBox.question(
+            self,
+            LangClass.TRANSLATIONS["Confirm"],
+            f"Replace every thread, prompt and image record with the backup of {item.text()}?",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+        )
+        if reply == QMessageBox.StandardButton.Yes:
+            thread = DBBackupThread(
+                restore_filename=item.data(Qt.ItemDataRole.UserRole),
+                parent=QApplication.instance(),
+            )
+            thread.succeeded.connect(self.__restored)
+            self.__startBackupThread(thread)
+
+    def __restored(self, filename):
+        result = show_message_box_after_change_to_restart(["Restore the database"])
+        if result == QMessageBox.StandardButton.Yes:
+            restart_app()
+
+    def __backupProgressChanged(self, copied_pages, total_pages):
+        self.__backupProgressBar.setRange(0, total_pages)
+        self.__backupProgressBar.setValue(copied_pages)
+
+    def __showBlobsMissing(self, count):
+        QMessageBox.warning(
+            self,
+            LangClass.TRANSLATIONS["Warning"],
+            f"The files of {count} images are missing, those images are kept without them.",
+        )
+
+    def __showError(self, error):
+        QMessageBox.critical(self, LangClass.TRANSLATIONS["Error"], error)
+
+    def __backupThreadFinished(self):
+        self.__backupThread = None
+        self.__backupProgressBar.setVisible(False)
+        self.__backupBtn.setEnabled(True)
+        self.__refreshBackups()
+        self.__refresh()
+
+    def getParam(self):
+        return {
+            "archive_after_days": self.__archiveAfterDaysSpinBox.value(),
+            "backup_interval_hours": self.__backupIntervalSpinBox.value(),
+            "backup_keep": self.__backupKeepSpinBox.value(),
+            "backup_compression": self.__backupCompressionCheckBox.isChecked(),
+            "response_cache": self.__responseCacheCheckBox.isChecked(),
+            "response_cache_ttl_hours": self.__responseCacheTtlSpinBox.value(),
+        }
@@ -28,7 +28,7 @@ from pyqt_openai import (
 )
 from pyqt_openai.config_loader import CONFIG_MANAGER
 from pyqt_openai.lang.translations import LangClass
-from pyqt_openai.models import ChatThreadContainer, ImagePromptContainer
+from pyqt_openai.models import ChatThreadStatsContainer, ImagePromptContainer
 from pyqt_openai.widgets.checkBoxListWidget import CheckBoxListWidget
 
 
@@ -158,7 +158,7 @@ class GeneralSettingsWidget(QScrollArea):
 
         chatColAllCheckBox = QCheckBox(LangClass.TRANSLATIONS["Check All"])
         self.__chatColCheckBoxListWidget = CheckBoxListWidget()
-        for k in ChatThreadContainer.get_keys(
+        for k in ChatThreadStatsContainer.get_keys(
             excludes=COLUMN_TO_EXCLUDE_FROM_SHOW_HIDE_CHAT,
         ):
             self.__chatColCheckBoxListWidget.addItem(
@@ -14,6 +14,7 @@ from qtpy.QtWidgets import (
 from pyqt_openai.lang.translations import LangClass
 from pyqt_openai.models import SettingsParamsContainer
 from pyqt_openai.settings_dialog.apiWidget import ApiWidget
+from pyqt_openai.settings_dialog.databaseWidget import DatabaseWidget
 from pyqt_openai.settings_dialog.generalSettingsWidget import GeneralSettingsWidget
 from pyqt_openai.settings_dialog.voiceSettingsWidget import VoiceSettingsWidget
 from pyqt_openai.widgets.navWidget import NavBar
@@ -35,6 +36,7 @@ class SettingsDialog(QDialog):
         self.__generalSettingsWidget = GeneralSettingsWidget()
         self.__apiWidget = ApiWidget()
         self.__voiceSettingsWidget = VoiceSettingsWidget()
+        self.__databaseWidget = DatabaseWidget()
 
         # Dialog buttons
         buttonBox = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
@@ -47,11 +49,14 @@ class SettingsDialog(QDialog):
         self.__navBar.add(LangClass.TRANSLATIONS["General"])
         self.__navBar.add(LangClass.TRANSLATIONS["API Key"])
         self.__navBar.add(LangClass.TRANSLATIONS["TTS-STT Settings"])
+        # TODO LANGUAGE
+        self.__navBar.add("Database")
         self.__navBar.itemClicked.connect(self.__currentWidgetChanged)
 
         self.__stackedWidget.addWidget(self.__generalSettingsWidget)
         self.__stackedWidget.addWidget(self.__apiWidget)
         self.__stackedWidget.addWidget(self.__voiceSettingsWidget)
+        self.__stackedWidget.addWidget(self.__databaseWidget)
 
         self.__stackedWidget.setCurrentIndex(self.__default_index)
         self.__navBar.setActiveButton(self.__default_index)
@@ -85,6 +90,7 @@ class SettingsDialog(QDialog):
         return SettingsParamsContainer(
             **self.__generalSettingsWidget.getParam(),
             **self.__voiceSettingsWidget.getParam(),
+            **self.__databaseWidget.getParam(),
         )
 
     def __currentWidgetChanged(self, i):
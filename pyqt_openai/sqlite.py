@@ -1,38 +1,108 @@
 from __future__ import annotations
 
+import atexit
+import hashlib
 import json
 import os
+import queue
+import shutil
 import sqlite3
+import threading
+import time
 
+from collections import OrderedDict, deque
+from concurrent.futures import Future
 from datetime import datetime
 from typing import TYPE_CHECKING
 
 from pyqt_openai import (
+    ARCHIVE_DB_SUFFIX,
+    ARCHIVE_SCHEMA_NAME,
+    BLOB_DIR_SUFFIX,
+    BLOB_TABLE_NAME,
+    CHAT_FILE_CHUNK_SIZE,
+    CHAT_FILE_GRACE_DAYS,
     CHAT_FILE_TABLE_NAME,
+    DB_ARCHIVE_AFTER_DAYS,
+    DB_ARCHIVE_BATCH_SIZE,
+    DB_BACKUP_PAGES_PER_STEP,
+    DB_BACKUP_STEP_SLEEP,
+    DB_BUSY_TIMEOUT,
+    DB_CACHE_SIZE,
+    DB_INCREMENTAL_VACUUM_PAGES,
+    DB_MMAP_SIZE,
+    DB_PURGE_DELETED_AFTER_MINUTES,
+    DB_WRITE_BEHIND_BATCH_SIZE,
+    DB_WRITE_BEHIND_INTERVAL,
+    DB_WRITE_RETRY_DELAY,
+    DB_WRITE_RETRY_MAX_DELAY,
     DEFAULT_DATETIME_FORMAT,
+    HISTORY_CACHE_MAX_THREADS,
+    IMAGE_BLOB_DELETED_TR_NAME,
+    IMAGE_BLOB_INSERTED_TR_NAME,
+    IMAGE_BLOB_UPDATED_TR_NAME,
     IMAGE_TABLE_NAME,
+    IMAGE_THUMBNAIL_TABLE_NAME,
+    MESSAGE_ARCHIVE_TABLE_NAME,
+    MESSAGE_FTS_DELETED_TR_NAME,
+    MESSAGE_FTS_INSERTED_TR_NAME,
+    MESSAGE_FTS_MIN_QUERY_LENGTH,
+    MESSAGE_FTS_SNIPPET_TOKENS,
+    MESSAGE_FTS_TABLE_NAME,
+    MESSAGE_COMPRESSION_THRESHOLD,
+    MESSAGE_CONTENT_VIEW_NAME,
+    MESSAGE_FILE_ARCHIVE_TABLE_NAME,
+    MESSAGE_FILE_TABLE_NAME,
+    MESSAGE_FTS_UPDATED_TR_NAME,
     MESSAGE_TABLE_NAME,
+    MESSAGE_TOKEN_TABLE_NAME,
+    MESSAGE_TOKEN_UPDATED_TR_NAME,
     PROMPT_ENTRY_TABLE_NAME,
     PROMPT_GROUP_TABLE_NAME,
+    RESPONSE_CACHE_MAX_SIZE,
+    RESPONSE_CACHE_TABLE_NAME,
+    RESPONSE_CACHE_TTL_HOURS,
+    TEMP_ID_TABLE_NAME,
+    THREAD_ALL_UPDATED_TR_NAME,
+    THREAD_ALL_VIEW_NAME,
+    THREAD_ARCHIVE_TABLE_NAME,
+    THREAD_LIST_UPDATED_TR_NAME,
+    THREAD_LIST_VIEW_NAME,
     THREAD_MESSAGE_DELETED_TR_NAME,
     THREAD_MESSAGE_INSERTED_TR_NAME,
     THREAD_MESSAGE_UPDATED_TR_NAME,
+    THREAD_STATS_ARCHIVE_TABLE_NAME,
+    THREAD_STATS_DELETED_TR_NAME,
+    THREAD_STATS_INSERTED_TR_NAME,
+    THREAD_STATS_PREVIEW_LENGTH,
+    THREAD_STATS_TABLE_NAME,
+    THREAD_STATS_UPDATED_TR_NAME,
     THREAD_TABLE_NAME,
     THREAD_TRIGGER_NAME,
+    USAGE_DAILY_TABLE_NAME,
     get_config_directory,
 )
 from pyqt_openai.config_loader import CONFIG_MANAGER
 from pyqt_openai.models import (
+    ChatFileContainer,
     ChatMessageContainer,
+    MessageHistoryRecord,
     PromptEntryContainer,
     PromptGroupContainer,
+    UsageContainer,
 )
+from pyqt_openai.util.blob_store import BlobStore
+from pyqt_openai.util.compression import compress_text, decompress_text
 
 if TYPE_CHECKING:
     from pyqt_openai.models import (
         ImagePromptContainer,
     )
 
+# Incremental BLOB I/O (Connection.blobopen) is only in Python 3.11+,
+# on 3.10 the files are written in a single statement and read with substr()
+HAS_BLOBOPEN = hasattr(sqlite3.Connection, "blobopen")
+
 
 def get_db_filename():
     """Get the database file's name from the settings."""
@@ -42,9 +112,391 @@ def get_db_filename():
     return db_path
 
 
+def get_archive_db_filename(db_filename):
+    """Get the file name of the archive database which belongs to the database."""
+    return os.path.splitext(db_filename)[0] + ARCHIVE_DB_SUFFIX + ".db"
+
+
+def get_blob_directory(db_filename):
+    """Get the directory of the blob store (image payloads) which belongs to the database."""
+    return os.path.splitext(db_filename)[0] + BLOB_DIR_SUFFIX
+
+
+def get_archive_statements(db_filename):
+    """Get the statements which attach the archive database to a connection
+    and create the (temporary) view of the threads of both databases.
+    Every connection which lists the threads runs them, the QSqlDatabase connection of the chat list as well.
+    """
+    archive_filename = get_archive_db_filename(db_filename).replace("'", "''")
+    return [
+        f"ATTACH DATABASE '{archive_filename}' AS {ARCHIVE_SCHEMA_NAME}",
+        f"""CREATE TEMP VIEW IF NOT EXISTS {THREAD_ALL_VIEW_NAME} AS
+            SELECT *, 0 AS is_archived FROM main.{THREAD_LIST_VIEW_NAME}
+            UNION ALL
+            SELECT t.id, t.name, t.insert_dt, t.update_dt,
+                   IFNULL(s.message_count, 0), IFNULL(s.prompt_tokens, 0),
+                   IFNULL(s.completion_tokens, 0), IFNULL(s.total_tokens, 0),
+                   s.last_role, s.last_model, s.preview, 1
+            FROM {ARCHIVE_SCHEMA_NAME}.{THREAD_ARCHIVE_TABLE_NAME} AS t
+            LEFT JOIN {ARCHIVE_SCHEMA_NAME}.{THREAD_STATS_ARCHIVE_TABLE_NAME} AS s ON s.thread_id = t.id""",
+        # The chat list renames the thread through the view
+        f"""CREATE TEMP TRIGGER IF NOT EXISTS {THREAD_ALL_UPDATED_TR_NAME}
+            INSTEAD OF UPDATE OF name ON {THREAD_ALL_VIEW_NAME}
+            BEGIN
+              UPDATE {THREAD_TABLE_NAME} SET name = NEW.name WHERE id = OLD.id AND OLD.is_archived = 0;
+              UPDATE {THREAD_ARCHIVE_TABLE_NAME} SET name = NEW.name WHERE id = OLD.id AND OLD.is_archived = 1;
+            END""",
+    ]
+
+
+def _get_message_content_expr(alias=""):
+    """SQL expression of the message content as text, whether it is compressed or not.
+    The compressed content is decompressed by decompress_content() which every connection of ConnectionManager has.
+    """
+    prefix = f"{alias}." if alias else ""
+    return (
+        f"CASE WHEN {prefix}content_encoding IS NULL THEN {prefix}content "
+        f"ELSE decompress_content({prefix}content, {prefix}content_encoding) END"
+    )
+
+
+class ConnectionManager:
+    """Hands out one sqlite3 connection per thread for a single database file.
+
+    Every connection is opened in WAL mode, so a background worker can write
+    while the GUI thread (or the QSqlDatabase connection of the table models) reads
+    without running into "database is locked" errors.
+    """
+
+    def __init__(
+        self,
+        db_filename,
+        busy_timeout=DB_BUSY_TIMEOUT,
+        mmap_size=DB_MMAP_SIZE,
+        cache_size=DB_CACHE_SIZE,
+    ):
+        self.__db_filename = db_filename
+        self.__busy_timeout = int(busy_timeout)
+        self.__mmap_size = int(mmap_size)
+        self.__cache_size = int(cache_size)
+
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        # Run on every connection after it is opened (e.g. attaching the archive database)
+        self.__init_statements: list[str] = []
+        # thread ident -> connection, kept to be able to close everything on shutdown
+        self.__connections: dict[int, sqlite3.Connection] = {}
+
+    def __connect(self) -> sqlite3.Connection:
+        # check_same_thread is disabled only to allow closeAll() from the GUI thread,
+        # each connection is still used by the thread which created it.
+        conn = sqlite3.connect(
+            self.__db_filename,
+            timeout=self.__busy_timeout / 1000,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        # Only takes effect while the file is still empty (see SqliteDatabase.compact for the existing files),
+        # so it has to come before anything else
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute(f"PRAGMA busy_timeout = {self.__busy_timeout}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA mmap_size = {self.__mmap_size}")
+        conn.execute(f"PRAGMA cache_size = {self.__cache_size}")
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.create_function("decompress_content", 2, decompress_text, deterministic=True)
+        conn.commit()
+        for statement in self.__init_statements:
+            conn.execute(statement)
+        return conn
+
+    @property
+    def busyTimeout(self):
+        return self.__busy_timeout
+
+    def setInitStatements(self, statements: list[str]):
+        """Set the statements to run on every connection opened from now on."""
+        self.__init_statements = list(statements)
+
+    def getConnection(self) -> sqlite3.Connection:
+        """Get the connection of the calling thread, open it if it doesn't exist yet."""
+        conn = getattr(self.__local, "conn", None)
+        if conn is None:
+            conn = self.__connect()
+            self.__local.conn = conn
+            self.__local.cursor = conn.cursor()
+            with self.__lock:
+                # Thread idents can be reused, close the connection left by a dead thread
+                stale = self.__connections.pop(threading.get_ident(), None)
+                if stale is not None:
+                    stale.close()
+                self.__connections[threading.get_ident()] = conn
+        return conn
+
+    def getCursor(self) -> sqlite3.Cursor:
+        """Get the cursor of the calling thread."""
+        self.getConnection()
+        return self.__local.cursor
+
+    def releaseConnection(self):
+        """Close the connection of the calling thread.
+        Worker threads should call this before they finish.
+        """
+        conn = getattr(self.__local, "conn", None)
+        if conn is None:
+            return
+        with self.__lock:
+            self.__connections.pop(threading.get_ident(), None)
+        self.__local.conn = None
+        self.__local.cursor = None
+        conn.close()
+
+    def interrupt(self, ident: int):
+        """Abort the statement running on the connection of the thread ident, it raises OperationalError there."""
+        with self.__lock:
+            conn = self.__connections.get(ident)
+        if conn is not None:
+            conn.interrupt()
+
+    def closeAll(self):
+        with self.__lock:
+            connections = list(self.__connections.values())
+            self.__connections.clear()
+        for conn in connections:
+            conn.close()
+        self.__local = threading.local()
+
+
+def is_fts_supported() -> bool:
+    """Whether this SQLite build has FTS5 with the trigram tokenizer, tried on a connection of its own."""
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute("CREATE VIRTUAL TABLE fts_probe USING fts5(content, tokenize='trigram')")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+def is_busy_error(e: Exception) -> bool:
+    """Whether the error only means that another connection held the lock for too long, so retrying can succeed."""
+    message = str(e).lower()
+    return isinstance(e, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+class MessageWriter:
+    """Writes the messages in a background thread so the GUI thread never waits for the disk.
+
+    Messages are written in the order they are queued, the ones queued within the interval
+    (or up to the batch size) are committed in a single transaction.
+    While the database is locked by another connection the batch is retried with backoff (the messages queued
+    after it wait), only the messages which can't be written at all fail their future.
+    """
+
+    # Put in the queue to stop the thread after everything queued before it is written
+    __STOP = object()
+
+    def __init__(
+        self,
+        db: SqliteDatabase,
+        interval=DB_WRITE_BEHIND_INTERVAL,
+        batch_size=DB_WRITE_BEHIND_BATCH_SIZE,
+        retry_delay=DB_WRITE_RETRY_DELAY,
+        retry_max_delay=DB_WRITE_RETRY_MAX_DELAY,
+    ):
+        self.__db = db
+        self.__interval = interval / 1000
+        self.__batch_size = batch_size
+        self.__retry_delay = retry_delay / 1000
+        self.__retry_max_delay = retry_max_delay / 1000
+
+        self.__queue = queue.Queue()
+        # Number of messages queued but not written yet
+        self.__pending = 0
+        self.__pending_lock = threading.Lock()
+
+        # Daemon thread, SqliteDatabase stops it (after writing everything) at exit
+        self.__thread = threading.Thread(target=self.__run, name="MessageWriter", daemon=True)
+        self.__thread.start()
+
+    def insertMessage(self, values: list) -> Future:
+        """Queue the values of the message to insert, the future gets the id of the message."""
+        future = Future()
+        with self.__pending_lock:
+            self.__pending += 1
+        self.__queue.put((values, future))
+        return future
+
+    def submit(self, fn) -> Future:
+        """Queue fn to be called in the writer thread once the messages queued before it are written,
+        the future gets its result.
+        """
+        future = Future()
+
+        def task():
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn())
+                    except Exception as e:
+                        future.set_exception(e)
+            finally:
+                with self.__pending_lock:
+                    self.__pending -= 1
+
+        with self.__pending_lock:
+            self.__pending += 1
+        self.__queue.put(task)
+        return future
+
+    def flush(self, timeout=None):
+        """Block until every message (and function) queued so far is written."""
+        with self.__pending_lock:
+            if not self.__pending or not self.__thread.is_alive():
+                return
+        event = threading.Event()
+        self.__queue.put(event)
+        event.wait(timeout)
+
+    def close(self):
+        if self.__thread.is_alive():
+            self.__queue.put(self.__STOP)
+            self.__thread.join()
+
+    def __run(self):
+        try:
+            stop = False
+            while not stop:
+                batch = []
+                tasks = []
+                events = []
+                item = self.__queue.get()
+                deadline = time.monotonic() + self.__interval
+                while True:
+                    if item is self.__STOP:
+                        stop = True
+                        break
+                    if isinstance(item, threading.Event):
+                        # Flush is requested, don't wait for the others
+                        events.append(item)
+                        break
+                    if callable(item):
+                        # Runs after the batch, the items queued after it wait
+                        tasks.append(item)
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.__batch_size:
+                        break
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self.__queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+
+                if batch:
+                    self.__write(batch)
+                for task in tasks:
+                    task()
+                for event in events:
+                    event.set()
+        finally:
+            self.__db.releaseConnection()
+
+    def __insert(self, values_arr):
+        """Insert the messages, wait and try again as long as the database is locked."""
+        delay = self.__retry_delay
+        while True:
+            try:
+                return self.__db.insertMessageValues(values_arr)
+            except sqlite3.Error as e:
+                if not is_busy_error(e):
+                    raise
+                print(f"The database is locked, writing the messages again in {delay:.1f} s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, self.__retry_max_delay)
+
+    def __write(self, batch):
+        try:
+            ids = self.__insert([values for values, _ in batch])
+            results = [(future, id, None) for (_, future), id in zip(batch, ids)]
+        except Exception as e:
+            # Write them one by one, so a single broken message doesn't take the others with it
+            print(f"An error occurred while writing the messages, retrying one by one: {e}")
+            results = []
+            for values, future in batch:
+                try:
+                    results.append((future, self.__insert([values])[0], None))
+                except Exception as e:
+                    results.append((future, None, e))
+
+        for future, id, exception in results:
+            if exception is None:
+                future.set_result(id)
+            else:
+                future.set_exception(exception)
+        with self.__pending_lock:
+            self.__pending -= len(batch)
+
+
+class MessageHistoryCache:
+    """The last messages of the recently used threads, so the history of the request is built without the DB.
+    Each thread has a ring buffer of its last messages, the least recently used thread is dropped first.
+    """
+
+    def __init__(self, max_threads=HISTORY_CACHE_MAX_THREADS):
+        self.__max_threads = max_threads
+        # thread id: (records, whether the records were the whole thread when it was read)
+        self.__threads: OrderedDict[int, tuple[deque, bool]] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, thread_id, limit) -> list[MessageHistoryRecord] | None:
+        """Get the last "limit" records of the thread, None if they are not cached."""
+        with self.__lock:
+            entry = self.__threads.get(thread_id)
+            if entry is None:
+                return None
+            records, is_whole_thread = entry
+            # Nothing has been dropped from the whole thread, otherwise only up to the size of the buffer is there
+            if limit > records.maxlen and not (is_whole_thread and len(records) < records.maxlen):
+                return None
+            self.__threads.move_to_end(thread_id)
+            return list(records)[-limit:] if limit else []
+
+    def put(self, thread_id, records: list[MessageHistoryRecord], limit):
+        """Cache the last "limit" records of the thread, which are read from the DB."""
+        with self.__lock:
+            self.__threads[thread_id] = (deque(records, maxlen=max(limit, 1)), len(records) < limit)
+            self.__threads.move_to_end(thread_id)
+            while len(self.__threads) > self.__max_threads:
+                self.__threads.popitem(last=False)
+
+    def append(self, thread_id, record: MessageHistoryRecord):
+        """Add the new message to the thread if it is cached."""
+        with self.__lock:
+            entry = self.__threads.get(thread_id)
+            if entry is not None:
+                entry[0].append(record)
+
+    def invalidate(self, thread_ids=None):
+        """Drop the threads (every thread if thread_ids is None), they are read from the DB next time."""
+        with self.__lock:
+            if thread_ids is None:
+                self.__threads.clear()
+                return
+            for thread_id in thread_ids:
+                self.__threads.pop(thread_id, None)
+
+
 class SqliteDatabase:
     """Functions which only meant to be used frequently are defined.
     If there is no functions you want to use, use ``getCursor`` instead.
+
+    Each thread works with its own connection (see ``ConnectionManager``),
+    so the functions can be called from worker threads as well as from the GUI thread.
     """
 
     def __init__(self, db_filename=get_db_filename()):
@@ -55,30 +507,148 @@ class SqliteDatabase:
     def __initVal(self, db_filename):
         # DB file name
         self.__db_filename = db_filename or get_db_filename()
+        # Image payloads are stored outside of the db file, next to it
+        self.__blob_store = BlobStore(get_blob_directory(self.__db_filename))
+        # Whether FTS5 index of message content is available (SQLite can be built without FTS5)
+        self.__is_fts_available = False
+        # Background writer of the messages, started on the first message
+        self.__writer: MessageWriter | None = None
+        self.__writer_lock = threading.Lock()
+        # Called with (message, exception) from the writer thread when a message can't be written
+        self.__write_error_listeners = []
+        # Called with the ids of the archived threads, from the thread which archived them
+        self.__archive_listeners = []
+        # Thread shown in the chat browser, it is never archived while it is open
+        self.__open_thread_id = None
+        # Last messages of the recently used threads, the messages are added as they are inserted
+        self.__history_cache = MessageHistoryCache()
+        # Compress the long message content (opt-in, see util/compression.py)
+        self.__is_compression_enabled = bool(CONFIG_MANAGER.get_general_property("db_compression"))
+        # Columns of message_tb to select, with the content decompressed (set after the migration)
+        self.__message_columns = "*"
+        atexit.register(self.close)
+        self.__manager = ConnectionManager(
+            self.__db_filename,
+            busy_timeout=CONFIG_MANAGER.get_general_property("db_busy_timeout") or DB_BUSY_TIMEOUT,
+            mmap_size=CONFIG_MANAGER.get_general_property("db_mmap_size") or DB_MMAP_SIZE,
+            cache_size=CONFIG_MANAGER.get_general_property("db_cache_size") or DB_CACHE_SIZE,
+        )
+
+    @property
+    def __conn(self) -> sqlite3.Connection:
+        # Connection of the calling thread
+        return self.__manager.getConnection()
+
+    @property
+    def __c(self) -> sqlite3.Cursor:
+        # Cursor of the calling thread
+        return self.__manager.getCursor()
 
     def __initDb(self):
         try:
             # Connect to the database (create a new file if it doesn't exist)
-            self.__conn = sqlite3.connect(self.__db_filename)
-            self.__conn.row_factory = sqlite3.Row
-            self.__conn.execute("PRAGMA foreign_keys = ON;")
-            self.__conn.commit()
+            self.__manager.getConnection()
 
-            # create cursor
-            self.__c = self.__conn.cursor()
+            # Bring the schema up to date
+            self.__migrate()
 
-            # create conversation tables
-            self.__createThread()
+            self.__initArchive()
 
-            # create prompt tables
-            self.__createPromptGroup()
-
-            # create image tables
-            self.__createImage()
+            self.__is_fts_available = self.__checkFts()
+            self.__message_columns = ", ".join(
+                f"{_get_message_content_expr()} AS content" if row["name"] == "content" else row["name"]
+                for row in self.__c.execute(f"PRAGMA table_info({MESSAGE_TABLE_NAME})").fetchall()
+                if row["name"] != "content_encoding"
+            )
         except sqlite3.Error as e:
             print(f"An error occurred while connecting to the database: {e}")
             raise
 
+    def __getMigrations(self):
+        """Schema migrations in order, the n-th one upgrades the schema to version n.
+        Only append new migrations to the end, never reorder or remove them.
+        """
+        return [
+            # 1: tables of the versions before the schema was versioned
+            self.__createBaseSchema,
+            # 2: full-text index of message content
+            self.__createMessageFts,
+            # 3: indexes of the frequently used queries
+            self.__createHotPathIndexes,
+            # 4: image payloads moved to the blob store
+            self.__createImageBlob,
+            # 5: thumbnails of the images
+            self.__createImageThumbnail,
+            # 6: compression of the message content
+            self.__createMessageCompression,
+            # 7: aggregates of the messages of each thread
+            self.__createThreadStats,
+            # 8: files attached to the messages
+            self.__createChatFile,
+            # 9: soft delete of the threads and images
+            self.__createSoftDelete,
+            # 10: token usage stored as integers and its daily rollup
+            self.__createUsage,
+            # 11: token counts of the messages
+            self.__createMessageTokenCount,
+            # 12: cache of the responses and the flag of the cached messages
+            self.__createResponseCache,
+        ]
+
+    def __migrate(self):
+        """Apply the migrations newer than the schema version stored in ``PRAGMA user_version``.
+        Once the schema is up to date, startup only costs this single integer check.
+        """
+        try:
+            version = self.__c.execute("PRAGMA user_version").fetchone()[0]
+            migrations = self.__getMigrations()
+            for target_version in range(version + 1, len(migrations) + 1):
+                self.__c.execute("BEGIN IMMEDIATE")
+                migrations[target_version - 1]()
+                # PRAGMA doesn't accept the bound parameter
+                self.__c.execute(f"PRAGMA user_version = {target_version}")
+                self.__conn.commit()
+        except sqlite3.Error as e:
+            if self.__conn.in_transaction:
+                self.__conn.rollback()
+            print(f"An error occurred while migrating the database: {e}")
+            raise
+
+    def __createBaseSchema(self):
+        # create conversation tables
+        self.__createThread()
+
+        # create prompt tables
+        self.__createPromptGroup()
+
+        # create image tables
+        self.__createImage()
+
+    def __createHotPathIndexes(self):
+        """Create indexes of the queries which run every time the thread or image is opened."""
+        self.__c.execute(
+            f"CREATE INDEX IF NOT EXISTS {MESSAGE_TABLE_NAME}_thread_id_idx ON {MESSAGE_TABLE_NAME} (thread_id, id)",
+        )
+        self.__c.execute(
+            f"CREATE INDEX IF NOT EXISTS {MESSAGE_TABLE_NAME}_favorite_idx ON {MESSAGE_TABLE_NAME} (favorite, favorite_set_date)",
+        )
+        self.__c.execute(
+            f"CREATE INDEX IF NOT EXISTS {THREAD_TABLE_NAME}_update_dt_idx ON {THREAD_TABLE_NAME} (update_dt)",
+        )
+        self.__c.execute(
+            f"CREATE INDEX IF NOT EXISTS {IMAGE_TABLE_NAME}_insert_dt_idx ON {IMAGE_TABLE_NAME} (insert_dt)",
+        )
+        # The former trigger fired on every update of thread_tb, including the update_dt bump of the message triggers
+        self.__c.execute(f"DROP TRIGGER IF EXISTS {THREAD_TRIGGER_NAME}")
+        self.__createThreadTrigger()
+
+    def __checkFts(self):
+        try:
+            self.__c.execute(f"SELECT rowid FROM {MESSAGE_FTS_TABLE_NAME} LIMIT 0")
+            return True
+        except sqlite3.OperationalError:
+            return False
+
     def __createPromptGroup(self):
         try:
             self.__c.execute(
@@ -98,9 +668,6 @@ class SqliteDatabase:
                 )
                 # Create prompt entry
                 self.__createPromptEntry()
-
-                # Commit the transaction
-                self.__conn.commit()
         except sqlite3.Error as e:
             print(f"An error occurred while creating the table: {e}")
             raise
@@ -187,45 +754,39 @@ class SqliteDatabase:
 
                 # Check if 'name' or 'content' exists
                 if "name" in existing_columns or "content" in existing_columns:
-                    try:
-                        self.__c.execute("PRAGMA foreign_keys=OFF")  # Disable foreign key constraints temporarily
-
-                        # Rename table to a temporary name
-                        temp_table = f"{PROMPT_ENTRY_TABLE_NAME}_backup"
-                        self.__c.execute(f"ALTER TABLE {PROMPT_ENTRY_TABLE_NAME} RENAME TO {temp_table}")
-
-                        # Create the updated table structure
-                        self.__c.execute(
-                            f"""CREATE TABLE {PROMPT_ENTRY_TABLE_NAME} (
-                                                    id INTEGER PRIMARY KEY,
-                                                    group_id INTEGER NOT NULL,
-                                                    act VARCHAR(255) NOT NULL,
-                                                    prompt TEXT NOT NULL,
-                                                    insert_dt DATETIME DEFAULT CURRENT_TIMESTAMP,
-                                                    update_dt DATETIME DEFAULT CURRENT_TIMESTAMP,
-                                                    FOREIGN KEY (group_id) REFERENCES {PROMPT_GROUP_TABLE_NAME}(id)
-                                                    ON DELETE CASCADE)
-                                """,
-                        )
+                    # Runs inside of the transaction of the migration, so foreign_keys can't be switched off here.
+                    # No table refers to the prompt entries, and the entries copied keep their group_id
 
-                        # Copy data from the old table to the new table, renaming columns
-                        self.__c.execute(
-                            f"""INSERT INTO {PROMPT_ENTRY_TABLE_NAME} (id, group_id, act, prompt, insert_dt, update_dt)
-                                    SELECT id, group_id,
-                                           name AS act, content AS prompt,
-                                           insert_dt, update_dt
-                                    FROM {temp_table}
-                                """,
-                        )
+                    # Rename table to a temporary name
+                    temp_table = f"{PROMPT_ENTRY_TABLE_NAME}_backup"
+                    self.__c.execute(f"ALTER TABLE {PROMPT_ENTRY_TABLE_NAME} RENAME TO {temp_table}")
 
-                        # Drop the temporary table
-                        self.__c.execute(f"DROP TABLE {temp_table}")
-                        self.__c.execute("PRAGMA foreign_keys=ON")  # Re-enable foreign key constraints
-                        self.__conn.commit()
-                    except Exception as e:
-                        print("Error during column rename:", e)
-                        self.__conn.rollback()
-                        self.__c.execute("PRAGMA foreign_keys=ON")  # Ensure foreign keys are re-enabled
+                    # Create the updated table structure
+                    self.__c.execute(
+                        f"""CREATE TABLE {PROMPT_ENTRY_TABLE_NAME} (
+                                                id INTEGER PRIMARY KEY,
+                                                group_id INTEGER NOT NULL,
+                                                act VARCHAR(255) NOT NULL,
+                                                prompt TEXT NOT NULL,
+                                                insert_dt DATETIME DEFAULT CURRENT_TIMESTAMP,
+                                                update_dt DATETIME DEFAULT CURRENT_TIMESTAMP,
+                                                FOREIGN KEY (group_id) REFERENCES {PROMPT_GROUP_TABLE_NAME}(id)
+                                                ON DELETE CASCADE)
+                            """,
+                    )
+
+                    # Copy data from the old table to the new table, renaming columns
+                    self.__c.execute(
+                        f"""INSERT INTO {PROMPT_ENTRY_TABLE_NAME} (id, group_id, act, prompt, insert_dt, update_dt)
+                                SELECT id, group_id,
+                                       name AS act, content AS prompt,
+                                       insert_dt, update_dt
+                                FROM {temp_table}
+                            """,
+                    )
+
+                    # Drop the temporary table
+                    self.__c.execute(f"DROP TABLE {temp_table}")
                 else:
                     print(f"Table {PROMPT_ENTRY_TABLE_NAME} already updated.")
             else:
@@ -241,7 +802,6 @@ class SqliteDatabase:
                                     ON DELETE CASCADE)
                 """,
                 )
-                self.__conn.commit()
         except sqlite3.Error as e:
             print(f"An error occurred: {e}")
             raise
@@ -337,31 +897,33 @@ class SqliteDatabase:
             if thread_trigger_exists:
                 pass
             else:
-                # Create a trigger to update the update_dt column with the current timestamp
-                self.__c.execute(
-                    f"""CREATE TRIGGER {THREAD_TRIGGER_NAME}
-                             AFTER UPDATE ON {THREAD_TABLE_NAME}
-                             FOR EACH ROW
-                             BEGIN
-                               UPDATE {THREAD_TABLE_NAME}
-                               SET update_dt=CURRENT_TIMESTAMP
-                               WHERE id=OLD.id;
-                             END;""",
-                )
-            # Commit the transaction
-            self.__conn.commit()
+                self.__createThreadTrigger()
         except sqlite3.Error as e:
             print(f"An error occurred while creating the table: {e}")
             raise
 
+    def __createThreadTrigger(self):
+        """Create a trigger to update the update_dt column with the current timestamp when the thread is renamed."""
+        self.__c.execute(
+            f"""CREATE TRIGGER {THREAD_TRIGGER_NAME}
+                     AFTER UPDATE OF name ON {THREAD_TABLE_NAME}
+                     FOR EACH ROW
+                     BEGIN
+                       UPDATE {THREAD_TABLE_NAME}
+                       SET update_dt=CURRENT_TIMESTAMP
+                       WHERE id=OLD.id;
+                     END;""",
+        )
+
     def selectAllThread(self, id_arr=None):
-        """Select all thread
+        """Select all thread (except the deleted ones)
         id_arr: list of thread id.
         """
         try:
-            query = f"SELECT * FROM {THREAD_TABLE_NAME}"
+            query = f"SELECT * FROM {THREAD_TABLE_NAME} WHERE deleted_dt IS NULL"
             if id_arr:
-                query += f' WHERE id IN ({",".join(map(str, id_arr))})'
+                self.__fillTempIds(id_arr)
+                query += f" AND id IN (SELECT id FROM {TEMP_ID_TABLE_NAME})"
             self.__c.execute(query)
             return self.__c.fetchall()
         except sqlite3.Error as e:
@@ -412,16 +974,108 @@ class SqliteDatabase:
             raise
 
     def deleteThread(self, id=None):
+        """Delete the thread for good, every thread (the archived and deleted ones as well) if id is None."""
         try:
+            self.flushMessages()
             query = f"DELETE FROM {THREAD_TABLE_NAME}"
+            params = ()
             if id:
-                query += f" WHERE id = {id}"
+                query += " WHERE id = ?"
+                params = (id,)
+            else:
+                # Remove all means the archived threads as well
+                self.__deleteArchivedThreads()
+            self.__c.execute(query, params)
+            self.__conn.commit()
+            self.__history_cache.invalidate([id] if id else None)
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    def deleteThreads(self, ids, soft=None) -> bool:
+        """Delete the threads in a single transaction.
+        With soft ("soft_delete" setting if None) they are only hidden and ``restoreDeletedThreads`` brings them back
+        until ``purgeDeleted`` removes them. Returns whether they can be restored.
+        """
+        if soft is None:
+            soft = bool(CONFIG_MANAGER.get_general_property("soft_delete"))
+        try:
+            self.flushMessages()
+            self.__c.execute("BEGIN IMMEDIATE")
+            self.__fillTempIds(ids)
+            if soft:
+                self.__c.execute(
+                    f"""UPDATE {THREAD_TABLE_NAME} SET deleted_dt = CURRENT_TIMESTAMP
+                        WHERE id IN (SELECT id FROM {TEMP_ID_TABLE_NAME}) AND deleted_dt IS NULL""",
+                )
+            else:
+                # The messages and everything else which belongs to the threads go with them (ON DELETE CASCADE)
+                self.__c.execute(
+                    f"DELETE FROM {THREAD_TABLE_NAME} WHERE id IN (SELECT id FROM {TEMP_ID_TABLE_NAME})",
+                )
+            self.__conn.commit()
+            if not soft:
+                self.__history_cache.invalidate(ids)
+            return soft
+        except sqlite3.Error as e:
+            self.__conn.rollback()
+            print(f"An error occurred while deleting the threads: {e}")
+            raise
+
+    def restoreDeletedThreads(self, ids=None):
+        """Bring the soft deleted threads back (every one of them if ids is None), if they haven't been purged yet."""
+        try:
+            query = f"UPDATE {THREAD_TABLE_NAME} SET deleted_dt = NULL WHERE deleted_dt IS NOT NULL"
+            if ids is not None:
+                self.__fillTempIds(ids)
+                query += f" AND id IN (SELECT id FROM {TEMP_ID_TABLE_NAME})"
             self.__c.execute(query)
             self.__conn.commit()
         except sqlite3.Error as e:
             print(f"An error occurred: {e}")
             raise
 
+    def __createSoftDelete(self):
+        """Mark the deleted threads and images with deleted_dt instead of removing them right away (see purgeDeleted)."""
+        for table_name in [THREAD_TABLE_NAME, IMAGE_TABLE_NAME]:
+            self.__c.execute(f"ALTER TABLE {table_name} ADD COLUMN deleted_dt DATETIME")
+            # Only the deleted rows are indexed
+            self.__c.execute(
+                f"CREATE INDEX {table_name}_deleted_dt_idx ON {table_name} (deleted_dt) WHERE deleted_dt IS NOT NULL",
+            )
+        # Dropping the view drops its trigger as well
+        self.__c.execute(f"DROP VIEW {THREAD_LIST_VIEW_NAME}")
+        self.__createThreadListView("t.deleted_dt IS NULL")
+
+    def __getUndeletedThreadCondition(self, column="thread_id"):
+        # Leaves out the rows of the soft deleted threads, only the (few) deleted ones are looked up
+        return f"{column} NOT IN (SELECT id FROM main.{THREAD_TABLE_NAME} WHERE deleted_dt IS NOT NULL)"
+
+    def purgeDeleted(self, minutes=DB_PURGE_DELETED_AFTER_MINUTES):
+        """Remove the threads and images which have been soft deleted for the given minutes for good.
+        Returns the number of the removed threads and images.
+        """
+        try:
+            self.flushMessages()
+            self.__c.execute("BEGIN IMMEDIATE")
+            counts = []
+            for table_name in [THREAD_TABLE_NAME, IMAGE_TABLE_NAME]:
+                self.__c.execute(
+                    f"DELETE FROM {table_name} WHERE deleted_dt IS NOT NULL AND deleted_dt <= datetime('now', ?)",
+                    (f"-{int(minutes)} minutes",),
+                )
+                counts.append(self.__c.rowcount)
+            self.__conn.commit()
+            if counts[0]:
+                self.__history_cache.invalidate()
+            if counts[1]:
+                self.__collectGarbageBlobs()
+            return tuple(counts)
+        except sqlite3.Error as e:
+            self.__conn.rollback()
+            print(f"An error occurred while purging the deleted rows: {e}")
+            raise
+
     def __createMessageTrigger(
         self, insert_trigger=True, update_trigger=True, delete_trigger=True,
     ):
@@ -462,9 +1116,6 @@ class SqliteDatabase:
             """,
             )
 
-        # Commit the transaction
-        self.__conn.commit()
-
     def __createMessage(self):
         """Create message table."""
         try:
@@ -499,26 +1150,769 @@ class SqliteDatabase:
                 )
 
                 self.__createMessageTrigger()
-                self.__conn.commit()
         except sqlite3.Error as e:
             print(f"An error occurred while creating the table: {e}")
             raise
 
-    def selectCertainThreadMessagesRaw(self, thread_id, content_to_select=None):
-        """This is for selecting all messages in a thread with a specific thread_id.
-        The format of the result is a list of sqlite Rows.
+    def __createMessageFts(self):
+        """Create FTS5 index of message content.
+        The index is an external content table of message_tb which is kept in sync by triggers.
+        If the table has just been created, it is filled with the existing messages.
+        """
+        if not is_fts_supported():
+            # FTS5 or trigram tokenizer is not supported by this SQLite build, LIKE search is used instead
+            print("Full-text search is not available in this SQLite build")
+            return
+        fts_exists = (
+            self.__c.execute(
+                f"SELECT count(*) FROM sqlite_master WHERE type='table' AND name='{MESSAGE_FTS_TABLE_NAME}'",
+            ).fetchone()[0]
+            == 1
+        )
+        if not fts_exists:
+            # trigram tokenizer is used to keep the substring matching of the former LIKE search
+            self.__c.execute(
+                f"""CREATE VIRTUAL TABLE {MESSAGE_FTS_TABLE_NAME}
+                         USING fts5(content,
+                                    content='{MESSAGE_TABLE_NAME}',
+                                    content_rowid='id',
+                                    tokenize='trigram')""",
+            )
+            self.__createMessageFtsTriggers("NEW.content", "OLD.content")
+            # Backfill the index with the messages stored before
+            self.__c.execute(
+                f"INSERT INTO {MESSAGE_FTS_TABLE_NAME} ({MESSAGE_FTS_TABLE_NAME}) VALUES ('rebuild')",
+            )
+
+    def __createMessageFtsTriggers(self, new_content, old_content):
+        """Create the triggers which keep FTS5 index in sync with message_tb.
+        new_content, old_content: SQL expressions of the content (text) of the inserted and deleted row.
+        """
+        self.__c.execute(
+            f"""
+            CREATE TRIGGER {MESSAGE_FTS_INSERTED_TR_NAME}
+            AFTER INSERT ON {MESSAGE_TABLE_NAME}
+            BEGIN
+              INSERT INTO {MESSAGE_FTS_TABLE_NAME} (rowid, content) VALUES (NEW.id, {new_content});
+            END
+        """,
+        )
+        self.__c.execute(
+            f"""
+            CREATE TRIGGER {MESSAGE_FTS_UPDATED_TR_NAME}
+            AFTER UPDATE OF content ON {MESSAGE_TABLE_NAME}
+            BEGIN
+              INSERT INTO {MESSAGE_FTS_TABLE_NAME} ({MESSAGE_FTS_TABLE_NAME}, rowid, content)
+              VALUES ('delete', OLD.id, {old_content});
+              INSERT INTO {MESSAGE_FTS_TABLE_NAME} (rowid, content) VALUES (NEW.id, {new_content});
+            END
+        """,
+        )
+        self.__c.execute(
+            f"""
+            CREATE TRIGGER {MESSAGE_FTS_DELETED_TR_NAME}
+            AFTER DELETE ON {MESSAGE_TABLE_NAME}
+            BEGIN
+              INSERT INTO {MESSAGE_FTS_TABLE_NAME} ({MESSAGE_FTS_TABLE_NAME}, rowid, content)
+              VALUES ('delete', OLD.id, {old_content});
+            END
+        """,
+        )
+
+    def __createMessageCompression(self):
+        """Add content_encoding to message_tb, the content is compressed with it unless it is NULL.
+
+        FTS5 index keeps indexing the text: it is rebuilt to read the content through the view
+        which decompresses it, and its triggers decompress the content of the changed rows.
+        """
+        self.__c.execute(f"ALTER TABLE {MESSAGE_TABLE_NAME} ADD COLUMN content_encoding VARCHAR(16)")
+        self.__c.execute(
+            f"""CREATE VIEW {MESSAGE_CONTENT_VIEW_NAME} AS
+                SELECT id, {_get_message_content_expr()} AS content FROM {MESSAGE_TABLE_NAME}""",
+        )
+        if not self.__checkFts():
+            return
+
+        for trigger_name in [MESSAGE_FTS_INSERTED_TR_NAME, MESSAGE_FTS_UPDATED_TR_NAME, MESSAGE_FTS_DELETED_TR_NAME]:
+            self.__c.execute(f"DROP TRIGGER IF EXISTS {trigger_name}")
+        self.__c.execute(f"DROP TABLE {MESSAGE_FTS_TABLE_NAME}")
+        self.__c.execute(
+            f"""CREATE VIRTUAL TABLE {MESSAGE_FTS_TABLE_NAME}
+                     USING fts5(content,
+                                content='{MESSAGE_CONTENT_VIEW_NAME}',
+                                content_rowid='id',
+                                tokenize='trigram')""",
+        )
+        self.__createMessageFtsTriggers(_get_message_content_expr("NEW"), _get_message_content_expr("OLD"))
+        self.__c.execute(
+            f"INSERT INTO {MESSAGE_FTS_TABLE_NAME} ({MESSAGE_FTS_TABLE_NAME}) VALUES ('rebuild')",
+        )
+
+    def __initArchive(self):
+        """Attach the archive database (created if it doesn't exist) to this connection and the ones opened later."""
+        statements = get_archive_statements(self.__db_filename)
+        self.__c.execute(statements[0])
+        # auto_vacuum only takes effect while the file is still empty
+        self.__c.execute(f"PRAGMA {ARCHIVE_SCHEMA_NAME}.auto_vacuum = INCREMENTAL")
+        self.__c.execute(f"PRAGMA {ARCHIVE_SCHEMA_NAME}.journal_mode = WAL")
+        try:
+            self.__c.execute("BEGIN IMMEDIATE")
+            self.__syncArchiveTable(THREAD_TABLE_NAME, THREAD_ARCHIVE_TABLE_NAME)
+            self.__syncArchiveTable(MESSAGE_TABLE_NAME, MESSAGE_ARCHIVE_TABLE_NAME)
+            self.__syncArchiveTable(THREAD_STATS_TABLE_NAME, THREAD_STATS_ARCHIVE_TABLE_NAME)
+            self.__syncArchiveTable(MESSAGE_FILE_TABLE_NAME, MESSAGE_FILE_ARCHIVE_TABLE_NAME)
+            self.__c.execute(
+                f"""CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA_NAME}.{MESSAGE_ARCHIVE_TABLE_NAME}_thread_id_idx
+                    ON {MESSAGE_ARCHIVE_TABLE_NAME} (thread_id, id)""",
+            )
+            # The files stay in the main database, the garbage collection looks up the archived references
+            self.__c.execute(
+                f"""CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA_NAME}.{MESSAGE_FILE_ARCHIVE_TABLE_NAME}_message_id_idx
+                    ON {MESSAGE_FILE_ARCHIVE_TABLE_NAME} (message_id)""",
+            )
+            self.__c.execute(
+                f"""CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA_NAME}.{MESSAGE_FILE_ARCHIVE_TABLE_NAME}_file_id_idx
+                    ON {MESSAGE_FILE_ARCHIVE_TABLE_NAME} (file_id)""",
+            )
+            self.__conn.commit()
+        except sqlite3.Error:
+            self.__conn.rollback()
+            raise
+        for statement in statements[1:]:
+            self.__c.execute(statement)
+        self.__manager.setInitStatements(statements)
+
+    def __syncArchiveTable(self, table_name, archive_table_name):
+        """Create the archive table with the columns of the table, or add the columns which have been added since."""
+        columns = self.__c.execute(f"PRAGMA main.table_info({table_name})").fetchall()
+        archive_columns = {
+            row["name"]
+            for row in self.__c.execute(
+                f"PRAGMA {ARCHIVE_SCHEMA_NAME}.table_info({archive_table_name})",
+            ).fetchall()
+        }
+        if not archive_columns:
+            definitions = ", ".join(
+                f"{row['name']} {row['type']}" + (" PRIMARY KEY" if row["pk"] else "") for row in columns
+            )
+            self.__c.execute(f"CREATE TABLE {ARCHIVE_SCHEMA_NAME}.{archive_table_name} ({definitions})")
+            return
+        for row in columns:
+            if row["name"] not in archive_columns:
+                self.__c.execute(
+                    f"ALTER TABLE {ARCHIVE_SCHEMA_NAME}.{archive_table_name} ADD COLUMN {row['name']} {row['type']}",
+                )
+
+    def __getColumns(self, table_name, excludes=()):
+        return [
+            row["name"]
+            for row in self.__c.execute(f"PRAGMA main.table_info({table_name})").fetchall()
+            if row["name"] not in excludes
+        ]
+
+    def __copyThread(self, thread_id, to_archive):
+        """Copy the thread with its messages between the main and the archive database, return the new id.
+        The copies get new ids, so the ids reused in either database never collide.
+        The aggregates are copied to the archive, the triggers of the main database rebuild them on the way back.
+        """
+        main_tables = (f"main.{THREAD_TABLE_NAME}", f"main.{MESSAGE_TABLE_NAME}", f"main.{MESSAGE_FILE_TABLE_NAME}")
+        archive_tables = (
+            f"{ARCHIVE_SCHEMA_NAME}.{THREAD_ARCHIVE_TABLE_NAME}",
+            f"{ARCHIVE_SCHEMA_NAME}.{MESSAGE_ARCHIVE_TABLE_NAME}",
+            f"{ARCHIVE_SCHEMA_NAME}.{MESSAGE_FILE_ARCHIVE_TABLE_NAME}",
+        )
+        src, dst = (main_tables, archive_tables) if to_archive else (archive_tables, main_tables)
+
+        columns = ", ".join(self.__getColumns(THREAD_TABLE_NAME, excludes=("id",)))
+        self.__c.execute(f"INSERT INTO {dst[0]} ({columns}) SELECT {columns} FROM {src[0]} WHERE id = ?", (thread_id,))
+        new_thread_id = self.__c.lastrowid
+
+        # The content is copied as it is stored (compressed or not)
+        columns = ", ".join(self.__getColumns(MESSAGE_TABLE_NAME, excludes=("id", "thread_id")))
+        self.__c.execute(
+            f"""INSERT INTO {dst[1]} (thread_id, {columns})
+                SELECT ?, {columns} FROM {src[1]} WHERE thread_id = ? ORDER BY id""",
+            (new_thread_id, thread_id),
+        )
+
+        # The messages got new ids, match them by their order to move the references to the files along
+        self.__c.execute(
+            f"""INSERT INTO {dst[2]} (message_id, file_id, position)
+                SELECT n.id, l.file_id, l.position
+                FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS rn FROM {src[1]} WHERE thread_id = ?) AS o
+                JOIN (SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS rn FROM {dst[1]} WHERE thread_id = ?) AS n
+                  ON n.rn = o.rn
+                JOIN {src[2]} AS l ON l.message_id = o.id""",
+            (thread_id, new_thread_id),
+        )
+
+        if to_archive:
+            columns = ", ".join(self.__getColumns(THREAD_STATS_TABLE_NAME, excludes=("thread_id",)))
+            self.__c.execute(
+                f"""INSERT INTO {ARCHIVE_SCHEMA_NAME}.{THREAD_STATS_ARCHIVE_TABLE_NAME} (thread_id, {columns})
+                    SELECT ?, {columns} FROM main.{THREAD_STATS_TABLE_NAME} WHERE thread_id = ?""",
+                (new_thread_id, thread_id),
+            )
+        return new_thread_id
+
+    def __deleteArchivedThreads(self, condition="", params=()):
+        query = f"DELETE FROM {ARCHIVE_SCHEMA_NAME}.{MESSAGE_FILE_ARCHIVE_TABLE_NAME}"
+        if condition:
+            query += f""" WHERE message_id IN (
+                SELECT id FROM {ARCHIVE_SCHEMA_NAME}.{MESSAGE_ARCHIVE_TABLE_NAME} WHERE thread_id {condition}
+            )"""
+        self.__c.execute(query, params)
+        for table_name, column in [
+            (MESSAGE_ARCHIVE_TABLE_NAME, "thread_id"),
+            (THREAD_STATS_ARCHIVE_TABLE_NAME, "thread_id"),
+            (THREAD_ARCHIVE_TABLE_NAME, "id"),
+        ]:
+            query = f"DELETE FROM {ARCHIVE_SCHEMA_NAME}.{table_name}"
+            if condition:
+                query += f" WHERE {column} {condition}"
+            self.__c.execute(query, params)
+
+    def setOpenThread(self, id):
+        """Set the thread shown in the chat browser (None if there is none), see ``archiveThreads``."""
+        self.__open_thread_id = id
+
+    def addArchiveListener(self, listener):
+        """Call listener(ids) after ``archiveThreads`` moved the threads, e.g. to reload the chat list.
+        It is called from the thread which archived them (the maintenance thread).
+        """
+        self.__archive_listeners.append(listener)
+
+    def archiveThreads(self, days, batch_size=DB_ARCHIVE_BATCH_SIZE):
+        """Move the threads which haven't been updated for "days" days into the archive database,
+        except the one open in the chat browser.
+        Every batch_size threads are moved in a transaction of their own. Returns the number of the archived threads.
+        """
+        archived_ids = []
+        try:
+            self.flushMessages()
+            while True:
+                self.__c.execute("BEGIN IMMEDIATE")
+                ids = [
+                    row[0]
+                    for row in self.__c.execute(
+                        f"""SELECT id FROM main.{THREAD_TABLE_NAME}
+                            WHERE COALESCE(update_dt, insert_dt) < datetime('now', ?) AND deleted_dt IS NULL
+                            AND id IS NOT ?
+                            LIMIT ?""",
+                        (f"-{int(days)} days", self.__open_thread_id, batch_size),
+                    ).fetchall()
+                ]
+                if not ids:
+                    self.__conn.commit()
+                    break
+                for thread_id in ids:
+                    self.__copyThread(thread_id, to_archive=True)
+                # The messages (with their index entries) and the aggregates go with the thread
+                self.__fillTempIds(ids)
+                self.__c.execute(
+                    f"DELETE FROM main.{THREAD_TABLE_NAME} WHERE id IN (SELECT id FROM {TEMP_ID_TABLE_NAME})",
+                )
+                self.__conn.commit()
+                self.__history_cache.invalidate(ids)
+                archived_ids.extend(ids)
+            return len(archived_ids)
+        except sqlite3.Error as e:
+            self.__conn.rollback()
+            print(f"An error occurred while archiving the threads: {e}")
+            raise
+        finally:
+            if archived_ids:
+                for listener in self.__archive_listeners:
+                    listener(archived_ids)
+
+    def restoreThread(self, id):
+        """Move the archived thread back to the main database and return its new id
+        (None if there is no such archived thread).
+        Its update_dt becomes the time of the restore, so it isn't archived again right away.
+        """
+        try:
+            self.__c.execute("BEGIN IMMEDIATE")
+            self.__c.execute(
+                f"SELECT COUNT(*) FROM {ARCHIVE_SCHEMA_NAME}.{THREAD_ARCHIVE_TABLE_NAME} WHERE id = ?", (id,),
+            )
+            if self.__c.fetchone()[0] == 0:
+                self.__conn.rollback()
+                return None
+            thread_id = self.__copyThread(id, to_archive=False)
+            self.__deleteArchivedThreads("= ?", (id,))
+            self.__conn.commit()
+            return thread_id
+        except sqlite3.Error as e:
+            self.__conn.rollback()
+            print(f"An error occurred while restoring the thread: {e}")
+            raise
+
+    def deleteArchivedThreads(self, ids):
+        try:
+            self.__fillTempIds(ids)
+            self.__deleteArchivedThreads(f"IN (SELECT id FROM {TEMP_ID_TABLE_NAME})")
+            self.__conn.commit()
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    def deleteArchivedThread(self, id=None):
+        try:
+            if id:
+                self.__deleteArchivedThreads("= ?", (id,))
+            else:
+                self.__deleteArchivedThreads()
+            self.__conn.commit()
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    def __getThreadStatsAddSql(self, row):
+        """Statement of a trigger which adds the message (row is NEW or OLD) to the aggregates of its thread."""
+        return f"""
+            INSERT INTO {THREAD_STATS_TABLE_NAME}
+                   (thread_id, message_count, prompt_tokens, completion_tokens, total_tokens,
+                    last_message_id, last_role, last_model, preview)
+            VALUES ({row}.thread_id, 1,
+                    IFNULL(CAST({row}.prompt_tokens AS INTEGER), 0),
+                    IFNULL(CAST({row}.completion_tokens AS INTEGER), 0),
+                    IFNULL(CAST({row}.total_tokens AS INTEGER), 0),
+                    {row}.id, {row}.role, {row}.model,
+                    substr({_get_message_content_expr(row)}, 1, {THREAD_STATS_PREVIEW_LENGTH}))
+            ON CONFLICT (thread_id) DO UPDATE
+            SET message_count = message_count + 1,
+                prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                completion_tokens = completion_tokens + excluded.completion_tokens,
+                total_tokens = total_tokens + excluded.total_tokens,
+                {", ".join(
+                    f"{column} = CASE WHEN excluded.last_message_id >= IFNULL(last_message_id, 0) "
+                    f"THEN excluded.{column} ELSE {column} END"
+                    for column in ["last_message_id", "last_role", "last_model", "preview"]
+                )};
+        """
+
+    def __getThreadStatsRemoveSql(self, row):
+        """Statements of a trigger which remove the message (row is NEW or OLD) from the aggregates of its thread.
+        If it was the last message, the one before takes its place (found by the (thread_id, id) index).
+        """
+        return f"""
+            UPDATE {THREAD_STATS_TABLE_NAME}
+            SET message_count = message_count - 1,
+                prompt_tokens = prompt_tokens - IFNULL(CAST({row}.prompt_tokens AS INTEGER), 0),
+                completion_tokens = completion_tokens - IFNULL(CAST({row}.completion_tokens AS INTEGER), 0),
+                total_tokens = total_tokens - IFNULL(CAST({row}.total_tokens AS INTEGER), 0)
+            WHERE thread_id = {row}.thread_id;
+            UPDATE {THREAD_STATS_TABLE_NAME}
+            SET (last_message_id, last_role, last_model, preview) = (
+                  SELECT id, role, model, substr({_get_message_content_expr()}, 1, {THREAD_STATS_PREVIEW_LENGTH})
+                  FROM {MESSAGE_TABLE_NAME}
+                  WHERE thread_id = {row}.thread_id
+                  ORDER BY id DESC
+                  LIMIT 1
+                )
+            WHERE thread_id = {row}.thread_id AND last_message_id = {row}.id;
+        """
+
+    def __createThreadStats(self):
+        """Create the table of the aggregates of the messages of each thread, the triggers which keep it up to date
+        and the view of the threads with their aggregates (for the chat list, which can sort on them
+        without scanning message_tb).
+        """
+        self.__c.execute(
+            f"""CREATE TABLE {THREAD_STATS_TABLE_NAME}
+                     (thread_id INTEGER PRIMARY KEY,
+                      message_count INTEGER NOT NULL DEFAULT 0,
+                      prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                      completion_tokens INTEGER NOT NULL DEFAULT 0,
+                      total_tokens INTEGER NOT NULL DEFAULT 0,
+                      last_message_id INTEGER,
+                      last_role VARCHAR(255),
+                      last_model VARCHAR(255),
+                      preview TEXT,
+                      FOREIGN KEY (thread_id) REFERENCES {THREAD_TABLE_NAME}(id)
+                      ON DELETE CASCADE)""",
+        )
+
+        # Aggregate the existing messages once
+        self.__c.execute(
+            f"""INSERT INTO {THREAD_STATS_TABLE_NAME}
+                       (thread_id, message_count, prompt_tokens, completion_tokens, total_tokens, last_message_id)
+                SELECT thread_id, COUNT(*),
+                       SUM(IFNULL(CAST(prompt_tokens AS INTEGER), 0)),
+                       SUM(IFNULL(CAST(completion_tokens AS INTEGER), 0)),
+                       SUM(IFNULL(CAST(total_tokens AS INTEGER), 0)),
+                       MAX(id)
+                FROM {MESSAGE_TABLE_NAME}
+                WHERE thread_id IN (SELECT id FROM {THREAD_TABLE_NAME})
+                GROUP BY thread_id""",
+        )
+        self.__c.execute(
+            f"""UPDATE {THREAD_STATS_TABLE_NAME}
+                SET (last_role, last_model, preview) = (
+                      SELECT role, model, substr({_get_message_content_expr()}, 1, {THREAD_STATS_PREVIEW_LENGTH})
+                      FROM {MESSAGE_TABLE_NAME}
+                      WHERE id = {THREAD_STATS_TABLE_NAME}.last_message_id
+                    )""",
+        )
+
+        self.__c.execute(
+            f"""
+            CREATE TRIGGER {THREAD_STATS_INSERTED_TR_NAME}
+            AFTER INSERT ON {MESSAGE_TABLE_NAME}
+            BEGIN
+              {self.__getThreadStatsAddSql("NEW")}
+            END
+        """,
+        )
+        self.__c.execute(
+            f"""
+            CREATE TRIGGER {THREAD_STATS_UPDATED_TR_NAME}
+            AFTER UPDATE OF thread_id, role, content, model, prompt_tokens, completion_tokens, total_tokens
+            ON {MESSAGE_TABLE_NAME}
+            BEGIN
+              {self.__getThreadStatsRemoveSql("OLD")}
+              {self.__getThreadStatsAddSql("NEW")}
+            END
+        """,
+        )
+        self.__c.execute(
+            f"""
+            CREATE TRIGGER {THREAD_STATS_DELETED_TR_NAME}
+            AFTER DELETE ON {MESSAGE_TABLE_NAME}
+            BEGIN
+              {self.__getThreadStatsRemoveSql("OLD")}
+            END
+        """,
+        )
+
+        self.__createThreadListView()
+
+    def __createThreadListView(self, condition=""):
+        """Create the view of the chat list, the threads with their aggregates."""
+        self.__c.execute(
+            f"""CREATE VIEW {THREAD_LIST_VIEW_NAME} AS
+                SELECT t.id, t.name, t.insert_dt, t.update_dt,
+                       IFNULL(s.message_count, 0) AS message_count,
+                       IFNULL(s.prompt_tokens, 0) AS prompt_tokens,
+                       IFNULL(s.completion_tokens, 0) AS completion_tokens,
+                       IFNULL(s.total_tokens, 0) AS total_tokens,
+                       s.last_role, s.last_model, s.preview
+                FROM {THREAD_TABLE_NAME} AS t
+                LEFT JOIN {THREAD_STATS_TABLE_NAME} AS s ON s.thread_id = t.id
+                {f"WHERE {condition}" if condition else ""}""",
+        )
+        # The chat list renames the thread through the view
+        self.__c.execute(
+            f"""
+            CREATE TRIGGER {THREAD_LIST_UPDATED_TR_NAME}
+            INSTEAD OF UPDATE OF name ON {THREAD_LIST_VIEW_NAME}
+            BEGIN
+              UPDATE {THREAD_TABLE_NAME} SET name = NEW.name WHERE id = OLD.id;
+            END
+        """,
+        )
+
+    def __getUsageAddQuery(self, condition):
+        """Add the usage of the messages which meet the condition to the daily rollup."""
+        return f"""
+            INSERT INTO {USAGE_DAILY_TABLE_NAME}
+                   (day, model, provider, message_count, prompt_tokens, completion_tokens, total_tokens)
+            SELECT DATE(insert_dt, 'localtime'), IFNULL(model, ''), IFNULL(provider, ''), COUNT(*),
+                   SUM(IFNULL(prompt_tokens, 0)), SUM(IFNULL(completion_tokens, 0)), SUM(total_tokens)
+            FROM {MESSAGE_TABLE_NAME}
+            WHERE {condition} AND typeof(total_tokens) = 'integer'
+            GROUP BY 1, 2, 3
+            ON CONFLICT (day, model, provider) DO UPDATE
+            SET message_count = message_count + excluded.message_count,
+                prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                completion_tokens = completion_tokens + excluded.completion_tokens,
+                total_tokens = total_tokens + excluded.total_tokens
+        """
+
+    def __createUsage(self):
+        """Store the token counts as integers (the older versions stored "")
+        and create the daily rollup of the usage, filled with the messages which have it.
+        """
+        # Converting the empty strings doesn't change the threads, keep their update_dt
+        self.__c.execute(f"DROP TRIGGER IF EXISTS {THREAD_MESSAGE_UPDATED_TR_NAME}")
+        self.__c.execute(
+            f"""UPDATE {MESSAGE_TABLE_NAME}
+                SET prompt_tokens = NULLIF(prompt_tokens, ''),
+                    completion_tokens = NULLIF(completion_tokens, ''),
+                    total_tokens = NULLIF(total_tokens, '')
+                WHERE prompt_tokens = '' OR completion_tokens = '' OR total_tokens = ''""",
+        )
+        self.__createMessageTrigger(insert_trigger=False, update_trigger=True, delete_trigger=False)
+
+        self.__c.execute(
+            f"""CREATE TABLE {USAGE_DAILY_TABLE_NAME}
+                     (day DATE NOT NULL,
+                      model VARCHAR(255) NOT NULL,
+                      provider VARCHAR(255) NOT NULL,
+                      message_count INTEGER NOT NULL DEFAULT 0,
+                      prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                      completion_tokens INTEGER NOT NULL DEFAULT 0,
+                      total_tokens INTEGER NOT NULL DEFAULT 0,
+                      PRIMARY KEY (day, model, provider)) WITHOUT ROWID""",
+        )
+        self.__c.execute(self.__getUsageAddQuery("1"))
+
+    def selectUsage(self, start_day=None, end_day=None) -> list[UsageContainer]:
+        """Get the daily token usage per model and provider, the newest day first.
+        start_day and end_day (inclusive, "YYYY-MM-DD" in local time) limit the days if given.
+        """
+        try:
+            self.flushMessages()
+            c = self.__getContainerCursor(UsageContainer)
+            return c.execute(
+                f"""SELECT * FROM {USAGE_DAILY_TABLE_NAME}
+                    WHERE day >= IFNULL(?, day) AND day <= IFNULL(?, day)
+                    ORDER BY day DESC, total_tokens DESC""",
+                (start_day, end_day),
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    def __createMessageTokenCount(self):
+        """Create the table of the number of tokens of the message content per tokenizer (see ``selectMessageTokenCounts``).
+        The counts of a message are removed with it or when its content changes.
+        """
+        self.__c.execute(
+            f"""CREATE TABLE {MESSAGE_TOKEN_TABLE_NAME}
+                     (message_id INTEGER NOT NULL,
+                      encoding VARCHAR(255) NOT NULL,
+                      token_count INTEGER NOT NULL,
+                      PRIMARY KEY (message_id, encoding),
+                      FOREIGN KEY (message_id) REFERENCES {MESSAGE_TABLE_NAME}(id)
+                      ON DELETE CASCADE) WITHOUT ROWID""",
+        )
+        self.__c.execute(
+            f"""
+            CREATE TRIGGER {MESSAGE_TOKEN_UPDATED_TR_NAME}
+            AFTER UPDATE OF content ON {MESSAGE_TABLE_NAME}
+            BEGIN
+              DELETE FROM {MESSAGE_TOKEN_TABLE_NAME} WHERE message_id = OLD.id;
+            END
+        """,
+        )
+
+    def selectMessageTokenCounts(self, message_ids) -> dict[int, dict[str, int]]:
+        """Get the stored number of tokens of the messages by message id and tokenizer (encoding),
+        the messages which are not counted yet are left out.
+        """
+        try:
+            self.__fillTempIds(message_ids)
+            self.__c.execute(
+                f"""SELECT message_id, encoding, token_count FROM {MESSAGE_TOKEN_TABLE_NAME}
+                    WHERE message_id IN (SELECT id FROM {TEMP_ID_TABLE_NAME})""",
+            )
+            result: dict[int, dict[str, int]] = {}
+            for row in self.__c.fetchall():
+                result.setdefault(row["message_id"], {})[row["encoding"]] = row["token_count"]
+            return result
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    def insertMessageTokenCountsLater(self, encoding, records: list[MessageHistoryRecord]) -> Future:
+        """Store record.token_counts[encoding] of the records with the background writer.
+        It runs after the messages queued before, so the records of those have their ids by then.
+        """
+
+        def insert():
+            token_counts = {
+                record.id: record.token_counts[encoding]
+                for record in records
+                if record.id is not None and encoding in record.token_counts
+            }
+            if token_counts:
+                self.insertMessageTokenCounts(encoding, token_counts)
+
+        return self.__getWriter().submit(insert)
+
+    def insertMessageTokenCounts(self, encoding, token_counts: dict[int, int]):
+        """Store the number of tokens of the messages (by message id) counted with the tokenizer.
+        The messages which have been deleted in the meantime are skipped.
+        """
+        try:
+            self.__c.executemany(
+                f"""INSERT OR REPLACE INTO {MESSAGE_TOKEN_TABLE_NAME} (message_id, encoding, token_count)
+                    SELECT id, ?, ? FROM {MESSAGE_TABLE_NAME} WHERE id = ?""",
+                ((encoding, token_count, message_id) for message_id, token_count in token_counts.items()),
+            )
+            self.__conn.commit()
+        except sqlite3.Error as e:
+            self.__conn.rollback()
+            print(f"An error occurred: {e}")
+            raise
+
+    def __createResponseCache(self):
+        """Create the cache of the responses by the hash of their request (see util/response_cache.py)
+        and mark the messages which have been replayed from it.
+        """
+        self.__c.execute(f"ALTER TABLE {MESSAGE_TABLE_NAME} ADD COLUMN is_cached INT DEFAULT 0")
+        self.__c.execute(
+            f"""CREATE TABLE {RESPONSE_CACHE_TABLE_NAME}
+                     (key CHAR(64) PRIMARY KEY,
+                      model VARCHAR(255),
+                      provider VARCHAR(255),
+                      content TEXT NOT NULL,
+                      size INTEGER NOT NULL,
+                      hit_count INTEGER NOT NULL DEFAULT 0,
+                      last_used_dt DATETIME DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+                      insert_dt DATETIME DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')))""",
+        )
+        self.__c.execute(
+            f"""CREATE INDEX {RESPONSE_CACHE_TABLE_NAME}_last_used_dt_idx
+                ON {RESPONSE_CACHE_TABLE_NAME} (last_used_dt)""",
+        )
+
+    def selectResponseCache(self, key, ttl_hours=RESPONSE_CACHE_TTL_HOURS) -> str | None:
+        """Get the cached content of the response by the key of its request,
+        None if it is not cached or older than ttl_hours. A hit makes it the most recently used one.
+        """
+        try:
+            row = self.__c.execute(
+                f"""SELECT content FROM {RESPONSE_CACHE_TABLE_NAME}
+                    WHERE key = ? AND insert_dt > strftime('%Y-%m-%d %H:%M:%f', 'now', ?)""",
+                (key, f"-{int(ttl_hours)} hours"),
+            ).fetchone()
+            if row is None:
+                return None
+            self.__c.execute(
+                f"""UPDATE {RESPONSE_CACHE_TABLE_NAME}
+                    SET hit_count = hit_count + 1, last_used_dt = strftime('%Y-%m-%d %H:%M:%f', 'now')
+                    WHERE key = ?""",
+                (key,),
+            )
+            self.__conn.commit()
+            return row["content"]
+        except sqlite3.Error as e:
+            self.__conn.rollback()
+            print(f"An error occurred: {e}")
+            raise
+
+    def insertResponseCache(self, key, content, model=None, provider=None, max_size=RESPONSE_CACHE_MAX_SIZE):
+        """Cache the content of the response by the key of its request,
+        then evict the least recently used responses which don't fit in max_size bytes.
+        """
+        try:
+            size = len(content.encode("utf-8"))
+            if size > max_size:
+                return
+            self.__c.execute(
+                f"""INSERT OR REPLACE INTO {RESPONSE_CACHE_TABLE_NAME} (key, model, provider, content, size)
+                    VALUES (?, ?, ?, ?, ?)""",
+                (key, model, provider, content, size),
+            )
+            self.__c.execute(
+                f"""DELETE FROM {RESPONSE_CACHE_TABLE_NAME}
+                    WHERE key IN (SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY last_used_dt DESC, rowid DESC) AS total
+                                                   FROM {RESPONSE_CACHE_TABLE_NAME})
+                                  WHERE total > ?)""",
+                (max_size,),
+            )
+            self.__conn.commit()
+        except sqlite3.Error as e:
+            self.__conn.rollback()
+            print(f"An error occurred: {e}")
+            raise
+
+    def purgeResponseCache(self, ttl_hours=RESPONSE_CACHE_TTL_HOURS):
+        """Remove the cached responses older than ttl_hours."""
+        try:
+            self.__c.execute(
+                f"DELETE FROM {RESPONSE_CACHE_TABLE_NAME} WHERE insert_dt <= strftime('%Y-%m-%d %H:%M:%f', 'now', ?)",
+                (f"-{int(ttl_hours)} hours",),
+            )
+            self.__conn.commit()
+        except sqlite3.Error as e:
+            self.__conn.rollback()
+            print(f"An error occurred: {e}")
+            raise
+
+    def clearResponseCache(self):
+        try:
+            self.__c.execute(f"DELETE FROM {RESPONSE_CACHE_TABLE_NAME}")
+            self.__conn.commit()
+        except sqlite3.Error as e:
+            self.__conn.rollback()
+            print(f"An error occurred: {e}")
+            raise
+
+    def getResponseCacheInfo(self):
+        """Get the number of the cached responses and the size (bytes) of their content."""
+        try:
+            row = self.__c.execute(
+                f"SELECT COUNT(*) AS count, IFNULL(SUM(size), 0) AS size FROM {RESPONSE_CACHE_TABLE_NAME}",
+            ).fetchone()
+            return {"count": row["count"], "size": row["size"]}
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    def __getMessageInsertQuery(self, excludes):
+        """Insert query of the values of ChatMessageContainer (see ``__toMessageRow``)."""
+        keys = ChatMessageContainer.get_keys(excludes) + ["content_encoding"]
+        return f"INSERT INTO {MESSAGE_TABLE_NAME} ({', '.join(keys)}) VALUES ({', '.join('?' * len(keys))})"
+
+    def __toMessageRow(self, values, excludes):
+        """Values of ChatMessageContainer to insert, with the content compressed if needed and its encoding."""
+        values = list(values)
+        encoding = None
+        if self.__is_compression_enabled:
+            content_index = ChatMessageContainer.get_keys(excludes).index("content")
+            values[content_index], encoding = compress_text(values[content_index], MESSAGE_COMPRESSION_THRESHOLD)
+        values.append(encoding)
+        return values
+
+    def __isFtsSearchable(self, content_to_select):
+        return self.__is_fts_available and len(content_to_select) >= MESSAGE_FTS_MIN_QUERY_LENGTH
+
+    @staticmethod
+    def __toFtsPhrase(content_to_select):
+        # Quote as a phrase so the operators of FTS5 query syntax are treated as plain text
+        return '"' + content_to_select.replace('"', '""') + '"'
+
+    def __getContentCondition(self, content_to_select):
+        """Get the WHERE condition (and its parameter) which selects the messages including content_to_select.
+        FTS5 index is used if possible, otherwise it falls back to LIKE.
         """
+        if self.__isFtsSearchable(content_to_select):
+            return (
+                f"id IN (SELECT rowid FROM {MESSAGE_FTS_TABLE_NAME} WHERE {MESSAGE_FTS_TABLE_NAME} MATCH ?)",
+                self.__toFtsPhrase(content_to_select),
+            )
+        # LIKE is case-insensitive for ASCII characters in SQLite
+        return f"{_get_message_content_expr()} LIKE ?", f"%{content_to_select}%"
+
+    def __getContainerCursor(self, container_cls) -> sqlite3.Cursor:
+        """Cursor which builds the container straight from each row, without going through sqlite3.Row and dict."""
+        cursor = self.__conn.cursor()
+        cursor.row_factory = container_cls.row_factory
+        return cursor
+
+    def __getCertainThreadMessagesQuery(self, thread_id, content_to_select=None):
         # Begin the query with the thread_id filter
-        query = f"SELECT * FROM {MESSAGE_TABLE_NAME} WHERE thread_id = ?"
+        query = f"SELECT {self.__message_columns} FROM {MESSAGE_TABLE_NAME} WHERE thread_id = ?"
         params = [thread_id]  # Start the parameter list with the thread_id
 
         # If content_to_select is provided, append to the query
         if content_to_select:
-            query += " AND LOWER(content) LIKE LOWER(?)"  # Modify for case-insensitive
-            params.append(f"%{content_to_select}%")  # Use parameterized placeholder
+            condition, param = self.__getContentCondition(content_to_select)
+            query += f" AND {condition}"
+            params.append(param)  # Use parameterized placeholder
+        return query, params
+
+    def selectCertainThreadMessagesRaw(self, thread_id, content_to_select=None):
+        """This is for selecting all messages in a thread with a specific thread_id.
+        The format of the result is a list of sqlite Rows.
+        """
+        self.flushMessages()
 
         # Execute the query with parameters
-        self.__c.execute(query, params)
+        self.__c.execute(*self.__getCertainThreadMessagesQuery(thread_id, content_to_select))
 
         # Fetch all results and return
         return self.__c.fetchall()
@@ -529,34 +1923,159 @@ class SqliteDatabase:
         """This is for selecting all messages in a thread with a specific thread_id.
         The format of the result is a list of ChatMessageContainer.
         """
-        result = [
-            ChatMessageContainer(**elem)
-            for elem in self.selectCertainThreadMessagesRaw(
-                thread_id, content_to_select=content_to_select,
+        self.flushMessages()
+
+        cursor = self.__getContainerCursor(ChatMessageContainer)
+        cursor.execute(*self.__getCertainThreadMessagesQuery(thread_id, content_to_select))
+        return cursor.fetchall()
+
+    def countCertainThreadMessages(self, thread_id) -> int:
+        try:
+            self.flushMessages()
+            self.__c.execute(
+                f"SELECT COUNT(*) FROM {MESSAGE_TABLE_NAME} WHERE thread_id = ?", (thread_id,),
             )
-        ]
-        return result
+            return self.__c.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    def __selectThreadMessagesPage(
+        self, thread_id, limit, before_id=None, after_id=None,
+    ) -> list[ChatMessageContainer]:
+        """Select a page of the messages by keyset pagination on id (which uses the (thread_id, id) index),
+        so only the rows of the page are read no matter how long the thread is.
+        The result is always in ascending order of id.
+        """
+        try:
+            self.flushMessages()
+            cursor = self.__getContainerCursor(ChatMessageContainer)
+            query = f"SELECT {self.__message_columns} FROM {MESSAGE_TABLE_NAME} WHERE thread_id = ?"
+            params = [thread_id]
+            if after_id is not None:
+                query += " AND id > ? ORDER BY id LIMIT ?"
+                params += [after_id, limit]
+                return cursor.execute(query, params).fetchall()
+            if before_id is not None:
+                query += " AND id < ?"
+                params.append(before_id)
+            query += " ORDER BY id DESC LIMIT ?"
+            params.append(limit)
+            return cursor.execute(query, params).fetchall()[::-1]
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    def selectLastThreadMessages(self, thread_id, limit) -> list[ChatMessageContainer]:
+        """Select the last "limit" messages of the thread."""
+        return self.__selectThreadMessagesPage(thread_id, limit)
+
+    def selectThreadMessagesBefore(self, thread_id, before_id, limit) -> list[ChatMessageContainer]:
+        """Select "limit" messages of the thread right before the message of before_id."""
+        return self.__selectThreadMessagesPage(thread_id, limit, before_id=before_id)
+
+    def selectThreadMessagesAfter(self, thread_id, after_id, limit) -> list[ChatMessageContainer]:
+        """Select "limit" messages of the thread right after the message of after_id."""
+        return self.__selectThreadMessagesPage(thread_id, limit, after_id=after_id)
+
+    def selectThreadHistory(self, thread_id, limit) -> list[MessageHistoryRecord]:
+        """Get the last "limit" messages of the thread to send as the history.
+        They are read from the DB once, then the cache is kept up to date by the inserts of the messages.
+        """
+        records = self.__history_cache.get(thread_id, limit)
+        if records is None:
+            records = [
+                MessageHistoryRecord(id=message.id, role=message.role, content=message.content)
+                for message in self.selectLastThreadMessages(thread_id, limit)
+            ]
+            # The stored token counts come along, so building the request never reads them
+            token_counts = self.selectMessageTokenCounts([record.id for record in records])
+            for record in records:
+                record.token_counts.update(token_counts.get(record.id, {}))
+            self.__history_cache.put(thread_id, records, limit)
+        return records
 
     def selectAllContentOfThread(self, content_to_select=None):
         """This is for selecting all messages in all threads which include the content_to_select."""
+        self.flushMessages()
+
+        query = f"SELECT {self.__message_columns} FROM {MESSAGE_TABLE_NAME} WHERE {self.__getUndeletedThreadCondition()}"
+        params = []
+        if content_to_select:
+            condition, param = self.__getContentCondition(content_to_select)
+            query += f" AND {condition}"
+            params.append(param)
+        query += " ORDER BY thread_id, id"
+
+        # Group the messages by the thread in a single pass
         arr = []
-        for _id in [conv[0] for conv in self.selectAllThread()]:
-            result = self.selectCertainThreadMessages(_id, content_to_select)
-            if result:
-                arr.append((_id, result))
+        for message in self.__getContainerCursor(ChatMessageContainer).execute(query, params).fetchall():
+            if not arr or arr[-1][0] != message.thread_id:
+                arr.append((message.thread_id, []))
+            arr[-1][1].append(message)
         return arr
 
+    def selectThreadsByContent(self, content_to_select):
+        """Select the threads which include content_to_select in their messages.
+        The result is a list of sqlite Rows with thread_id, match_count, snippet (preview of the best match)
+        and is_archived, ordered by relevance if FTS5 index is available, otherwise by the latest match.
+        The archived threads come after the others.
+        """
+        try:
+            self.flushMessages()
+            if self.__isFtsSearchable(content_to_select):
+                # "LIMIT -1" keeps the subquery from being flattened into the aggregate,
+                # snippet() can only be used in the query on the FTS table itself
+                query = f"""
+                    SELECT m.thread_id, COUNT(*) AS match_count, MIN(f.rank) AS best_rank, f.snippet, 0 AS is_archived
+                    FROM (SELECT rowid, rank,
+                                 snippet({MESSAGE_FTS_TABLE_NAME}, 0, '[', ']', '...', {MESSAGE_FTS_SNIPPET_TOKENS}) AS snippet
+                          FROM {MESSAGE_FTS_TABLE_NAME}
+                          WHERE {MESSAGE_FTS_TABLE_NAME} MATCH ?
+                          LIMIT -1) AS f
+                    JOIN {MESSAGE_TABLE_NAME} AS m ON m.id = f.rowid
+                    WHERE {self.__getUndeletedThreadCondition("m.thread_id")}
+                    GROUP BY m.thread_id
+                    ORDER BY best_rank
+                """
+                threads = self.__c.execute(query, (self.__toFtsPhrase(content_to_select),)).fetchall()
+            else:
+                threads = self.__selectThreadsByContentLike(
+                    f"main.{MESSAGE_TABLE_NAME}", content_to_select, is_archived=False,
+                    condition=self.__getUndeletedThreadCondition(),
+                )
+            # The archive is cold, it is searched without the index
+            return threads + self.__selectThreadsByContentLike(
+                f"{ARCHIVE_SCHEMA_NAME}.{MESSAGE_ARCHIVE_TABLE_NAME}", content_to_select, is_archived=True,
+            )
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    def __selectThreadsByContentLike(self, table_name, content_to_select, is_archived, condition="1"):
+        query = f"""
+            SELECT thread_id, COUNT(*) AS match_count, MAX(id) AS last_id,
+                   substr({_get_message_content_expr()}, 1, {MESSAGE_FTS_SNIPPET_TOKENS}) AS snippet,
+                   {int(is_archived)} AS is_archived
+            FROM {table_name}
+            WHERE {_get_message_content_expr()} LIKE ? AND {condition}
+            GROUP BY thread_id
+            ORDER BY last_id DESC
+        """
+        return self.__c.execute(query, (f"%{content_to_select}%",)).fetchall()
+
     def insertMessage(self, arg: ChatMessageContainer, deactivate_trigger=False):
         try:
             if deactivate_trigger:
                 # Remove the trigger
                 self.__c.execute(f"DROP TRIGGER {THREAD_MESSAGE_INSERTED_TR_NAME}")
             excludes = ["id", "update_dt", "insert_dt"]
-            insert_query = arg.create_insert_query(
-                table_name=MESSAGE_TABLE_NAME, excludes=excludes,
+            insert_query = self.__getMessageInsertQuery(excludes)
+            self.__c.execute(
+                insert_query, self.__toMessageRow(arg.get_values_for_insert(excludes=excludes), excludes),
             )
-            self.__c.execute(insert_query, arg.get_values_for_insert(excludes=excludes))
             new_id = self.__c.lastrowid
+            self.__c.execute(self.__getUsageAddQuery("id = ?"), (new_id,))
             if deactivate_trigger:
                 # Create the trigger
                 self.__createMessageTrigger(
@@ -565,14 +2084,169 @@ class SqliteDatabase:
 
             # Commit the transaction
             self.__conn.commit()
+            self.__history_cache.append(
+                arg.thread_id, MessageHistoryRecord(id=new_id, role=arg.role, content=arg.content, files=[]),
+            )
             return new_id
         except sqlite3.Error as e:
             print(f"An error occurred: {e}")
             raise
 
+    def __getWriter(self) -> MessageWriter:
+        with self.__writer_lock:
+            if self.__writer is None:
+                self.__writer = MessageWriter(self)
+            return self.__writer
+
+    def insertMessageLater(self, arg: ChatMessageContainer, files=None) -> Future:
+        """Queue the message to be written by the background writer and return right away.
+        arg.id is set when the message is written, the future gets the id as well.
+        The files (the data or the paths, see ``insertChatFile``) are hashed, stored and attached to the message
+        by the writer thread once the message is written.
+
+        The values are taken at the moment of the call, so arg can be changed afterward.
+        Functions of this class which read the messages wait for the queued ones,
+        use ``flushMessages`` before reading message_tb with the other connections.
+        """
+        excludes = ["id", "update_dt", "insert_dt"]
+        future = self.__getWriter().insertMessage(arg.get_values_for_insert(excludes=excludes))
+        # The files are read when they are needed
+        record = MessageHistoryRecord(role=arg.role, content=arg.content, files=None if files else [])
+        self.__history_cache.append(arg.thread_id, record)
+
+        def setId(f: Future):
+            # Called in the writer thread
+            error = f.exception()
+            if error is None:
+                arg.id = record.id = f.result()
+                if files:
+                    try:
+                        self.insertMessageFiles(arg.id, files)
+                    except (sqlite3.Error, OSError) as e:
+                        error = e
+            if error is not None:
+                # The message (or its files) is not in the DB, read the thread again
+                self.__history_cache.invalidate([arg.thread_id])
+                for listener in self.__write_error_listeners:
+                    listener(arg, error)
+
+        future.add_done_callback(setId)
+        return future
+
+    def addMessageWriteErrorListener(self, listener):
+        """Call listener(message, exception) when a message queued by ``insertMessageLater`` can't be written.
+        It is called from the writer thread, e.g. emit a signal to show it in the GUI.
+        """
+        self.__write_error_listeners.append(listener)
+
+    def insertMessageValues(self, values_arr: list[list]) -> list[int]:
+        """Insert the messages (values in the order of ChatMessageContainer keys) in a single transaction."""
+        try:
+            excludes = ["id", "update_dt", "insert_dt"]
+            insert_query = self.__getMessageInsertQuery(excludes)
+            self.__c.execute("BEGIN IMMEDIATE")
+            ids = []
+            for values in values_arr:
+                self.__c.execute(insert_query, self.__toMessageRow(values, excludes))
+                ids.append(self.__c.lastrowid)
+            self.__c.executemany(self.__getUsageAddQuery("id = ?"), ((id,) for id in ids))
+            self.__conn.commit()
+            return ids
+        except sqlite3.Error as e:
+            self.__conn.rollback()
+            print(f"An error occurred: {e}")
+            raise
+
+    def flushMessages(self, timeout=None):
+        """Wait until the messages queued by ``insertMessageLater`` are written."""
+        if self.__writer is not None:
+            self.__writer.flush(timeout)
+
+    def importThreads(self, data: list[dict]) -> list[int]:
+        """Import threads with their messages in a single transaction.
+        data: list of thread dicts (name, insert_dt, update_dt, messages),
+        the format which is used by the import dialog and ``export``.
+
+        The triggers which update thread_tb.update_dt are suspended once for the whole import,
+        so the imported threads keep their own update_dt.
+        Returns the ids of the imported threads.
+        """
+        excludes = ["id", "update_dt", "insert_dt"]
+        insert_query = self.__getMessageInsertQuery(excludes)
+        try:
+            # Take the write lock up front instead of failing in the middle of the import
+            self.__c.execute("BEGIN IMMEDIATE")
+            self.__c.execute(f"DROP TRIGGER IF EXISTS {THREAD_MESSAGE_INSERTED_TR_NAME}")
+            self.__c.execute(f"DROP TRIGGER IF EXISTS {THREAD_TRIGGER_NAME}")
+
+            thread_ids = []
+            for thread in data:
+                self.__c.execute(
+                    f"""INSERT INTO {THREAD_TABLE_NAME} (name, insert_dt, update_dt)
+                        VALUES (?, COALESCE(?, CURRENT_TIMESTAMP), ?)""",
+                    (thread["name"], thread.get("insert_dt"), thread.get("update_dt")),
+                )
+                thread_id = self.__c.lastrowid
+                thread_ids.append(thread_id)
+                self.__c.executemany(
+                    insert_query,
+                    (
+                        self.__toMessageRow(
+                            ChatMessageContainer(
+                                **{**message, "thread_id": thread_id},
+                            ).get_values_for_insert(excludes=excludes),
+                            excludes,
+                        )
+                        for message in thread["messages"]
+                    ),
+                )
+
+            # Threads imported without update_dt get their insert_dt, in one statement
+            self.__fillTempIds(thread_ids)
+            self.__c.execute(
+                f"""UPDATE {THREAD_TABLE_NAME}
+                    SET update_dt = COALESCE(update_dt, insert_dt)
+                    WHERE update_dt IS NULL AND id IN (SELECT id FROM {TEMP_ID_TABLE_NAME})""",
+            )
+            # The imported messages count toward the usage of their days, as the inserted ones do
+            self.__c.execute(
+                self.__getUsageAddQuery(f"thread_id IN (SELECT id FROM {TEMP_ID_TABLE_NAME})"),
+            )
+
+            self.__createMessageTrigger(
+                insert_trigger=True, update_trigger=False, delete_trigger=False,
+            )
+            self.__createThreadTrigger()
+            self.__conn.commit()
+            return thread_ids
+        except Exception as e:
+            # DDL is transactional in SQLite, rolling back restores the dropped triggers as well
+            self.__conn.rollback()
+            print(f"An error occurred: {e}")
+            raise
+
+    def __fillTempIds(self, ids):
+        """Fill the temporary id table with the given ids,
+        to be used in set-based statements instead of building "IN (...)" lists.
+        """
+        in_transaction = self.__conn.in_transaction
+        self.__c.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {TEMP_ID_TABLE_NAME} (id INTEGER PRIMARY KEY)",
+        )
+        self.__c.execute(f"DELETE FROM {TEMP_ID_TABLE_NAME}")
+        self.__c.executemany(
+            f"INSERT OR IGNORE INTO {TEMP_ID_TABLE_NAME} (id) VALUES (?)",
+            ((_id,) for _id in ids),
+        )
+        # Writing the temporary table starts a transaction implicitly, end it right away for the queries
+        # which only read, otherwise the connection would keep reading the snapshot of this moment
+        if not in_transaction:
+            self.__conn.commit()
+
     def updateMessage(self, id, favorite):
         """Update message favorite."""
         try:
+            self.flushMessages()
             current_date = datetime.now().strftime(DEFAULT_DATETIME_FORMAT)
             self.__c.execute(
                 f"""
@@ -593,37 +2267,230 @@ class SqliteDatabase:
             raise
 
     def __createChatFile(self):
+        """Store the files attached to the messages once per content hash, message_file_tb links them to the messages.
+        chat_file_tb of the old versions (one row per message) is converted.
+        """
+        self.__c.execute(
+            f"SELECT count(*) FROM sqlite_master WHERE type='table' AND name='{CHAT_FILE_TABLE_NAME}'",
+        )
+        old_table_name = f"{CHAT_FILE_TABLE_NAME}_old"
+        has_old_table = self.__c.fetchone()[0] == 1
+        if has_old_table:
+            self.__c.execute(f"ALTER TABLE {CHAT_FILE_TABLE_NAME} RENAME TO {old_table_name}")
+
+        self.__c.execute(
+            f"""CREATE TABLE {CHAT_FILE_TABLE_NAME}
+                     (id INTEGER PRIMARY KEY,
+                      hash VARCHAR(64) NOT NULL UNIQUE,
+                      name TEXT,
+                      mime_type VARCHAR(255),
+                      size INTEGER NOT NULL,
+                      data BLOB,
+                      update_dt DATETIME DEFAULT CURRENT_TIMESTAMP,
+                      insert_dt DATETIME DEFAULT CURRENT_TIMESTAMP)""",
+        )
+        self.__c.execute(
+            f"""CREATE TABLE {MESSAGE_FILE_TABLE_NAME}
+                     (id INTEGER PRIMARY KEY,
+                      message_id INTEGER NOT NULL,
+                      file_id INTEGER NOT NULL,
+                      position INTEGER NOT NULL DEFAULT 0,
+                      FOREIGN KEY (message_id) REFERENCES {MESSAGE_TABLE_NAME}(id)
+                      ON DELETE CASCADE,
+                      FOREIGN KEY (file_id) REFERENCES {CHAT_FILE_TABLE_NAME}(id))""",
+        )
+        self.__c.execute(
+            f"""CREATE UNIQUE INDEX {MESSAGE_FILE_TABLE_NAME}_message_id_idx
+                ON {MESSAGE_FILE_TABLE_NAME} (message_id, position)""",
+        )
+        self.__c.execute(
+            f"CREATE INDEX {MESSAGE_FILE_TABLE_NAME}_file_id_idx ON {MESSAGE_FILE_TABLE_NAME} (file_id)",
+        )
+
+        if has_old_table:
+            # One by one, so the whole table is never loaded in memory at once
+            ids = [
+                row[0]
+                for row in self.__c.execute(
+                    f"SELECT id FROM {old_table_name} WHERE typeof(data) = 'blob' ORDER BY id",
+                ).fetchall()
+            ]
+            for id in ids:
+                row = self.__c.execute(
+                    f"SELECT message_id, name, data FROM {old_table_name} WHERE id = ?", (id,),
+                ).fetchone()
+                file_id = self.__putChatFile(row["data"], row["name"])
+                self.__c.execute(
+                    f"""INSERT INTO {MESSAGE_FILE_TABLE_NAME} (message_id, file_id, position)
+                        SELECT ?, ?, (SELECT COUNT(*) FROM {MESSAGE_FILE_TABLE_NAME} WHERE message_id = ?)
+                        WHERE EXISTS (SELECT 1 FROM {MESSAGE_TABLE_NAME} WHERE id = ?)""",
+                    (row["message_id"], file_id, row["message_id"], row["message_id"]),
+                )
+            self.__c.execute(f"DROP TABLE {old_table_name}")
 
+    def __putChatFile(self, source, name=None, mime_type=None):
+        """Store the file (bytes or the path of the file) unless the same content is stored already, return its id.
+        The data is written with incremental BLOB I/O chunk by chunk, a file on the disk is never loaded at once
+        (unless blobopen isn't available, see ``HAS_BLOBOPEN``).
+        Must be called inside of a transaction.
+        """
+        is_path = isinstance(source, (str, os.PathLike))
+        hash_obj = hashlib.sha256()
+        if is_path:
+            with open(source, "rb") as f:
+                header = f.read(CHAT_FILE_CHUNK_SIZE)
+                hash_obj.update(header)
+                for chunk in iter(lambda: f.read(CHAT_FILE_CHUNK_SIZE), b""):
+                    hash_obj.update(chunk)
+            size = os.path.getsize(source)
+            name = name or os.path.basename(source)
+        else:
+            source = memoryview(source)
+            header = source[:CHAT_FILE_CHUNK_SIZE].tobytes()
+            hash_obj.update(source)
+            size = source.nbytes
+        data_hash = hash_obj.hexdigest()
+
+        row = self.__c.execute(f"SELECT id FROM {CHAT_FILE_TABLE_NAME} WHERE hash = ?", (data_hash,)).fetchone()
+        if row is not None:
+            # Used again, keep it away from the garbage collection
+            self.__c.execute(f"UPDATE {CHAT_FILE_TABLE_NAME} SET update_dt = CURRENT_TIMESTAMP WHERE id = ?", (row[0],))
+            return row[0]
+
+        if not HAS_BLOBOPEN:
+            if is_path:
+                with open(source, "rb") as f:
+                    data = f.read()
+            else:
+                data = source
+            self.__c.execute(
+                f"INSERT INTO {CHAT_FILE_TABLE_NAME} (hash, name, mime_type, size, data) VALUES (?, ?, ?, ?, ?)",
+                (data_hash, name, mime_type or BlobStore.get_mime_type(header), size, data),
+            )
+            return self.__c.lastrowid
+
+        # The BLOB is allocated first and filled afterward
+        self.__c.execute(
+            f"INSERT INTO {CHAT_FILE_TABLE_NAME} (hash, name, mime_type, size, data) VALUES (?, ?, ?, ?, zeroblob(?))",
+            (data_hash, name, mime_type or BlobStore.get_mime_type(header), size, size),
+        )
+        file_id = self.__c.lastrowid
+        if size > 0:
+            with self.__conn.blobopen(CHAT_FILE_TABLE_NAME, "data", file_id, readonly=False) as blob:
+                if is_path:
+                    with open(source, "rb") as f:
+                        for chunk in iter(lambda: f.read(CHAT_FILE_CHUNK_SIZE), b""):
+                            blob.write(chunk)
+                else:
+                    for offset in range(0, size, CHAT_FILE_CHUNK_SIZE):
+                        blob.write(source[offset : offset + CHAT_FILE_CHUNK_SIZE])
+        return file_id
+
+    def insertChatFile(self, source, name=None, mime_type=None) -> int:
+        """Store the file to attach to a message and return its id, the same content is stored only once.
+        source is the data (bytes) or the path of the file.
+        """
         try:
-            # Check if the table exists
+            self.__c.execute("BEGIN IMMEDIATE")
+            file_id = self.__putChatFile(source, name, mime_type)
+            self.__conn.commit()
+            return file_id
+        except (sqlite3.Error, OSError) as e:
+            self.__conn.rollback()
+            print(f"An error occurred while storing the file: {e}")
+            raise
+
+    def insertMessageFiles(self, message_id, files):
+        """Store the files (the data or the paths, see ``insertChatFile``) and attach them to the message,
+        in the given order, in a single transaction.
+        """
+        try:
+            self.__c.execute("BEGIN IMMEDIATE")
+            file_ids = [self.__putChatFile(source) for source in files]
+            start = self.__c.execute(
+                f"SELECT COUNT(*) FROM {MESSAGE_FILE_TABLE_NAME} WHERE message_id = ?", (message_id,),
+            ).fetchone()[0]
+            self.__c.executemany(
+                f"INSERT INTO {MESSAGE_FILE_TABLE_NAME} (message_id, file_id, position) VALUES (?, ?, ?)",
+                ((message_id, file_id, start + i) for i, file_id in enumerate(file_ids)),
+            )
+            self.__conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            self.__conn.rollback()
+            print(f"An error occurred while storing the files: {e}")
+            raise
+
+    def selectMessageFiles(self, message_ids) -> dict[int, list[ChatFileContainer]]:
+        """Get the files (without the data) attached to the messages, by message id."""
+        try:
+            self.flushMessages()
+            self.__fillTempIds(message_ids)
             self.__c.execute(
-                f"SELECT count(*) FROM sqlite_master WHERE type='table' AND name='{CHAT_FILE_TABLE_NAME}'",
+                f"""SELECT l.message_id, f.id, f.hash, f.name, f.mime_type, f.size, f.update_dt, f.insert_dt
+                    FROM {MESSAGE_FILE_TABLE_NAME} AS l
+                    JOIN {CHAT_FILE_TABLE_NAME} AS f ON f.id = l.file_id
+                    WHERE l.message_id IN (SELECT id FROM {TEMP_ID_TABLE_NAME})
+                    ORDER BY l.message_id, l.position""",
             )
-            if self.__c.fetchone()[0] == 1:
-                # Add provider column if not exists
-                self.__c.execute(f"PRAGMA table_info({CHAT_FILE_TABLE_NAME})")
-                columns = self.__c.fetchall()
-                if not any([col[1] == "provider" for col in columns]):
-                    self.__c.execute(
-                        f"ALTER TABLE {CHAT_FILE_TABLE_NAME} ADD COLUMN provider VARCHAR(255)",
-                    )
-            else:
-                self.__c.execute(
-                    f"""CREATE TABLE {CHAT_FILE_TABLE_NAME}
-                             (id INTEGER PRIMARY KEY,
-                              thread_id INTEGER,
-                              message_id INTEGER,
-                              name TEXT,
-                              data BLOB,
-                              update_dt DATETIME DEFAULT CURRENT_TIMESTAMP,
-                              insert_dt DATETIME DEFAULT CURRENT_TIMESTAMP)""",
-                )
-                # Commit the transaction
-                self.__conn.commit()
+            keys = ChatFileContainer.get_keys()
+            result: dict[int, list[ChatFileContainer]] = {}
+            for row in self.__c.fetchall():
+                result.setdefault(row["message_id"], []).append(ChatFileContainer(**{key: row[key] for key in keys}))
+            return result
         except sqlite3.Error as e:
-            print(f"An error occurred while creating the table: {e}")
+            print(f"An error occurred: {e}")
             raise
 
+    def iterChatFile(self, id, chunk_size=CHAT_FILE_CHUNK_SIZE):
+        """Read the data of the file chunk by chunk with incremental BLOB I/O."""
+        if not HAS_BLOBOPEN:
+            yield from self.__iterChatFileBySubstr(id, chunk_size)
+            return
+        try:
+            blob = self.__conn.blobopen(CHAT_FILE_TABLE_NAME, "data", id, readonly=True)
+        except sqlite3.OperationalError:
+            # No such file
+            return
+        with blob:
+            for chunk in iter(lambda: blob.read(chunk_size), b""):
+                yield chunk
+
+    def __iterChatFileBySubstr(self, id, chunk_size):
+        row = self.__c.execute(f"SELECT size FROM {CHAT_FILE_TABLE_NAME} WHERE id = ?", (id,)).fetchone()
+        if row is None:
+            return
+        # substr() of a BLOB counts bytes, from 1
+        for offset in range(0, row[0], chunk_size):
+            chunk = self.__c.execute(
+                f"SELECT substr(data, ?, ?) FROM {CHAT_FILE_TABLE_NAME} WHERE id = ?",
+                (offset + 1, chunk_size, id),
+            ).fetchone()
+            if chunk is None or not chunk[0]:
+                return
+            yield bytes(chunk[0])
+
+    def readChatFile(self, id) -> bytes | None:
+        """Read the whole data of the file (None if there is no such file)."""
+        chunks = list(self.iterChatFile(id))
+        if not chunks:
+            row = self.__c.execute(f"SELECT size FROM {CHAT_FILE_TABLE_NAME} WHERE id = ?", (id,)).fetchone()
+            return b"" if row is not None else None
+        return b"".join(chunks)
+
+    def __collectGarbageChatFiles(self):
+        """Remove the files which no message (of either database) refers to and which haven't been used for a while."""
+        self.__c.execute(
+            f"""DELETE FROM {CHAT_FILE_TABLE_NAME}
+                WHERE update_dt < datetime('now', ?)
+                AND NOT EXISTS (SELECT 1 FROM main.{MESSAGE_FILE_TABLE_NAME} WHERE file_id = {CHAT_FILE_TABLE_NAME}.id)
+                AND NOT EXISTS (
+                  SELECT 1 FROM {ARCHIVE_SCHEMA_NAME}.{MESSAGE_FILE_ARCHIVE_TABLE_NAME}
+                  WHERE file_id = {CHAT_FILE_TABLE_NAME}.id
+                )""",
+            (f"-{int(CHAT_FILE_GRACE_DAYS)} days",),
+        )
+        self.__conn.commit()
+
     def __createImage(self):
         try:
             # Check if the table exists
@@ -656,46 +2523,241 @@ class SqliteDatabase:
                               update_dt DATETIME DEFAULT CURRENT_TIMESTAMP,
                               insert_dt DATETIME DEFAULT CURRENT_TIMESTAMP)""",
                 )
-                # Commit the transaction
-                self.__conn.commit()
         except sqlite3.Error as e:
             print(f"An error occurred while creating the table: {e}")
             raise
 
     def insertImage(self, arg: ImagePromptContainer):
+        """Insert the image, its payload is saved in the blob store and image_tb keeps the reference to it.
+        The reference is inserted before the payload is saved, so a failure never leaves a payload
+        which no row of blob_tb refers to (the garbage collection only knows the payloads in blob_tb).
+        """
+        excludes = ["id", "insert_dt", "update_dt"]
+        query = arg.create_insert_query(IMAGE_TABLE_NAME, excludes)
+        values = dict(arg.get_items(excludes))
+        data = arg.data if isinstance(arg.data, (bytes, bytearray)) else None
+        if data is not None:
+            values["data"] = None
+            values["data_hash"] = BlobStore.get_hash(data)
+            values["data_size"] = len(data)
+            values["mime_type"] = BlobStore.get_mime_type(data)
+        else:
+            values["data_hash"] = values["data_size"] = values["mime_type"] = None
+        with self.__blob_store.lock:
+            try:
+                self.__c.execute(query, list(values.values()))
+                new_id = self.__c.lastrowid
+                if data is not None:
+                    self.__blob_store.put(data)
+                self.__conn.commit()
+                return new_id
+            except (sqlite3.Error, OSError) as e:
+                self.__conn.rollback()
+                print(f"An error occurred: {e}")
+                if data is not None and not self.__isBlobReferenced(values["data_hash"]):
+                    self.__blob_store.remove(values["data_hash"])
+                raise
+
+    def __isBlobReferenced(self, data_hash):
+        return (
+            self.__c.execute(
+                f"SELECT 1 FROM {BLOB_TABLE_NAME} WHERE hash = ?", (data_hash,),
+            ).fetchone()
+            is not None
+        )
+
+    def __createImageBlob(self):
+        """Move the image payloads out of image_tb into the content-addressed blob store.
+        image_tb keeps the hash, byte size and MIME type of the payload,
+        blob_tb counts how many images refer to each payload so unused ones can be removed.
+        """
+        self.__c.execute(f"ALTER TABLE {IMAGE_TABLE_NAME} ADD COLUMN data_hash VARCHAR(64)")
+        self.__c.execute(f"ALTER TABLE {IMAGE_TABLE_NAME} ADD COLUMN data_size INTEGER")
+        self.__c.execute(f"ALTER TABLE {IMAGE_TABLE_NAME} ADD COLUMN mime_type VARCHAR(255)")
+        self.__c.execute(
+            f"""CREATE TABLE {BLOB_TABLE_NAME}
+                     (hash VARCHAR(64) PRIMARY KEY,
+                      size INTEGER,
+                      mime_type VARCHAR(255),
+                      ref_count INTEGER DEFAULT 0,
+                      insert_dt DATETIME DEFAULT CURRENT_TIMESTAMP)""",
+        )
+        self.__c.execute(
+            f"""
+            CREATE TRIGGER {IMAGE_BLOB_INSERTED_TR_NAME}
+            AFTER INSERT ON {IMAGE_TABLE_NAME}
+            WHEN NEW.data_hash IS NOT NULL
+            BEGIN
+              INSERT OR IGNORE INTO {BLOB_TABLE_NAME} (hash, size, mime_type) VALUES (NEW.data_hash, NEW.data_size, NEW.mime_type);
+              UPDATE {BLOB_TABLE_NAME} SET ref_count = ref_count + 1 WHERE hash = NEW.data_hash;
+            END
+        """,
+        )
+        self.__c.execute(
+            f"""
+            CREATE TRIGGER {IMAGE_BLOB_UPDATED_TR_NAME}
+            AFTER UPDATE OF data_hash ON {IMAGE_TABLE_NAME}
+            WHEN OLD.data_hash IS NOT NEW.data_hash
+            BEGIN
+              UPDATE {BLOB_TABLE_NAME} SET ref_count = ref_count - 1 WHERE hash = OLD.data_hash;
+              INSERT OR IGNORE INTO {BLOB_TABLE_NAME} (hash, size, mime_type) SELECT NEW.data_hash, NEW.data_size, NEW.mime_type WHERE NEW.data_hash IS NOT NULL;
+              UPDATE {BLOB_TABLE_NAME} SET ref_count = ref_count + 1 WHERE hash = NEW.data_hash;
+            END
+        """,
+        )
+        self.__c.execute(
+            f"""
+            CREATE TRIGGER {IMAGE_BLOB_DELETED_TR_NAME}
+            AFTER DELETE ON {IMAGE_TABLE_NAME}
+            WHEN OLD.data_hash IS NOT NULL
+            BEGIN
+              UPDATE {BLOB_TABLE_NAME} SET ref_count = ref_count - 1 WHERE hash = OLD.data_hash;
+            END
+        """,
+        )
+
+        # Move the existing payloads one by one, so the whole table is never loaded in memory at once.
+        # Payloads stored as str are the image URLs of the very old versions, they are left as they are.
+        ids = [
+            row[0]
+            for row in self.__c.execute(
+                f"SELECT id FROM {IMAGE_TABLE_NAME} WHERE typeof(data) = 'blob'",
+            ).fetchall()
+        ]
+        for id in ids:
+            data = self.__c.execute(
+                f"SELECT data FROM {IMAGE_TABLE_NAME} WHERE id = ?", (id,),
+            ).fetchone()[0]
+            self.__c.execute(
+                f"UPDATE {IMAGE_TABLE_NAME} SET data = NULL, data_hash = ?, data_size = ?, mime_type = ? WHERE id = ?",
+                (self.__blob_store.put(data), len(data), BlobStore.get_mime_type(data), id),
+            )
+
+    def __collectGarbageBlobs(self):
+        """Remove the payloads which no image refers to anymore."""
+        with self.__blob_store.lock:
+            hashes = [
+                row[0]
+                for row in self.__c.execute(
+                    f"SELECT hash FROM {BLOB_TABLE_NAME} WHERE ref_count <= 0",
+                ).fetchall()
+            ]
+            if not hashes:
+                return
+            self.__c.execute(f"DELETE FROM {BLOB_TABLE_NAME} WHERE ref_count <= 0")
+            self.__conn.commit()
+            # Files are removed only after the commit, a rollback must never point to the missing payload
+            for data_hash in hashes:
+                self.__blob_store.remove(data_hash)
+
+    def __createImageThumbnail(self):
+        self.__c.execute(
+            f"""CREATE TABLE {IMAGE_THUMBNAIL_TABLE_NAME}
+                     (image_id INTEGER PRIMARY KEY,
+                      data BLOB,
+                      width INT,
+                      height INT,
+                      insert_dt DATETIME DEFAULT CURRENT_TIMESTAMP,
+                      FOREIGN KEY (image_id) REFERENCES {IMAGE_TABLE_NAME}(id)
+                      ON DELETE CASCADE)""",
+        )
+
+    def insertImageThumbnail(self, image_id, data, width, height):
+        """Insert (or replace) the thumbnail of the image.
+        Nothing is inserted if the image has been removed in the meantime.
+        """
         try:
-            excludes = ["id", "insert_dt", "update_dt"]
-            query = arg.create_insert_query(IMAGE_TABLE_NAME, excludes)
-            values = arg.get_values_for_insert(excludes)
-            self.__c.execute(query, values)
-            new_id = self.__c.lastrowid
+            self.__c.execute(
+                f"""INSERT OR REPLACE INTO {IMAGE_THUMBNAIL_TABLE_NAME} (image_id, data, width, height)
+                    SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM {IMAGE_TABLE_NAME} WHERE id = ?)""",
+                (image_id, data, width, height, image_id),
+            )
             self.__conn.commit()
-            return new_id
         except sqlite3.Error as e:
-            print("An error occurred..")
+            print(f"An error occurred: {e}")
+            raise
+
+    def selectImageThumbnail(self, image_id):
+        try:
+            self.__c.execute(
+                f"SELECT data, width, height FROM {IMAGE_THUMBNAIL_TABLE_NAME} WHERE image_id = ?",
+                (image_id,),
+            )
+            return self.__c.fetchone()
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
             raise
 
     def selectImage(self):
         try:
-            self.__c.execute(f"SELECT * FROM {IMAGE_TABLE_NAME}")
+            self.__c.execute(f"SELECT * FROM {IMAGE_TABLE_NAME} WHERE deleted_dt IS NULL")
             return self.__c.fetchall()
         except sqlite3.Error as e:
             print(f"An error occurred: {e}")
             raise
 
     def selectCertainImage(self, id):
+        """Select specific image, "data" holds the payload loaded from the blob store."""
         try:
             self.__c.execute(f"SELECT * FROM {IMAGE_TABLE_NAME} WHERE id={id}")
-            return self.__c.fetchone()
+            row = self.__c.fetchone()
+            if row is None:
+                return row
+            image = dict(row)
+            if image["data_hash"]:
+                image["data"] = self.__blob_store.get(image["data_hash"])
+            return image
         except sqlite3.Error as e:
             print(f"An error occurred: {e}")
             raise
 
     def removeImage(self, id=None):
+        """Remove the image for good, every image (the deleted ones as well) if id is None."""
         try:
             query = f"DELETE FROM {IMAGE_TABLE_NAME}"
+            params = ()
             if id:
-                query += f" WHERE id = {id}"
+                query += " WHERE id = ?"
+                params = (id,)
+            self.__c.execute(query, params)
+            self.__conn.commit()
+            self.__collectGarbageBlobs()
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    def removeImages(self, ids, soft=None) -> bool:
+        """Remove the images in a single transaction, see ``deleteThreads`` for soft.
+        Returns whether they can be restored.
+        """
+        if soft is None:
+            soft = bool(CONFIG_MANAGER.get_general_property("soft_delete"))
+        try:
+            self.__c.execute("BEGIN IMMEDIATE")
+            self.__fillTempIds(ids)
+            if soft:
+                self.__c.execute(
+                    f"""UPDATE {IMAGE_TABLE_NAME} SET deleted_dt = CURRENT_TIMESTAMP
+                        WHERE id IN (SELECT id FROM {TEMP_ID_TABLE_NAME}) AND deleted_dt IS NULL""",
+                )
+            else:
+                self.__c.execute(f"DELETE FROM {IMAGE_TABLE_NAME} WHERE id IN (SELECT id FROM {TEMP_ID_TABLE_NAME})")
+            self.__conn.commit()
+            if not soft:
+                self.__collectGarbageBlobs()
+            return soft
+        except sqlite3.Error as e:
+            self.__conn.rollback()
+            print(f"An error occurred while removing the images: {e}")
+            raise
+
+    def restoreRemovedImages(self, ids=None):
+        """Bring the soft deleted images back (every one of them if ids is None), if they haven't been purged yet."""
+        try:
+            query = f"UPDATE {IMAGE_TABLE_NAME} SET deleted_dt = NULL WHERE deleted_dt IS NOT NULL"
+            if ids is not None:
+                self.__fillTempIds(ids)
+                query += f" AND id IN (SELECT id FROM {TEMP_ID_TABLE_NAME})"
             self.__c.execute(query)
             self.__conn.commit()
         except sqlite3.Error as e:
@@ -704,8 +2766,10 @@ class SqliteDatabase:
 
     def selectFavorite(self):
         try:
+            self.flushMessages()
             self.__c.execute(
-                f"SELECT * FROM {MESSAGE_TABLE_NAME} WHERE favorite=1 order by favorite_set_date",
+                f"""SELECT {self.__message_columns} FROM {MESSAGE_TABLE_NAME}
+                    WHERE favorite=1 AND {self.__getUndeletedThreadCondition()} order by favorite_set_date""",
             )
             return self.__c.fetchall()
         except sqlite3.Error as e:
@@ -719,7 +2783,7 @@ class SqliteDatabase:
         # Convert it into dictionary
         for d in data:
             d["messages"] = list(
-                map(lambda x: x.__dict__, self.selectCertainThreadMessages(d["id"])),
+                map(lambda x: dict(x.get_items()), self.selectCertainThreadMessages(d["id"])),
             )
 
         # Save the JSON
@@ -729,12 +2793,323 @@ class SqliteDatabase:
     def getCursor(self):
         return self.__c
 
+    def releaseConnection(self):
+        """Close the connection of the calling thread (for worker threads)."""
+        self.__manager.releaseConnection()
+
+    def interruptConnection(self, ident: int):
+        """Abort the statement running on the connection of the thread ident (e.g. the maintenance at exit)."""
+        self.__manager.interrupt(ident)
+
+    def vacuumIncrementally(self, step_pages=DB_INCREMENTAL_VACUUM_PAGES, is_interrupted=None):
+        """Give the free pages (left by deleted threads, images...) back to the file system.
+        It is done in steps of step_pages, so the write lock is never held for long.
+        The files which are not INCREMENTAL yet are skipped, see ``compact``.
+        """
+        try:
+            for schema in ["main", ARCHIVE_SCHEMA_NAME]:
+                if self.__c.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0] != 2:
+                    continue
+                while self.__c.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0] > 0:
+                    if is_interrupted is not None and is_interrupted():
+                        return
+                    # The pages are freed while stepping through the result, so it has to be fetched
+                    self.__c.execute(f"PRAGMA {schema}.incremental_vacuum({int(step_pages)})").fetchall()
+                    self.__conn.commit()
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    def runMaintenance(self, is_interrupted=None):
+        """Keep the file compact and the statistics of the query planner up to date.
+        Meant to run in a background thread when the app is idle, every step holds the write lock only briefly.
+        ``is_interrupted()`` is checked between the steps, the maintenance stops early once it returns True.
+        """
+        is_interrupted = is_interrupted or (lambda: False)
+
+        def archive():
+            archive_after_days = CONFIG_MANAGER.get_general_property("archive_after_days") or DB_ARCHIVE_AFTER_DAYS
+            if int(archive_after_days) > 0:
+                self.archiveThreads(int(archive_after_days))
+
+        def optimizeFts():
+            if self.__is_fts_available:
+                # Merge the segments of the full-text index, the deleted messages stay in them until then
+                self.__c.execute(f"INSERT INTO {MESSAGE_FTS_TABLE_NAME}({MESSAGE_FTS_TABLE_NAME}) VALUES('optimize')")
+                self.__conn.commit()
+
+        def analyze():
+            # Gather the statistics once, PRAGMA optimize keeps them up to date after that
+            self.__c.execute("SELECT count(*) FROM sqlite_master WHERE type='table' AND name='sqlite_stat1'")
+            if self.__c.fetchone()[0] == 0:
+                self.__c.execute("ANALYZE")
+            else:
+                self.__c.execute("PRAGMA optimize")
+            self.__conn.commit()
+
+        steps = [
+            self.flushMessages,
+            archive,
+            self.purgeDeleted,
+            self.__collectGarbageChatFiles,
+            lambda: self.purgeResponseCache(
+                CONFIG_MANAGER.get_general_property("response_cache_ttl_hours") or RESPONSE_CACHE_TTL_HOURS,
+            ),
+            optimizeFts,
+            lambda: self.vacuumIncrementally(is_interrupted=is_interrupted),
+            analyze,
+        ]
+        try:
+            for step in steps:
+                if is_interrupted():
+                    return
+                step()
+        except sqlite3.Error as e:
+            print(f"An error occurred while maintaining the database: {e}")
+            raise
+
+    def isCompactNeeded(self) -> bool:
+        """Whether the main or the archive database was created before auto_vacuum was set to INCREMENTAL,
+        the free pages of those are only given back by ``compact``.
+        """
+        return any(
+            self.__c.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0] != 2
+            for schema in ["main", ARCHIVE_SCHEMA_NAME]
+        )
+
+    def compact(self):
+        """Rebuild the main and the archive database with VACUUM, switching them to INCREMENTAL auto_vacuum
+        so the maintenance gives the free pages back from then on.
+        It holds the exclusive lock until it is done (the message writer waits meanwhile),
+        so it only runs when the user asks for it (see the database settings).
+        """
+        try:
+            self.flushMessages()
+            for schema in ["main", ARCHIVE_SCHEMA_NAME]:
+                self.__c.execute(f"PRAGMA {schema}.auto_vacuum = INCREMENTAL")
+                # VACUUM can't run inside of the transaction
+                self.__conn.commit()
+                self.__c.execute(f"VACUUM {schema}")
+        except sqlite3.Error as e:
+            print(f"An error occurred while compacting the database: {e}")
+            raise
+
+    def checkpoint(self):
+        """Move the content of the WAL file into the database and truncate it."""
+        try:
+            # Returns (busy, wal pages, checkpointed pages), busy is 1 if another connection is still reading
+            return self.__c.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    def backup(self, filename, pages=DB_BACKUP_PAGES_PER_STEP, step_sleep=DB_BACKUP_STEP_SLEEP, progress=None):
+        """Write a consistent snapshot of the database to filename and of the archive database next to it
+        (see ``get_archive_db_filename``), with the backup API of SQLite.
+
+        The pages are copied in steps of ``pages`` with a pause of ``step_sleep`` milliseconds in between,
+        the other connections keep reading and writing meanwhile.
+        ``progress(copied_pages, total_pages)`` is called after every step, raising from it cancels the backup.
+        The image payloads the snapshot refers to are put into the blob store of the backup
+        (see ``get_blob_directory``, hard links where possible). Returns the hashes of the payloads which were missing.
+        """
+        self.flushMessages()
+        targets = [("main", filename), (ARCHIVE_SCHEMA_NAME, get_archive_db_filename(filename))]
+        tmp_filenames = [target + ".tmp" for _, target in targets]
+        blob_dir = get_blob_directory(filename)
+        tmp_blob_dir = blob_dir + ".tmp"
+        try:
+            # The read transaction keeps the snapshot of both databases until the backup is done.
+            # Without it the backup starts over whenever another connection commits, which may be never done for a big file
+            self.__c.execute("BEGIN")
+            total_pages = 0
+            for schema, _ in targets:
+                total_pages += self.__c.execute(f"PRAGMA {schema}.page_count").fetchone()[0]
+
+            copied_pages = 0
+            for (schema, _), tmp_filename in zip(targets, tmp_filenames):
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+
+                def onStep(status, remaining, total, copied_before=copied_pages):
+                    if progress is not None:
+                        progress(copied_before + total - remaining, total_pages)
+                    time.sleep(step_sleep / 1000)
+
+                dst = sqlite3.connect(tmp_filename)
+                try:
+                    self.__conn.backup(dst, pages=pages, progress=onStep, name=schema)
+                    copied_pages += dst.execute("PRAGMA page_count").fetchone()[0]
+                finally:
+                    dst.close()
+
+            if os.path.exists(tmp_blob_dir):
+                shutil.rmtree(tmp_blob_dir)
+            missing_hashes = self.__copyBlobs(self.__blob_store, BlobStore(tmp_blob_dir), self.__conn)
+
+            # Replace the previous files only once every database is copied
+            for (_, target), tmp_filename in zip(targets, tmp_filenames):
+                os.replace(tmp_filename, target)
+            if os.path.exists(blob_dir):
+                shutil.rmtree(blob_dir)
+            if os.path.exists(tmp_blob_dir):
+                os.replace(tmp_blob_dir, blob_dir)
+            if missing_hashes:
+                print(f"{len(missing_hashes)} image payloads are missing from the blob store, they are not backed up")
+            return missing_hashes
+        except BaseException as e:
+            for tmp_filename in tmp_filenames:
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+            if os.path.exists(tmp_blob_dir):
+                shutil.rmtree(tmp_blob_dir)
+            if isinstance(e, sqlite3.Error):
+                print(f"An error occurred while backing up the database: {e}")
+            raise
+        finally:
+            if self.__conn.in_transaction:
+                self.__conn.rollback()
+
+    @staticmethod
+    def __copyBlobs(src_store: BlobStore, dst_store: BlobStore, conn: sqlite3.Connection) -> list[str]:
+        """Put the payloads referred to by blob_tb of the connection into dst_store, return the missing hashes."""
+        has_blob_table = conn.execute(
+            f"SELECT count(*) FROM main.sqlite_master WHERE type='table' AND name='{BLOB_TABLE_NAME}'",
+        ).fetchone()[0]
+        if not has_blob_table:
+            return []
+        missing_hashes = []
+        # The garbage collection waits, so none of the payloads is removed in the middle of it
+        with src_store.lock, dst_store.lock:
+            for (data_hash,) in conn.execute(f"SELECT hash FROM main.{BLOB_TABLE_NAME} WHERE ref_count > 0"):
+                if not src_store.copy_to(data_hash, dst_store):
+                    missing_hashes.append(data_hash)
+        return missing_hashes
+
+    def restore(self, filename, blob_dir=None):
+        """Replace the content of the database (and of the archive database) with the backup written by ``backup``.
+        The other connections read the restored content from then on, but what the app already loaded is stale,
+        so it should be restarted afterwards.
+
+        The image payloads are put back from the blob store of the backup (blob_dir, next to filename by default)
+        before the database is replaced, and the garbage collection of the payloads waits until it is done.
+        Returns the hashes of the payloads the restored images refer to which are in neither of the stores.
+        """
+        if not os.path.exists(filename):
+            raise FileNotFoundError(filename)
+        self.flushMessages()
+        targets = [
+            (filename, self.__db_filename),
+            (get_archive_db_filename(filename), get_archive_db_filename(self.__db_filename)),
+        ]
+        backup_blob_store = BlobStore(blob_dir or get_blob_directory(filename))
+        try:
+            with self.__blob_store.lock:
+                src = sqlite3.connect(filename)
+                try:
+                    missing_hashes = self.__copyBlobs(backup_blob_store, self.__blob_store, src)
+                finally:
+                    src.close()
+
+                for source, target in targets:
+                    if not os.path.exists(source):
+                        continue
+                    src = sqlite3.connect(source)
+                    dst = sqlite3.connect(target, timeout=self.__manager.busyTimeout / 1000)
+                    try:
+                        # In a single step, so nothing is written into the database in the middle of it
+                        src.backup(dst)
+                    finally:
+                        src.close()
+                        dst.close()
+            if missing_hashes:
+                print(f"{len(missing_hashes)} image payloads of the backup are missing, those images can't be shown")
+            return missing_hashes
+        except sqlite3.Error as e:
+            print(f"An error occurred while restoring the database: {e}")
+            raise
+
+    def getFileInfo(self):
+        """Get the size of the database file and how much of it is free."""
+        try:
+            page_size = self.__c.execute("PRAGMA page_size").fetchone()[0]
+            page_count = self.__c.execute("PRAGMA page_count").fetchone()[0]
+            freelist_count = self.__c.execute("PRAGMA freelist_count").fetchone()[0]
+            wal_filename = self.__db_filename + "-wal"
+            archive_filename = get_archive_db_filename(self.__db_filename)
+            return {
+                "filename": self.__db_filename,
+                "page_size": page_size,
+                "page_count": page_count,
+                "freelist_count": freelist_count,
+                "size": page_size * page_count,
+                "free_size": page_size * freelist_count,
+                "wal_size": os.path.getsize(wal_filename) if os.path.exists(wal_filename) else 0,
+                "archive_filename": archive_filename,
+                "archive_size": os.path.getsize(archive_filename) if os.path.exists(archive_filename) else 0,
+                "auto_vacuum": self.__c.execute("PRAGMA auto_vacuum").fetchone()[0],
+            }
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    def getTableSizes(self):
+        """Get the pages used by every table and index, the largest first.
+        Returns a list of dicts (name, pages, size, is_estimated).
+
+        The dbstat virtual table is optional in SQLite builds, without it the sizes of the tables
+        are estimated from the length of their values and the indexes are not listed.
+        """
+        try:
+            try:
+                self.__c.execute(
+                    "SELECT name, COUNT(*) AS pages, SUM(pgsize) AS size FROM dbstat GROUP BY name ORDER BY size DESC",
+                )
+                return [
+                    {"name": row["name"], "pages": row["pages"], "size": row["size"], "is_estimated": False}
+                    for row in self.__c.fetchall()
+                ]
+            except sqlite3.OperationalError:
+                pass
+
+            page_size = self.__c.execute("PRAGMA page_size").fetchone()[0]
+            table_names = [
+                row[0]
+                for row in self.__c.execute(
+                    "SELECT name FROM sqlite_master WHERE type='table' AND sql NOT LIKE 'CREATE VIRTUAL%'",
+                ).fetchall()
+            ]
+            result = []
+            for table_name in table_names:
+                columns = [row["name"] for row in self.__c.execute(f'PRAGMA table_info("{table_name}")').fetchall()]
+                # Bytes of the values, the overhead of the records and the pages is left out
+                length_expr = " + ".join(f'IFNULL(LENGTH(CAST("{column}" AS BLOB)), 0)' for column in columns) or "0"
+                size = self.__c.execute(f'SELECT IFNULL(SUM({length_expr}), 0) FROM "{table_name}"').fetchone()[0]
+                pages = max(1, -(-size // page_size))
+                result.append({"name": table_name, "pages": pages, "size": pages * page_size, "is_estimated": True})
+            return sorted(result, key=lambda x: x["size"], reverse=True)
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            raise
+
     def close(self):
-        self.__conn.close()
+        # Write the queued messages before closing
+        with self.__writer_lock:
+            if self.__writer is not None:
+                self.__writer.close()
+                self.__writer = None
+        try:
+            # Recommended before closing, it only analyzes the tables which need it
+            self.__c.execute("PRAGMA optimize")
+            # Leave no WAL file behind, so the file can be copied or backed up as it is
+            self.checkpoint()
+        except sqlite3.Error as e:
+            print(f"An error occurred while closing the database: {e}")
+        self.__manager.closeAll()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        # Close the connection
-        self.__conn.close()
+        # Close the connections
+        self.close()
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+import filetype
+
+
+class BlobStore:
+    """Content-addressed store of binary payloads such as generated images.
+
+    Every payload is saved once under its SHA-256 hash, sharded by the first two hex digits
+    (``<root_dir>/ab/abcdef...``), so the same image generated twice takes the space only once.
+    Reference counting is up to the caller (see ``blob_tb`` in sqlite.py).
+    """
+
+    def __init__(self, root_dir: str):
+        self.__root_dir = root_dir
+        # Held from writing a payload until it is referenced in the database,
+        # so the garbage collection can't remove a payload which is about to be used
+        self.lock = threading.RLock()
+
+    @property
+    def root_dir(self):
+        return self.__root_dir
+
+    @staticmethod
+    def get_hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def get_mime_type(data: bytes) -> str | None:
+        kind = filetype.guess(data)
+        return kind.mime if kind else None
+
+    def get_path(self, data_hash: str) -> str:
+        return os.path.join(self.__root_dir, data_hash[:2], data_hash)
+
+    def exists(self, data_hash: str) -> bool:
+        return os.path.exists(self.get_path(data_hash))
+
+    def put(self, data: bytes) -> str:
+        """Save the payload if it is not stored yet and return its hash."""
+        data_hash = self.get_hash(data)
+        path = self.get_path(data_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first, so a crash never leaves a truncated payload under the hash
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return data_hash
+
+    def get(self, data_hash: str) -> bytes | None:
+        try:
+            with open(self.get_path(data_hash), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def copy_to(self, data_hash: str, store: BlobStore) -> bool:
+        """Put the payload into the other store (hard link if possible, a copy otherwise) unless it is there already.
+        The payloads never change, so sharing them between the stores is safe. False if the payload is missing.
+        """
+        path = self.get_path(data_hash)
+        dst_path = store.get_path(data_hash)
+        if os.path.exists(dst_path):
+            return True
+        if not os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        try:
+            os.link(path, dst_path)
+        except FileExistsError:
+            pass
+        except OSError:
+            # Another file system or no hard link support
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst_path), suffix=".tmp")
+            os.close(fd)
+            try:
+                shutil.copyfile(path, tmp_path)
+                os.replace(tmp_path, dst_path)
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return True
+
+    def remove(self, data_hash: str):
+        try:
+            os.remove(self.get_path(data_hash))
+        except FileNotFoundError:
+            pass
@@ -5,12 +5,16 @@ Some of the functions are used to set PyQt settings, restart the application, sh
 """
 from __future__ import annotations
 
+import asyncio
 import base64
 import csv
+import functools
+import inspect
 import json
 import os
 import random
 import re
+import sqlite3
 import string
 import subprocess
 import sys
@@ -20,6 +24,7 @@ import traceback
 import wave
 import zipfile
 
+from concurrent.futures import Future
 from datetime import datetime
 from pathlib import Path
 
@@ -28,7 +33,7 @@ import numpy as np
 import psutil
 
 from g4f.providers.base_provider import ProviderModelMixin
-from litellm import completion
+from litellm import acompletion
 
 from pyqt_openai.widgets.scrollableErrorDialog import ScrollableErrorDialog
 
@@ -46,7 +51,7 @@ from g4f.errors import ProviderNotFoundError
 from g4f.models import ModelUtils
 from g4f.providers.retry_provider import IterProvider
 from jinja2 import Template
-from qtpy.QtCore import QThread, QUrl, Qt, Signal
+from qtpy.QtCore import QObject, QThread, QUrl, Qt, Signal
 from qtpy.QtGui import QDesktopServices
 from qtpy.QtWidgets import QFrame, QMessageBox
 
@@ -54,6 +59,7 @@ import pyqt_openai.util
 
 from pyqt_openai import (
     AUTOSTART_REGISTRY_KEY,
+    CHAT_FILE_URL_CACHE_SIZE,
     CONTEXT_DELIMITER,
     DEFAULT_API_CONFIGS,
     DEFAULT_APP_NAME,
@@ -61,6 +67,10 @@ from pyqt_openai import (
     DEFAULT_TOKEN_CHUNK_SIZE,
     FAMOUS_LLM_LIST,
     G4F_PROVIDER_DEFAULT,
+    G4F_RACE_PROVIDER_COUNT,
+    HISTORY_IMAGE_TOKENS,
+    HISTORY_MESSAGE_OVERHEAD_TOKENS,
+    HISTORY_RESPONSE_RESERVE_TOKENS,
     INDENT_SIZE,
     MAIN_INDEX,
     O1_MODELS,
@@ -68,6 +78,7 @@ from pyqt_openai import (
     PROMPT_END_KEY_NAME,
     PROMPT_JSON_KEY_NAME,
     PROMPT_MAIN_KEY_NAME,
+    RESPONSE_CACHE_TTL_HOURS,
     STT_MODEL,
     THREAD_ORDERBY,
     is_frozen,
@@ -75,13 +86,17 @@ from pyqt_openai import (
 from pyqt_openai.config_loader import CONFIG_MANAGER
 from pyqt_openai.globals import (
     DB,
-    G4F_CLIENT,
+    G4F_ASYNC_CLIENT,
     LLAMAINDEX_WRAPPER,
+    NETWORK_ENGINE,
     OPENAI_CLIENT,
     REPLICATE_CLIENT,
 )
 from pyqt_openai.lang.translations import LangClass
 from pyqt_openai.models import ChatMessageContainer
+from pyqt_openai.util.network_engine import StreamCoalescer, close_stream
+from pyqt_openai.util.response_cache import get_response_cache_key, is_response_cacheable
+from pyqt_openai.util.token_counter import count_tokens, get_context_window, pack_history
 
 if TYPE_CHECKING:
     from g4f import ProviderType
@@ -562,7 +577,7 @@ def get_g4f_providers_by_model(model, including_auto=False):
         provider = ProviderUtils.convert[provider]
 
         if hasattr(provider, "models"):
-            models = provider.models if provider.models else models
+            models = provider.models or []
             if model in models:
                 supported_providers.append(provider)
 
@@ -619,6 +634,42 @@ def get_image_url_from_local(image):
     return f"data:{get_mime_type_from_bytes(image)};base64,{base64_image}"
 
 
+@functools.lru_cache(maxsize=CHAT_FILE_URL_CACHE_SIZE)
+def get_chat_file_url(file_id, file_hash, mime_type):
+    """Data URL of the file attached to a message, read from chat_file_tb.
+    The hash is part of the key of the cache, so a reused id never returns another file.
+    """
+    encoded = "".join(base64.b64encode(chunk).decode("utf-8") for chunk in _iter_base64_chunks(DB.iterChatFile(file_id)))
+    return f"data:{mime_type};base64,{encoded}"
+
+
+def _iter_base64_chunks(chunks):
+    # base64 encodes every 3 bytes separately, so the chunks are cut at multiples of 3 to encode them one by one
+    rest = b""
+    for chunk in chunks:
+        chunk = rest + chunk
+        cut = len(chunk) - len(chunk) % 3
+        rest = chunk[cut:]
+        yield chunk[:cut]
+    yield rest
+
+
+def get_message_files_content(text, files):
+    """Content of a message of the history with the images attached to it, the other files are left out."""
+    images = [file for file in files if (file.mime_type or "").startswith("image/")]
+    if not images:
+        return text
+    return [{"type": "text", "text": text}] + [
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": get_chat_file_url(file.id, file.hash, file.mime_type),
+            },
+        }
+        for file in images
+    ]
+
+
 def get_message_obj(role, content):
     return {"role": role, "content": content}
 
@@ -749,8 +800,21 @@ def get_api_argument(
     is_llama_available=False,
     is_json_response_available=0,
     json_content=None,
+    history_token_counts=None,
 ):
+    """Get the arguments of the API request.
+    If history_token_counts (the tokens of each of the messages) is given, only the newest messages
+    which fit in the context window of the model are sent, leaving room for the prompt and the response.
+    """
     try:
+        if history_token_counts is not None:
+            reserved_tokens = (
+                max_tokens if use_max_tokens else HISTORY_RESPONSE_RESERVE_TOKENS
+            ) + len(images) * HISTORY_IMAGE_TOKENS
+            for text in [system, cur_text, json_content if is_json_response_available else None]:
+                reserved_tokens += HISTORY_MESSAGE_OVERHEAD_TOKENS + count_tokens(text, model)
+            messages = pack_history(messages, history_token_counts, get_context_window(model) - reserved_tokens)
+
         if model in O1_MODELS:
             stream = False
         else:
@@ -821,6 +885,7 @@ def get_argument(
     is_json_response_available=0,
     json_content=None,
     is_g4f=False,
+    history_token_counts=None,
 ):
     try:
         if is_g4f:
@@ -842,6 +907,7 @@ def get_argument(
                 is_llama_available=is_llama_available,
                 is_json_response_available=is_json_response_available,
                 json_content=json_content,
+                history_token_counts=history_token_counts,
             )
         return args
     except Exception as e:
@@ -849,60 +915,165 @@ def get_argument(
         raise e
 
 
-def stream_response(response, is_g4f=False, get_content_only=True):
-    if is_g4f:
-        if get_content_only:
-            for chunk in response:
-                yield chunk.choices[0].delta.content
-        else:
-            for chunk in response:
-                yield chunk
+def get_token_usage(usage):
+    """Get (prompt_tokens, completion_tokens, total_tokens) from the usage of the response,
+    None if the response didn't report it.
+    The usage is an object or a dict depending on the provider.
+    """
+    if not usage:
+        return None
+    if isinstance(usage, dict):
+        prompt_tokens, completion_tokens, total_tokens = (
+            usage.get(key) for key in ["prompt_tokens", "completion_tokens", "total_tokens"]
+        )
     else:
-        for part in response:
-            yield part.choices[0].delta.content or ""
+        prompt_tokens, completion_tokens, total_tokens = (
+            getattr(usage, key, None) for key in ["prompt_tokens", "completion_tokens", "total_tokens"]
+        )
+    if prompt_tokens is None and completion_tokens is None and total_tokens is None:
+        return None
+    prompt_tokens = int(prompt_tokens or 0)
+    completion_tokens = int(completion_tokens or 0)
+    total_tokens = int(total_tokens) if total_tokens is not None else prompt_tokens + completion_tokens
+    return prompt_tokens, completion_tokens, total_tokens
+
+
+async def stream_response_async(response, is_g4f=False, on_usage=None):
+    """Yield the content of the chunks of the API (on_usage is called with the usage when a chunk reports it,
+    which is the last one), the chunks of G4F are yielded as they are.
+    Closing the generator (or cancelling the task which iterates it) closes the stream and its connection.
+    """
+    try:
+        async for part in response:
+            if is_g4f:
+                yield part
+                continue
+            if on_usage is not None and getattr(part, "usage", None):
+                on_usage(part.usage)
+            if part.choices:
+                yield part.choices[0].delta.content or ""
+    finally:
+        await close_stream(response)
 
 
-def get_api_response(args, get_content_only=True):
-    try:
-        response = completion(drop_params=True, **args)
-        if args["stream"]:
-            return stream_response(response)
-        return response.choices[0].message.content or ""
-    except Exception as e:
-        print(e)
-        raise e
+# Number of races won by each G4F provider, the winners are tried first in the next races
+_g4f_race_wins: dict[str, int] = {}
+
 
+def get_g4f_race_providers(model, count=G4F_RACE_PROVIDER_COUNT):
+    """Get the providers of the model to race, the ones which have won the most races first."""
+    providers = get_g4f_providers_by_model(model)
+    providers.sort(key=lambda provider: _g4f_race_wins.get(provider, 0), reverse=True)
+    return providers[:count]
 
-def get_g4f_response(args, get_content_only=True):
+
+async def _open_g4f_response(args, provider):
+    """Send the request to the provider, return the response once its content starts.
+    The stream is returned with its iterator and the chunks read until the first one which has content.
+    """
+    response = G4F_ASYNC_CLIENT.chat.completions.create(**{**args, "provider": convert_to_provider(provider)})
+    if inspect.isawaitable(response):
+        response = await response
+    if not args["stream"]:
+        if not response.choices or not response.choices[0].message.content:
+            raise RuntimeError("Empty response")
+        return response, None, []
+    # The iteration goes on with the same iterator once the provider wins
+    iterator = aiter(response)
+    chunks = []
     try:
-        response = G4F_CLIENT.chat.completions.create(**args)
-        if args["stream"]:
-            return stream_response(
-                response=response,
-                is_g4f=True,
-                get_content_only=get_content_only,
-            )
-        if get_content_only:
-            return response.choices[0].message.content
-        return response
-    except Exception as e:
-        print(e)
-        raise e
+        async for chunk in iterator:
+            chunks.append(chunk)
+            if chunk.choices and chunk.choices[0].delta.content:
+                return response, iterator, chunks
+        raise RuntimeError("Empty response")
+    except BaseException:
+        await close_stream(response)
+        raise
 
 
-def get_response(args, is_g4f=False, get_content_only=True, provider=""):
-    """Get the response from the API
-    :param args: The arguments to pass to the API
-    :param is_g4f: Whether the model is G4F or not
-    :param get_content_only: Whether to get the content only or not
-    :param provider: The provider of the model (Auto if not provided).
+async def _continue_g4f_stream(response, iterator, chunks):
+    try:
+        for chunk in chunks:
+            yield chunk
+        async for chunk in iterator:
+            yield chunk
+    finally:
+        await close_stream(response)
+
+
+async def race_g4f_response(args, providers):
+    """Send the request to all of the providers at once and use the first one which produces content,
+    the others are cancelled right away (and their connections closed).
+    Returns the same as ``get_response_async``, the winner is the provider of the response.
+    """
+    tasks = {asyncio.ensure_future(_open_g4f_response(args, provider)): provider for provider in providers}
+    winner_task = None
+    errors = []
+    try:
+        pending = set(tasks)
+        while pending and winner_task is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    errors.append(f"{tasks[task]}: {task.exception()}")
+                elif winner_task is None:
+                    winner_task = task
+        if winner_task is None:
+            raise RuntimeError("No provider responded. " + " / ".join(errors))
+    finally:
+        losers = [task for task in tasks if task is not winner_task]
+        for task in losers:
+            task.cancel()
+        # The losers which have their stream already close it when they are cancelled
+        await asyncio.gather(*losers, return_exceptions=True)
+        for task in losers:
+            # The ones which finished in the same round as the winner are not cancelled
+            if args["stream"] and not task.cancelled() and task.exception() is None:
+                await close_stream(task.result()[0])
+
+    winner = tasks[winner_task]
+    _g4f_race_wins[winner] = _g4f_race_wins.get(winner, 0) + 1
+    response, iterator, chunks = winner_task.result()
+    if args["stream"]:
+        return _continue_g4f_stream(response, iterator, chunks)
+    return response
+
+
+async def get_response_async(args, is_g4f=False, provider="", on_usage=None):
+    """Get the response of the API (or G4F), to run on the network engine (see util/network_engine.py).
+    Returns the content (the whole response if it is G4F), or an async generator of it if it is streamed.
+    on_usage is called with the usage of the response (API only).
     """
     try:
         if is_g4f:
             if provider != G4F_PROVIDER_DEFAULT:
                 args["provider"] = convert_to_provider(provider)
-            return get_g4f_response(args, get_content_only=False)
-        return get_api_response(args, get_content_only)
+            else:
+                race_provider_count = CONFIG_MANAGER.get_general_property("g4f_race_provider_count")
+                providers = get_g4f_race_providers(
+                    args["model"],
+                    G4F_RACE_PROVIDER_COUNT if race_provider_count is None else int(race_provider_count),
+                )
+                if len(providers) > 1:
+                    return await race_g4f_response(args, providers)
+            response = G4F_ASYNC_CLIENT.chat.completions.create(**args)
+            # The stream is returned right away, the whole response has to be awaited
+            if inspect.isawaitable(response):
+                response = await response
+            if args["stream"]:
+                return stream_response_async(response, is_g4f=True)
+            return response
+
+        if args["stream"] and on_usage is not None:
+            # The usage of the stream comes in the last chunk only if it is asked for
+            args = {**args, "stream_options": {"include_usage": True}}
+        response = await acompletion(drop_params=True, **args)
+        if args["stream"]:
+            return stream_response_async(response, on_usage=on_usage)
+        if on_usage is not None:
+            on_usage(getattr(response, "usage", None))
+        return response.choices[0].message.content or ""
     except Exception as e:
         print(e)
         raise e
@@ -1153,77 +1324,71 @@ class STTThread(QThread):
             os.remove(self.filename)
 
 
-class ChatThread(QThread):
-    """== replyGenerated Signal ==
+class ChatTask(QObject):
+    """Chat request which runs on the network engine (see util/network_engine.py) instead of a thread of its own.
+
+    == replyGenerated Signal ==
     First: response
     Second: streaming or not streaming
     Third: ChatMessageContainer.
+
+    == statsGenerated Signal ==
+    Emitted once the response is received.
+    First: time to the first token (seconds)
+    Second: tokens per second after the first token (0 if it can't be measured).
+
+    The signals are emitted from the thread of the engine, so they are queued to the receivers in the GUI thread.
     """
 
+    started = Signal()
+    finished = Signal()
     replyGenerated = Signal(str, bool, ChatMessageContainer)
     streamFinished = Signal(ChatMessageContainer)
+    statsGenerated = Signal(float, float)
 
     def __init__(
-        self, input_args, info: ChatMessageContainer, is_g4f=False, provider="",
+        self, input_args, info: ChatMessageContainer, is_g4f=False, provider="", parent=None,
     ):
-        super().__init__()
+        super().__init__(parent)
         self.__input_args = input_args
-        self.__stop = False
         self.__is_g4f = is_g4f
         self.__provider = provider
+        self.__future: Future | None = None
+        # The chunks are shown at most once per frame
+        self.__coalescer = StreamCoalescer(lambda text: self.replyGenerated.emit(text, True, self.__info))
+        # Whether any content of the streamed response has arrived
+        self.__has_content = False
 
         self.__info = info
         self.__info.role = "assistant"
 
-    def stop(self):
-        self.__stop = True
+    def start(self):
+        self.started.emit()
+        self.__future = NETWORK_ENGINE.submit(self.__run())
 
-    def run(self):
-        try:
-            self.__info.is_g4f = self.__is_g4f
-            # For getting the provider if it is G4F
-            get_content_only = not self.__info.is_g4f
+    def isRunning(self):
+        return self.__future is not None and not self.__future.done()
 
-            if self.__input_args["stream"]:
-                response = get_response(
-                    self.__input_args, self.__is_g4f, get_content_only, self.__provider,
-                )
-                for chunk in response:
-                    # Get provider if it is G4F
-                    # Get the content from choices[0].delta.content if it is G4F, otherwise get it from chunk
-                    # The reason is that G4F has content in choices[0].delta.content, otherwise it has content in chunk.
-                    if self.__is_g4f:
-                        self.__info.provider = chunk.provider
-                        self.__info.model = chunk.model
-                        chunk = chunk.choices[0].delta.content
-                    if self.__stop:
-                        self.__info.finish_reason = "stopped by user"
-                        self.streamFinished.emit(self.__info)
-                        break
-                    self.replyGenerated.emit(chunk, True, self.__info)
-            else:
-                response = get_response(
-                    self.__input_args, self.__is_g4f, get_content_only,
-                )
-                # Get provider if it is G4F
-                # Get the content from choices[0].message.content if it is G4F, otherwise get it from response
-                # The reason is that G4F has content in choices[0].message.content, otherwise it has content in response.
-                if self.__is_g4f:
-                    self.__info.content = response.choices[0].message.content
-                    self.__info.model = response.model
-                    self.__info.provider = response.provider
-                else:
-                    self.__info.content = response
-                self.__info.prompt_tokens = ""
-                self.__info.completion_tokens = ""
-                self.__info.total_tokens = ""
+    def stop(self):
+        """Cancel the request, the connection is closed right away."""
+        if self.__future is not None:
+            self.__future.cancel()
 
-            self.__info.finish_reason = "stop"
+    def __setUsage(self, usage):
+        token_usage = get_token_usage(usage)
+        if token_usage is not None:
+            self.__info.prompt_tokens, self.__info.completion_tokens, self.__info.total_tokens = token_usage
 
-            if self.__input_args["stream"]:
+    async def __run(self):
+        try:
+            await self.__request()
+        except asyncio.CancelledError:
+            # Only the streamed response which has begun has something to show
+            if self.__input_args["stream"] and self.__has_content:
+                self.__coalescer.flush()
+                self.__info.finish_reason = "stopped by user"
                 self.streamFinished.emit(self.__info)
-            else:
-                self.replyGenerated.emit(self.__info.content, False, self.__info)
+            raise
         except Exception as e:
             self.__info.provider = self.__provider
             self.__info.finish_reason = "Error"
@@ -1238,6 +1403,124 @@ You can try the following:
 - Use API instead of G4F
 """
             self.replyGenerated.emit(self.__info.content, False, self.__info)
+        finally:
+            self.finished.emit()
+
+    def __getCacheKey(self):
+        """Key of the request in the response cache, None if the cache is off or the response can't be replayed."""
+        if CONFIG_MANAGER.get_general_property("response_cache") and is_response_cacheable(
+            self.__input_args, self.__is_g4f,
+        ):
+            return get_response_cache_key(self.__input_args)
+        return None
+
+    async def __selectCachedResponse(self, cache_key):
+        """Cached response of the request (None if there is none), read in a worker thread of its own.
+        The cache is only a shortcut, a failure to read it counts as a miss.
+        """
+        ttl_hours = CONFIG_MANAGER.get_general_property("response_cache_ttl_hours") or RESPONSE_CACHE_TTL_HOURS
+        try:
+            return await asyncio.to_thread(DB.selectResponseCache, cache_key, ttl_hours)
+        except sqlite3.Error as e:
+            print(f"Failed to read the response cache: {e}")
+            return None
+
+    async def __insertCachedResponse(self, cache_key, content):
+        # The response is shown already, a failure to cache it must not turn it into an error
+        try:
+            await asyncio.to_thread(
+                DB.insertResponseCache, cache_key, content, self.__input_args["model"], self.__info.provider,
+            )
+        except sqlite3.Error as e:
+            print(f"Failed to write the response cache: {e}")
+
+    def __replay(self, start_time, content):
+        """Answer with the cached response through the same signals as the received one, without the usage.
+        The whole response arrives at once, so only the time to it is measured.
+        """
+        self.__info.content = content
+        self.__info.is_cached = 1
+        self.__info.finish_reason = "stop"
+        if self.__input_args["stream"]:
+            self.replyGenerated.emit(content, True, self.__info)
+            self.streamFinished.emit(self.__info)
+        else:
+            self.replyGenerated.emit(content, False, self.__info)
+        self.statsGenerated.emit(time.monotonic() - start_time, 0.0)
+
+    def __emitStats(self, start_time, first_token_time, content):
+        end_time = time.monotonic()
+        completion_tokens = self.__info.completion_tokens
+        if completion_tokens is None:
+            completion_tokens = count_tokens(content, self.__input_args["model"])
+        duration = end_time - first_token_time
+        self.statsGenerated.emit(
+            first_token_time - start_time, completion_tokens / duration if duration > 0 else 0.0,
+        )
+
+    async def __request(self):
+        self.__info.is_g4f = self.__is_g4f
+        start_time = time.monotonic()
+        cache_key = self.__getCacheKey()
+        if cache_key is not None:
+            content = await self.__selectCachedResponse(cache_key)
+            if content is not None:
+                self.__replay(start_time, content)
+                return
+
+        response = await get_response_async(
+            self.__input_args, self.__is_g4f, self.__provider, on_usage=self.__setUsage,
+        )
+
+        if self.__input_args["stream"]:
+            chunks = []
+            first_token_time = None
+            try:
+                async for chunk in response:
+                    # Get provider if it is G4F
+                    # Get the content from choices[0].delta.content if it is G4F, otherwise get it from chunk
+                    # The reason is that G4F has content in choices[0].delta.content, otherwise it has content in chunk.
+                    if self.__is_g4f:
+                        # Some providers report the usage, in a chunk which may have no content
+                        self.__setUsage(getattr(chunk, "usage", None))
+                        if not chunk.choices:
+                            continue
+                        self.__info.provider = chunk.provider
+                        self.__info.model = chunk.model
+                        chunk = chunk.choices[0].delta.content
+                    if chunk:
+                        if first_token_time is None:
+                            first_token_time = time.monotonic()
+                        self.__has_content = True
+                        chunks.append(chunk)
+                    self.__coalescer.add(chunk)
+            finally:
+                await response.aclose()
+            self.__coalescer.flush()
+            self.__info.finish_reason = "stop"
+            self.streamFinished.emit(self.__info)
+            content = "".join(chunks)
+        else:
+            # Get provider if it is G4F
+            # Get the content from choices[0].message.content if it is G4F, otherwise get it from response
+            # The reason is that G4F has content in choices[0].message.content, otherwise it has content in response.
+            if self.__is_g4f:
+                self.__info.content = response.choices[0].message.content
+                self.__info.model = response.model
+                self.__info.provider = response.provider
+                self.__setUsage(getattr(response, "usage", None))
+            else:
+                self.__info.content = response
+            self.__info.finish_reason = "stop"
+            self.replyGenerated.emit(self.__info.content, False, self.__info)
+            content = self.__info.content
+            # The whole response arrives at once
+            first_token_time = time.monotonic()
+
+        self.__emitStats(start_time, first_token_time or time.monotonic(), content or "")
+
+        if cache_key is not None and content:
+            await self.__insertCachedResponse(cache_key, content)
 
 
 # To manage only one TTS stream at a time
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZLIB_ENCODING = "zlib"
+ZSTD_ENCODING = "zstd"
+
+
+def get_default_encoding() -> str:
+    """zstd if the zstandard package is installed, zlib otherwise."""
+    return ZSTD_ENCODING if zstandard is not None else ZLIB_ENCODING
+
+
+def compress_text(text: str, threshold: int, encoding: str | None = None) -> tuple[str | bytes, str | None]:
+    """Compress the text if its UTF-8 encoded size is at least threshold bytes.
+    Returns (compressed bytes, encoding), or (text, None) if it is short or doesn't get smaller.
+    """
+    if not isinstance(text, str) or len(text) < threshold:
+        return text, None
+    data = text.encode("utf-8")
+    if len(data) < threshold:
+        return text, None
+    encoding = encoding or get_default_encoding()
+    if encoding == ZSTD_ENCODING:
+        compressed = zstandard.ZstdCompressor().compress(data)
+    else:
+        encoding = ZLIB_ENCODING
+        compressed = zlib.compress(data)
+    if len(compressed) >= len(data):
+        return text, None
+    return compressed, encoding
+
+
+def decompress_text(data: str | bytes | None, encoding: str | None) -> str | None:
+    """Reverse of ``compress_text``, the text which is not compressed (encoding is None) is returned as it is."""
+    if encoding is None or data is None:
+        return data
+    if encoding == ZLIB_ENCODING:
+        return zlib.decompress(data).decode("utf-8")
+    if encoding == ZSTD_ENCODING:
+        if zstandard is None:
+            raise RuntimeError("zstandard package is required to read the content compressed with zstd.")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    raise ValueError(f"Unknown content encoding: {encoding}")
@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import gzip
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from datetime import datetime
+
+from qtpy.QtCore import QObject, QThread, QTimer, Signal
+from qtpy.QtWidgets import QApplication
+
+from pyqt_openai import (
+    DB_BACKUP_CHECK_INTERVAL,
+    DB_BACKUP_DIR_SUFFIX,
+    DB_BACKUP_INTERVAL_HOURS,
+    DB_BACKUP_KEEP,
+    DB_MAINTENANCE_DELAY,
+)
+from pyqt_openai.config_loader import CONFIG_MANAGER
+from pyqt_openai.globals import DB
+from pyqt_openai.sqlite import get_archive_db_filename, get_blob_directory, get_db_filename
+
+GZIP_SUFFIX = ".gz"
+
+# Only a single backup is written at a time (the scheduled one and the one started from the settings)
+_backup_lock = threading.Lock()
+
+
+def get_backup_directory(db_filename=None):
+    """Get the directory of the backups of the database, "<db><suffix>" next to the db file."""
+    return os.path.splitext(db_filename or get_db_filename())[0] + DB_BACKUP_DIR_SUFFIX
+
+
+def get_backup_filenames(db_filename=None):
+    """Get the backups of the database, the newest first.
+    The archive database which belongs to each of them is not listed.
+    """
+    db_filename = db_filename or get_db_filename()
+    backup_dir = get_backup_directory(db_filename)
+    if not os.path.isdir(backup_dir):
+        return []
+    db_name = os.path.splitext(os.path.basename(db_filename))[0]
+    pattern = re.compile(rf"^{re.escape(db_name)}_\d{{8}}_\d{{6}}\.db({re.escape(GZIP_SUFFIX)})?$")
+    # The time of the backup is in the name, so sorting by name is sorting by time
+    return [
+        os.path.join(backup_dir, filename)
+        for filename in sorted(os.listdir(backup_dir), reverse=True)
+        if pattern.match(filename)
+    ]
+
+
+def get_backup_time(filename):
+    """Get the time of the backup from its name."""
+    match = re.search(r"_(\d{8}_\d{6})\.db", os.path.basename(filename))
+    return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S") if match else None
+
+
+def _get_backup_file_group(filename):
+    # The backup and the backup of its archive database
+    if filename.endswith(GZIP_SUFFIX):
+        return [filename, get_archive_db_filename(filename[: -len(GZIP_SUFFIX)]) + GZIP_SUFFIX]
+    return [filename, get_archive_db_filename(filename)]
+
+
+def _get_backup_blob_directory(filename):
+    # The image payloads of the backup, never compressed (they are compressed images already)
+    if filename.endswith(GZIP_SUFFIX):
+        filename = filename[: -len(GZIP_SUFFIX)]
+    return get_blob_directory(filename)
+
+
+def _compress_file(filename):
+    with open(filename, "rb") as src, gzip.open(filename + GZIP_SUFFIX, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(filename)
+
+
+def _decompress_file(filename, directory):
+    fd, tmp_filename = tempfile.mkstemp(dir=directory, suffix=".db")
+    with gzip.open(filename, "rb") as src, os.fdopen(fd, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    return tmp_filename
+
+
+def remove_old_backups(keep, db_filename=None):
+    """Remove the backups except the newest ones."""
+    for filename in get_backup_filenames(db_filename)[max(0, int(keep)) :]:
+        for path in _get_backup_file_group(filename):
+            if os.path.exists(path):
+                os.remove(path)
+        blob_dir = _get_backup_blob_directory(filename)
+        if os.path.isdir(blob_dir):
+            shutil.rmtree(blob_dir)
+
+
+def create_backup(compress=False, keep=DB_BACKUP_KEEP, progress=None, on_missing_blobs=None):
+    """Back up the database into the backup directory, remove the old backups and return the file name.
+    ``on_missing_blobs(hashes)`` is called if some of the image payloads couldn't be backed up.
+    """
+    with _backup_lock:
+        db_filename = get_db_filename()
+        backup_dir = get_backup_directory(db_filename)
+        os.makedirs(backup_dir, exist_ok=True)
+        db_name = os.path.splitext(os.path.basename(db_filename))[0]
+        filename = os.path.join(backup_dir, f"{db_name}_{datetime.now():%Y%m%d_%H%M%S}.db")
+
+        missing_hashes = DB.backup(filename, progress=progress)
+        if missing_hashes and on_missing_blobs is not None:
+            on_missing_blobs(missing_hashes)
+        if compress:
+            for path in _get_backup_file_group(filename):
+                if os.path.exists(path):
+                    _compress_file(path)
+            filename += GZIP_SUFFIX
+
+        if keep:
+            remove_old_backups(keep, db_filename)
+        return filename
+
+
+def restore_backup(filename):
+    """Restore the database from the backup, the app should be restarted afterwards.
+    Returns the hashes of the image payloads which are missing (see ``SqliteDatabase.restore``).
+    """
+    with _backup_lock:
+        if not filename.endswith(GZIP_SUFFIX):
+            return DB.restore(filename)
+
+        # The backup API needs the database files, decompress them next to the backup first
+        main_filename, archive_filename = _get_backup_file_group(filename)
+        directory = os.path.dirname(filename)
+        tmp_filename = _decompress_file(main_filename, directory)
+        tmp_archive_filename = get_archive_db_filename(tmp_filename)
+        try:
+            if os.path.exists(archive_filename):
+                os.replace(_decompress_file(archive_filename, directory), tmp_archive_filename)
+            return DB.restore(tmp_filename, blob_dir=_get_backup_blob_directory(filename))
+        finally:
+            for path in [tmp_filename, tmp_archive_filename]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+class DBBackupThread(QThread):
+    """Back up the database (or restore it, if a backup file is given) with its own connection.
+    The options which are not given are read from the settings.
+    """
+
+    progressChanged = Signal(int, int)
+    succeeded = Signal(str)
+    errorOccurred = Signal(str)
+    # Number of the image payloads which are missing, the images stay in the database without them
+    blobsMissing = Signal(int)
+
+    def __init__(self, restore_filename=None, compress=None, keep=None, parent=None):
+        super().__init__(parent)
+        self.__restore_filename = restore_filename
+        self.__compress = compress
+        self.__keep = keep
+
+    def __onProgress(self, copied_pages, total_pages):
+        if self.isInterruptionRequested():
+            raise InterruptedError("The backup is cancelled")
+        self.progressChanged.emit(copied_pages, total_pages)
+
+    def run(self):
+        try:
+            if self.__restore_filename:
+                missing_hashes = restore_backup(self.__restore_filename)
+                if missing_hashes:
+                    self.blobsMissing.emit(len(missing_hashes))
+                self.succeeded.emit(self.__restore_filename)
+            else:
+                compress = self.__compress
+                if compress is None:
+                    compress = bool(CONFIG_MANAGER.get_general_property("backup_compression"))
+                keep = self.__keep or CONFIG_MANAGER.get_general_property("backup_keep") or DB_BACKUP_KEEP
+                filename = create_backup(
+                    compress=compress,
+                    keep=keep,
+                    progress=self.__onProgress,
+                    on_missing_blobs=lambda hashes: self.blobsMissing.emit(len(hashes)),
+                )
+                self.succeeded.emit(filename)
+        except InterruptedError:
+            pass
+        except Exception as e:
+            print(f"Failed to back up the database: {e}")
+            self.errorOccurred.emit(str(e))
+        finally:
+            DB.releaseConnection()
+
+
+class DBBackupScheduler(QObject):
+    """Back up the database in the background when the newest backup is older than "backup_interval_hours".
+
+    The time of the newest backup comes from the backup directory,
+    so the schedule goes on across restarts of the app.
+    """
+
+    def __init__(self, app: QApplication):
+        super().__init__(app)
+        self.__thread = DBBackupThread(parent=self)
+
+        self.__timer = QTimer(self)
+        self.__timer.setInterval(DB_BACKUP_CHECK_INTERVAL)
+        self.__timer.timeout.connect(self.__runIfDue)
+        self.__timer.start()
+        QTimer.singleShot(DB_MAINTENANCE_DELAY, self.__runIfDue)
+
+        # Don't make the user wait for the backup at exit, the unfinished one is thrown away
+        app.aboutToQuit.connect(self.__stop)
+
+    def __runIfDue(self):
+        interval_hours = CONFIG_MANAGER.get_general_property("backup_interval_hours") or DB_BACKUP_INTERVAL_HOURS
+        if int(interval_hours) <= 0 or self.__thread.isRunning():
+            return
+        backup_filenames = get_backup_filenames()
+        if backup_filenames and time.time() - os.path.getmtime(backup_filenames[0]) < int(interval_hours) * 3600:
+            return
+        self.__thread.start(QThread.Priority.LowestPriority)
+
+    def __stop(self):
+        self.__thread.requestInterruption()
+        self.__thread.wait()
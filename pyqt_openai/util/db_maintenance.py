@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import threading
+
+from qtpy.QtCore import QObject, QThread, QTimer, Qt, Signal
+from qtpy.QtWidgets import QApplication
+
+from pyqt_openai import DB_MAINTENANCE_DELAY, DB_MAINTENANCE_INTERVAL
+from pyqt_openai.globals import DB
+
+
+class DBThread(QThread):
+    """Thread which works on the database with its own connection, ``stop`` aborts its running statement."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.__ident = None
+
+    def _work(self):
+        raise NotImplementedError
+
+    def _fail(self, e: Exception):
+        raise NotImplementedError
+
+    def run(self):
+        self.__ident = threading.get_ident()
+        try:
+            self._work()
+        except Exception as e:
+            # The error of the interrupted statement is expected
+            if not self.isInterruptionRequested():
+                self._fail(e)
+        finally:
+            self.__ident = None
+            DB.releaseConnection()
+
+    def stop(self):
+        """Interrupt the work and wait for the thread, e.g. at exit."""
+        self.requestInterruption()
+        ident = self.__ident
+        if ident is not None:
+            DB.interruptConnection(ident)
+        self.wait()
+
+
+class DBMaintenanceThread(DBThread):
+    """Run ``SqliteDatabase.runMaintenance``, it stops after the running step when interrupted."""
+
+    def _work(self):
+        DB.runMaintenance(is_interrupted=self.isInterruptionRequested)
+
+    def _fail(self, e):
+        print(f"Failed to maintain the database: {e}")
+
+
+class DBCompactThread(DBThread):
+    """Run ``SqliteDatabase.compact``, it is started from the database settings.
+    The interrupted VACUUM leaves the file as it was.
+    """
+
+    errorOccurred = Signal(str)
+
+    def _work(self):
+        DB.compact()
+
+    def _fail(self, e):
+        print(f"Failed to compact the database: {e}")
+        self.errorOccurred.emit(str(e))
+
+
+class DBTableSizesThread(DBThread):
+    """Run ``SqliteDatabase.getTableSizes``, it reads every page of the file."""
+
+    sizesReady = Signal(list)
+
+    def _work(self):
+        self.sizesReady.emit(DB.getTableSizes())
+
+    def _fail(self, e):
+        print(f"Failed to get the sizes of the tables: {e}")
+
+
+class DBMaintenanceScheduler(QObject):
+    """Run the maintenance of the database when the app is idle.
+
+    The maintenance is due shortly after startup and then every interval,
+    it runs as soon as the app is not the active one (minimized or another window is focused).
+    It never rebuilds the whole file, that is up to the user (see ``DBCompactThread``).
+    """
+
+    def __init__(self, app: QApplication):
+        super().__init__(app)
+        self.__app = app
+        self.__is_due = False
+
+        self.__thread = DBMaintenanceThread(self)
+
+        self.__timer = QTimer(self)
+        self.__timer.setInterval(DB_MAINTENANCE_INTERVAL)
+        self.__timer.timeout.connect(self.__setDue)
+        self.__timer.start()
+        QTimer.singleShot(DB_MAINTENANCE_DELAY, self.__setDue)
+
+        self.__app.applicationStateChanged.connect(self.__runIfIdle)
+        # The connections are closed at exit, don't make the user wait for the rest of the maintenance
+        self.__app.aboutToQuit.connect(self.__thread.stop)
+
+    def __setDue(self):
+        self.__is_due = True
+        self.__runIfIdle()
+
+    def __runIfIdle(self):
+        if not self.__is_due or self.__thread.isRunning():
+            return
+        if self.__app.applicationState() == Qt.ApplicationState.ApplicationActive:
+            return
+        self.__is_due = False
+        self.__thread.start(QThread.Priority.LowestPriority)
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import contextlib
+import threading
+import time
+
+import httpx
+
+from litellm import get_llm_provider, openai_compatible_providers
+
+from pyqt_openai import (
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_READ_TIMEOUT,
+)
+from pyqt_openai.config_loader import CONFIG_MANAGER
+
+try:
+    # HTTP/2 is optional in httpx, it needs the h2 package
+    import h2
+except ImportError:
+    h2 = None
+
+OPENAI_API_BASE = "https://api.openai.com/v1"
+
+_lock = threading.Lock()
+_client: httpx.Client | None = None
+_async_client: httpx.AsyncClient | None = None
+# When each base URL was connected to last (time.monotonic), to pre-warm it once per keep-alive
+_prewarmed: dict[str, float] = {}
+
+
+def _get_client_kwargs() -> dict:
+    """Arguments of the shared clients, the pool limits and the timeouts come from the settings."""
+    config = CONFIG_MANAGER.get_general_property
+    return {
+        "http2": h2 is not None and bool(config("http2")),
+        "follow_redirects": True,
+        "limits": httpx.Limits(
+            max_connections=config("http_max_connections") or HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=config("http_max_keepalive_connections") or HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config("http_keepalive_expiry") or HTTP_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(
+            config("http_read_timeout") or HTTP_READ_TIMEOUT,
+            connect=config("http_connect_timeout") or HTTP_CONNECT_TIMEOUT,
+        ),
+    }
+
+
+def get_http_client() -> httpx.Client:
+    """Get the process-wide HTTP client of the blocking requests (OpenAI SDK, litellm, image downloads).
+    The connections are pooled and kept alive, so only the first request to a host pays for DNS, TCP and TLS.
+    """
+    global _client
+    with _lock:
+        if _client is None:
+            _client = httpx.Client(**_get_client_kwargs())
+        return _client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Get the process-wide HTTP client of the async requests,
+    only to be used in the coroutines running on the network engine (see util/network_engine.py).
+    """
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            _async_client = httpx.AsyncClient(**_get_client_kwargs())
+        return _async_client
+
+
+def get_api_base(model: str) -> str | None:
+    """Get the base URL which litellm sends the requests of the model to with the shared client,
+    None if the provider has its own transport (e.g. Anthropic, Gemini).
+    """
+    try:
+        _, provider, _, api_base = get_llm_provider(model)
+    except Exception:
+        return None
+    if provider == "openai":
+        return api_base or OPENAI_API_BASE
+    if provider in openai_compatible_providers:
+        return api_base
+    return None
+
+
+async def prewarm_connection(model: str):
+    """Open the connection to the provider of the model before the request is sent,
+    the request then takes it from the pool. Skipped if it has been opened within the keep-alive.
+    """
+    api_base = get_api_base(model)
+    if not api_base:
+        return
+    now = time.monotonic()
+    keepalive_expiry = CONFIG_MANAGER.get_general_property("http_keepalive_expiry") or HTTP_KEEPALIVE_EXPIRY
+    if now - _prewarmed.get(api_base, -keepalive_expiry) < keepalive_expiry:
+        return
+    _prewarmed[api_base] = now
+    # Any response means the connection is open, the status doesn't matter
+    with contextlib.suppress(httpx.HTTPError):
+        await get_async_http_client().head(api_base)
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import inspect
+
+from concurrent.futures import Future
+from typing import Callable, Coroutine
+
+from qtpy.QtCore import QThread
+
+from pyqt_openai import STREAM_FLUSH_INTERVAL, STREAM_FLUSH_SIZE
+
+
+class NetworkEngine(QThread):
+    """Single long-lived thread which runs an asyncio event loop for the network requests.
+
+    The requests are coroutines submitted with ``submit``, any number of them run concurrently on the loop.
+    Cancelling the returned future cancels the coroutine where it waits for the network,
+    so the connection is closed right away instead of after the next chunk.
+    The results go back to Qt with signals, which are queued to the receivers in the GUI thread.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.__loop = asyncio.new_event_loop()
+
+    def run(self):
+        asyncio.set_event_loop(self.__loop)
+        try:
+            self.__loop.run_forever()
+        finally:
+            self.__cancelTasks()
+            self.__loop.run_until_complete(self.__loop.shutdown_asyncgens())
+
+    def __cancelTasks(self):
+        tasks = asyncio.all_tasks(self.__loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            self.__loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Run the coroutine on the loop (the thread starts by itself on the first one).
+        Cancel the returned future to cancel the coroutine.
+        """
+        if not self.isRunning():
+            self.start()
+        # The coroutine is scheduled even if the loop is not running yet, it runs once the thread starts it
+        return asyncio.run_coroutine_threadsafe(coro, self.__loop)
+
+    def stop(self):
+        """Cancel the running requests and stop the thread."""
+        if self.isRunning():
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+            self.wait()
+
+
+class StreamCoalescer:
+    """Join the chunks of the stream in the engine and pass them on at most once per interval (ms),
+    or right away once max_size characters are waiting, so fast providers don't flood the GUI with updates.
+    Only to be used in a coroutine running on the engine, the delayed flush is scheduled on its loop.
+    """
+
+    def __init__(self, flush: Callable[[str], None], interval=STREAM_FLUSH_INTERVAL, max_size=STREAM_FLUSH_SIZE):
+        self.__flush = flush
+        self.__interval = interval / 1000
+        self.__max_size = max_size
+        self.__chunks: list[str] = []
+        self.__size = 0
+        self.__timer: asyncio.TimerHandle | None = None
+
+    def add(self, text: str | None):
+        if not text:
+            return
+        self.__chunks.append(text)
+        self.__size += len(text)
+        if self.__size >= self.__max_size:
+            self.flush()
+        elif self.__timer is None:
+            # The waiting text is shown even if the next chunk takes long
+            self.__timer = asyncio.get_running_loop().call_later(self.__interval, self.flush)
+
+    def flush(self):
+        """Pass on the waiting text now, call it before the end of the stream."""
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        if self.__chunks:
+            text = "".join(self.__chunks)
+            self.__chunks.clear()
+            self.__size = 0
+            self.__flush(text)
+
+
+async def close_stream(stream):
+    """Close the async stream of the response and the one it wraps (e.g. litellm's wrapper of the OpenAI stream),
+    which closes the HTTP response instead of leaving it to the garbage collector.
+    """
+    for obj in [stream, getattr(stream, "completion_stream", None)]:
+        close = getattr(obj, "aclose", None) or getattr(obj, "close", None)
+        if close is None:
+            continue
+        with contextlib.suppress(Exception):
+            result = close()
+            if inspect.isawaitable(result):
+                await result
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import hashlib
+import json
+
+# The arguments which change how the response is delivered, not the response itself
+_EXCLUDED_ARGUMENTS = ("stream", "stream_options")
+_DATA_URL_PREFIX = "data:"
+
+
+def is_response_cacheable(args: dict, is_g4f=False) -> bool:
+    """Whether the response to the request can be replayed from the cache.
+    Only the API requests with temperature 0 are, G4F providers don't respect the sampling arguments.
+    The requests answered with llama-index (without the messages) are not.
+    """
+    return not is_g4f and "messages" in args and args.get("temperature") == 0
+
+
+def _replace_data_urls(obj):
+    """Replace the images embedded as data URLs with their hash, they are as long as the files."""
+    if isinstance(obj, dict):
+        return {k: _replace_data_urls(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_replace_data_urls(v) for v in obj]
+    if isinstance(obj, str) and obj.startswith(_DATA_URL_PREFIX):
+        return hashlib.sha256(obj.encode("utf-8")).hexdigest()
+    return obj
+
+
+def get_response_cache_key(args: dict) -> str:
+    """Get the key of the request in the cache, the hash of its arguments in canonical JSON
+    (the same for the same model, messages and sampling arguments, whether it is streamed or not).
+    """
+    args = {k: v for k, v in args.items() if k not in _EXCLUDED_ARGUMENTS}
+    text = json.dumps(_replace_data_urls(args), sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import functools
+
+from litellm import get_model_info
+
+from pyqt_openai import (
+    HISTORY_DEFAULT_CONTEXT_WINDOW,
+    HISTORY_IMAGE_TOKENS,
+    HISTORY_MESSAGE_OVERHEAD_TOKENS,
+    TOKEN_DEFAULT_ENCODING,
+    TOKEN_ENCODING_CACHE_SIZE,
+)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Name of the "encoding" which estimates the tokens from the length when tiktoken is not installed
+ESTIMATE_ENCODING = "estimate"
+
+
+@functools.lru_cache(maxsize=TOKEN_ENCODING_CACHE_SIZE)
+def get_encoding(model: str):
+    """Get the tiktoken encoding of the model (built once per model),
+    TOKEN_DEFAULT_ENCODING for the models tiktoken doesn't know, None if tiktoken is not installed.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        # The models of the other providers have the prefix, e.g. "openai/gpt-4o"
+        return tiktoken.encoding_for_model(model.split("/")[-1])
+    except KeyError:
+        return tiktoken.get_encoding(TOKEN_DEFAULT_ENCODING)
+
+
+def get_encoding_name(model: str) -> str:
+    """Get the name of the tokenizer of the model, the stored token counts are kept per tokenizer."""
+    encoding = get_encoding(model)
+    return encoding.name if encoding is not None else ESTIMATE_ENCODING
+
+
+def count_tokens(text: str | None, model: str) -> int:
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is None:
+        # About 4 characters per token in English
+        return len(text) // 4 + 1
+    # The special tokens in the messages are counted as text, the API doesn't treat them specially either
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message: dict, content_tokens: int) -> int:
+    """Get the tokens of the message (a dict of the messages parameter) with the content_tokens of its text,
+    the overhead of the chat format and the estimate of its images.
+    """
+    content = message.get("content")
+    images = sum(1 for part in content if part.get("type") == "image_url") if isinstance(content, list) else 0
+    return HISTORY_MESSAGE_OVERHEAD_TOKENS + content_tokens + images * HISTORY_IMAGE_TOKENS
+
+
+@functools.lru_cache(maxsize=TOKEN_ENCODING_CACHE_SIZE)
+def get_context_window(model: str) -> int:
+    """Get the number of input tokens the model accepts, HISTORY_DEFAULT_CONTEXT_WINDOW if it is unknown."""
+    try:
+        info = get_model_info(model)
+    except Exception:
+        return HISTORY_DEFAULT_CONTEXT_WINDOW
+    return info.get("max_input_tokens") or info.get("max_tokens") or HISTORY_DEFAULT_CONTEXT_WINDOW
+
+
+def pack_history(messages: list[dict], token_counts: list[int], budget: int) -> list[dict]:
+    """Keep the newest messages whose tokens (token_counts, in the same order) fit in the budget,
+    the messages keep their order. A message which doesn't fit drops the older ones as well,
+    so the history has no gaps.
+    """
+    total = 0
+    start = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        total += token_counts[i]
+        if total > budget:
+            break
+        start = i
+    return messages[start:]
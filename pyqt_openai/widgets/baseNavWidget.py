@@ -3,10 +3,10 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 from qtpy.QtCore import QSortFilterProxyModel, Qt, Signal
-from qtpy.QtSql import QSqlQuery, QSqlTableModel
+from qtpy.QtSql import QSqlIndex, QSqlQuery, QSqlTableModel
 from qtpy.QtWidgets import QAbstractItemView, QLabel, QMessageBox, QStyledItemDelegate, QTableView, QWidget
 
-from pyqt_openai import ICON_CLOSE, ICON_DELETE
+from pyqt_openai import ICON_CLOSE, ICON_DELETE, ICON_HISTORY
 from pyqt_openai.globals import DB
 from pyqt_openai.lang.translations import LangClass
 from pyqt_openai.widgets.button import Button
@@ -80,6 +80,20 @@ class SqlTableModel(QSqlTableModel):
                 return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
         return super().flags(index)
 
+    def setTable(
+        self,
+        tableName: str,
+    ):
+        super().setTable(tableName)
+        # Views (e.g. the chat list) have no primary key, find the row to update by id
+        # (and is_archived, the archived threads are numbered apart)
+        if self.primaryKey().isEmpty() and self.fieldIndex("id") != -1:
+            index = QSqlIndex(tableName, "id")
+            for name in ["id", "is_archived"]:
+                if self.fieldIndex(name) != -1:
+                    index.append(self.record().field(name))
+            self.setPrimaryKey(index)
+
     def column_index_by_name(
         self,
         name: str,
@@ -105,6 +119,10 @@ class BaseNavWidget(QWidget):
     ):
         self._columns: list[str] = columns
         self._table_nm: str = table_nm
+        # Condition of the rows to show (e.g. leaving the deleted ones out)
+        self._filter: str = ""
+        # Ids of the rows deleted last, they can be restored until they are purged
+        self._deleted_ids: list = []
 
     def __initUi(self):
         imageGenerationHistoryLbl = QLabel()
@@ -124,12 +142,22 @@ class BaseNavWidget(QWidget):
         self._clearBtn.clicked.connect(self._clear)
         self._clearBtn.setToolTip(LangClass.TRANSLATIONS["Remove All"])
 
+        # TODO LANGUAGE
+        self._undoBtn: Button = Button()
+        self._undoBtn.setStyleAndIcon(ICON_HISTORY)
+        self._undoBtn.clicked.connect(self.__undoDelete)
+        self._undoBtn.setToolTip("Restore the deleted rows")
+        self._undoBtn.setVisible(False)
+
     def setModel(
         self,
         table_type: str = "chat",
+        filter: str = "",
     ):
+        self._filter = filter
         self._model: SqlTableModel = SqlTableModel(table_type, self)
         self._model.setTable(self._table_nm)
+        self._model.setFilter(self._filter)
         self._model.beforeUpdate.connect(self._updated)
 
         # Set the query to fetch columns in the defined order
@@ -137,9 +165,7 @@ class BaseNavWidget(QWidget):
         if table_type == "image":
             if self._columns.__contains__("data"):
                 self._columns.remove("data")
-            self._model.setQuery(
-                QSqlQuery(f"SELECT {','.join(self._columns)} FROM {self._table_nm}"),
-            )
+            self._model.setQuery(self._getSelectQuery())
 
         for i in range(len(self._columns)):
             self._model.setHeaderData(i, Qt.Orientation.Horizontal, self._columns[i])
@@ -188,6 +214,27 @@ class BaseNavWidget(QWidget):
         # Send updated signal
         self._model.updated.emit(r.value("id"), r.value("name"))
 
+    def _getSelectQuery(self, condition: str = "") -> QSqlQuery:
+        """Query of the columns to show, of the rows which match the filter and the condition."""
+        conditions = [c for c in [self._filter, condition] if c]
+        query = f"SELECT {','.join(self._columns)} FROM {self._table_nm}"
+        if conditions:
+            query += " WHERE " + " AND ".join(f"({c})" for c in conditions)
+        return QSqlQuery(query)
+
+    def _setDeleted(self, ids: list):
+        """Keep the ids of the (soft) deleted rows to be able to restore them."""
+        self._deleted_ids = list(ids)
+        self._undoBtn.setVisible(bool(self._deleted_ids))
+
+    def __undoDelete(self):
+        self._restoreDeleted(self._deleted_ids)
+        self._setDeleted([])
+        self._model.select()
+
+    def _restoreDeleted(self, ids: list):
+        pass
+
     def _delete(self):
         pass
 
@@ -215,6 +262,7 @@ class BaseNavWidget(QWidget):
                 DB.deleteThread()
             elif table_type == "image":
                 DB.removeImage()
+            self._setDeleted([])
             self._model.select()
 
     def setColumns(
@@ -225,11 +273,11 @@ class BaseNavWidget(QWidget):
         self._columns = columns
         self._model.clear()
         self._model.setTable(self._table_nm)
+        # clear() resets the filter as well
+        self._model.setFilter(self._filter)
         if table_type == "image":
             # Remove DATA for GUI performance
             if self._columns.__contains__("data"):
                 self._columns.remove("data")
-        self._model.setQuery(
-            QSqlQuery(f"SELECT {','.join(self._columns)} FROM {self._table_nm}"),
-        )
+        self._model.setQuery(self._getSelectQuery())
         self._model.select()
@@ -19,6 +19,8 @@ from pyqt_openai.widgets.notifier import NotifierWidget
 from pyqt_openai.widgets.thumbnailView import ThumbnailView
 
 if TYPE_CHECKING:
+    from collections.abc import Callable
+
     from qtpy.QtGui import QShowEvent
 
 
@@ -46,7 +48,7 @@ class ImageMainWidget(QWidget):
 
         self._viewWidget: ThumbnailView = ThumbnailView()
 
-        self._imageNavWidget.getContent.connect(lambda x: self._updateCenterWidget(1, x))
+        self._imageNavWidget.getContent.connect(lambda x, loader: self._updateCenterWidget(1, x, loader))
 
         self._historyBtn: Button = Button()
         self._historyBtn.setStyleAndIcon(ICON_HISTORY)
@@ -123,17 +125,19 @@ class ImageMainWidget(QWidget):
         self,
         idx: int,
         data: bytes | None = None,
+        full_content_loader: Callable[[], bytes | None] | None = None,
     ):
         """0 is home page, 1 is the main view
         :param idx: index
         :param data: data (bytes).
+        :param full_content_loader: function which loads the full image if data is a thumbnail.
         """
         # Set the current index
         self._centralWidget.setCurrentIndex(idx)
 
         # If the index is 1, set the content
         if idx == 1 and data is not None:
-            self._viewWidget.setContent(data)
+            self._viewWidget.setContent(data, full_content_loader)
 
     def showSecondaryToolBar(
         self,
@@ -163,7 +167,8 @@ class ImageMainWidget(QWidget):
         # save
         if self._rightSideBarWidget.isSavedEnabled():
             self._saveResultImage(result)
-        DB.insertImage(result)
+        image_id = DB.insertImage(result)
+        self._imageNavWidget.addThumbnail(image_id, result.data)
         self._imageNavWidget.refresh()
 
     def _saveResultImage(
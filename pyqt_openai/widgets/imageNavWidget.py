@@ -9,6 +9,7 @@ from qtpy.QtWidgets import QHBoxLayout, QLabel, QMessageBox, QStyledItemDelegate
 from pyqt_openai.globals import DB
 from pyqt_openai.lang.translations import LangClass
 from pyqt_openai.widgets.baseNavWidget import BaseNavWidget
+from pyqt_openai.widgets.thumbnailThread import ThumbnailThread
 
 if TYPE_CHECKING:
     from qtpy.QtCore import QModelIndex, QPersistentModelIndex
@@ -55,7 +56,8 @@ class SqlTableModel(QSqlTableModel):
 
 
 class ImageNavWidget(BaseNavWidget):
-    getContent = Signal(bytes)
+    # data to show, function which loads the full image if data is only a thumbnail (None otherwise)
+    getContent = Signal(bytes, object)
 
     def __init__(
         self,
@@ -64,10 +66,15 @@ class ImageNavWidget(BaseNavWidget):
         parent: QWidget | None = None,
     ):
         super().__init__(columns, table_nm, parent)
+        self.__initVal()
         self.__initUi()
 
+    def __initVal(self):
+        self.__thumbnailThread = ThumbnailThread(self)
+
     def __initUi(self):
-        self.setModel(table_type="image")
+        # The soft deleted images stay in the table until they are purged
+        self.setModel(table_type="image", filter="deleted_dt IS NULL")
 
         imageGenerationHistoryLbl: QLabel = QLabel()
         imageGenerationHistoryLbl.setText(LangClass.TRANSLATIONS["History"])
@@ -75,6 +82,7 @@ class ImageNavWidget(BaseNavWidget):
         lay = QHBoxLayout()
         lay.addWidget(self._searchBar)
         lay.addWidget(self._delBtn)
+        lay.addWidget(self._undoBtn)
         lay.addWidget(self._clearBtn)
         lay.setContentsMargins(0, 0, 0, 0)
 
@@ -103,6 +111,10 @@ class ImageNavWidget(BaseNavWidget):
     def refresh(self):
         self._model.select()
 
+    def addThumbnail(self, image_id: int, data: bytes | None = None):
+        """Generate the thumbnail of the image in the background."""
+        self.__thumbnailThread.addImage(image_id, data)
+
     def __clicked(
         self,
         idx: QModelIndex,
@@ -113,6 +125,12 @@ class ImageNavWidget(BaseNavWidget):
         # get the primary key value of the row
         cur_id: int = self._model.record(source_idx.row()).value("id")
 
+        # Show the thumbnail if there is, the full image is loaded only when it is needed (zoom, copy, save)
+        thumbnail = DB.selectImageThumbnail(cur_id)
+        if thumbnail and thumbnail["data"]:
+            self.getContent.emit(thumbnail["data"], lambda: self.__loadImage(cur_id))
+            return
+
         # Get data from DB id
         data: bytes | str = DB.selectCertainImage(cur_id)["data"]
         if data:
@@ -128,7 +146,9 @@ class ImageNavWidget(BaseNavWidget):
                 )
             else:
                 data = QByteArray(data).data()
-                self.getContent.emit(data)
+                self.getContent.emit(data, None)
+                # Images stored before the thumbnails were introduced
+                self.addThumbnail(cur_id, data)
         else:
             QMessageBox.critical(
                 None,  # pyright: ignore[reportArgumentType]
@@ -138,6 +158,10 @@ class ImageNavWidget(BaseNavWidget):
                 QMessageBox.StandardButton.No,
             )
 
+    def __loadImage(self, image_id: int) -> bytes | None:
+        image = DB.selectCertainImage(image_id)
+        return image["data"] if image else None
+
     def _search(
         self,
         text: str,
@@ -150,12 +174,25 @@ class ImageNavWidget(BaseNavWidget):
 
     def _delete(self):
         idx_s: list[QModelIndex] = self._tableView.selectedIndexes()
-        for idx in idx_s:
-            idx = idx.siblingAtColumn(0)
-            id = self._model.data(idx, role=Qt.ItemDataRole.DisplayRole)
-            DB.removeImage(id)
+        # Every cell of the selected rows is selected
+        ids = list(
+            {
+                self._model.data(
+                    self._proxyModel.mapToSource(idx).siblingAtColumn(0),
+                    role=Qt.ItemDataRole.DisplayRole,
+                )
+                for idx in idx_s
+            },
+        )
+        if not ids:
+            return
+        is_restorable = DB.removeImages(ids)
+        self._setDeleted(ids if is_restorable else [])
         self._model.select()
 
+    def _restoreDeleted(self, ids: list):
+        DB.restoreRemovedImages(ids)
+
     def setColumns(
         self,
         columns: list[str],
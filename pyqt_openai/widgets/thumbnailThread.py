@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import queue
+
+from qtpy.QtCore import QBuffer, QByteArray, QIODevice, QThread, Qt, Signal
+from qtpy.QtGui import QImage
+
+from pyqt_openai import IMAGE_THUMBNAIL_FORMAT, IMAGE_THUMBNAIL_QUALITY, IMAGE_THUMBNAIL_SIZE
+from pyqt_openai.globals import DB
+
+
+class ThumbnailThread(QThread):
+    """Generate the thumbnails of the images in the background and store them in the DB.
+    Images are queued with ``addImage``, the thread starts by itself and stops when the queue is empty.
+    """
+
+    thumbnailGenerated = Signal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.__queue: queue.Queue[tuple[int, bytes | None]] = queue.Queue()
+        # An image could be queued right after run() found the queue empty
+        self.finished.connect(self.__startIfQueued)
+
+    def addImage(self, image_id: int, data: bytes | None = None):
+        """Queue the image, if data is None it is loaded from the DB."""
+        self.__queue.put((image_id, data))
+        if not self.isRunning():
+            self.start()
+
+    def __startIfQueued(self):
+        if not self.__queue.empty():
+            self.start()
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    image_id, data = self.__queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self.__generate(image_id, data)
+                except Exception as e:
+                    print(f"Failed to generate the thumbnail of the image {image_id}: {e}")
+        finally:
+            DB.releaseConnection()
+
+    def __generate(self, image_id: int, data: bytes | None):
+        if data is None:
+            image = DB.selectCertainImage(image_id)
+            data = image["data"] if image else None
+        if not isinstance(data, (bytes, bytearray)):
+            return
+
+        # QImage (unlike QPixmap) can be used outside of the GUI thread
+        image = QImage.fromData(data)
+        if image.isNull():
+            return
+        if image.width() > IMAGE_THUMBNAIL_SIZE or image.height() > IMAGE_THUMBNAIL_SIZE:
+            image = image.scaled(
+                IMAGE_THUMBNAIL_SIZE,
+                IMAGE_THUMBNAIL_SIZE,
+                Qt.AspectRatioMode.KeepAspectRatio,
+                Qt.TransformationMode.SmoothTransformation,
+            )
+
+        byte_array = QByteArray()
+        buffer = QBuffer(byte_array)
+        buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+        # JPEG can't keep the transparency
+        image.save(buffer, "PNG" if image.hasAlphaChannel() else IMAGE_THUMBNAIL_FORMAT, IMAGE_THUMBNAIL_QUALITY)
+        buffer.close()
+
+        DB.insertImageThumbnail(image_id, byte_array.data(), image.width(), image.height())
+        self.thumbnailGenerated.emit(image_id)
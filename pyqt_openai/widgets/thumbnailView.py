@@ -13,6 +13,8 @@ from pyqt_openai.lang.translations import LangClass
 from pyqt_openai.widgets.button import Button
 
 if TYPE_CHECKING:
+    from collections.abc import Callable
+
     from qtpy.QtCore import QEvent
     from qtpy.QtGui import QEnterEvent, QMouseEvent, QResizeEvent, QWheelEvent
 
@@ -30,6 +32,8 @@ class ThumbnailView(QGraphicsView):
         self._p: QPixmap = QPixmap()
         self._item: QGraphicsPixmapItem = QGraphicsPixmapItem()
         self.__aspectRatioMode: Qt.AspectRatioMode = Qt.AspectRatioMode.KeepAspectRatio
+        # Loads the full image when the content is only a thumbnail of it
+        self.__fullContentLoader: Callable[[], bytes | None] | None = None
 
         self.__factor: float = 1.1  # Zoom factor
 
@@ -95,6 +99,7 @@ class ThumbnailView(QGraphicsView):
         self,
         filename: str,
     ):
+        self.__fullContentLoader = None
         self._scene = QGraphicsScene()
         self._p = QPixmap(filename)
         self.__refreshSceneAndView()
@@ -102,15 +107,32 @@ class ThumbnailView(QGraphicsView):
     def setContent(
         self,
         content: bytes,
+        full_content_loader: Callable[[], bytes | None] | None = None,
     ):
+        """Set the image to show.
+        If content is a thumbnail, give full_content_loader as well,
+        the full image is loaded with it only when it is zoomed, copied or saved.
+        """
+        self.__fullContentLoader = full_content_loader
         self._scene = QGraphicsScene()
         self._p.loadFromData(content)
         self.__refreshSceneAndView()
 
+    def __loadFullContent(self):
+        if self.__fullContentLoader is None:
+            return
+        content = self.__fullContentLoader()
+        self.__fullContentLoader = None
+        if content:
+            self._scene = QGraphicsScene()
+            self._p.loadFromData(content)
+            self.__refreshSceneAndView()
+
     def setPixmap(
         self,
         pixmap: QPixmap,
     ):
+        self.__fullContentLoader = None
         self._scene = QGraphicsScene()
         self._p = pixmap
         self.__refreshSceneAndView()
@@ -122,6 +144,7 @@ class ThumbnailView(QGraphicsView):
         self.__aspectRatioMode = mode
 
     def __copy(self):
+        self.__loadFullContent()
         QApplication.clipboard().setPixmap(self._p)
 
     def __save(self):
@@ -134,12 +157,15 @@ class ThumbnailView(QGraphicsView):
         if filename[0] and filename[0].strip():
             filename = filename[0]
             if filename:
+                self.__loadFullContent()
                 self._p.save(filename)
 
     def __zoomIn(self):
+        self.__loadFullContent()
         self.scale(self.__factor, self.__factor)
 
     def __zoomOut(self):
+        self.__loadFullContent()
         self.scale(1 / self.__factor, 1 / self.__factor)
 
     def enterEvent(